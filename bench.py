@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import sqlite3
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from sqlalchemy.engine.url import URL
+import rc
+import sql
+from output import DirectorySink
+from reflect import reflect
+from typemap import TypeMap
+
+
+# Choice strings in the proportions they show up in real dictionaries:
+# a few shared enumerations repeated many times plus a long tail.
+SHARED_CHOICES = (
+    ('radio', '1, Yes | 0, No'),
+    ('radio', '1, Yes | 0, No | 99, Unknown'),
+    ('dropdown', '1, Never | 2, Rarely | 3, Sometimes | 4, Often | 5, Always'),
+    ('checkbox', '1, Red | 2, Green | 3, Blue'),
+    ('calc', 'round(([weight] / ([height] * [height])) * 10000, 1)'),
+    ('slider', 'Not at all | Somewhat | Very much'),
+)
+
+
+# Column types of the synthetic tables, cycled through.
+SYNTHETIC_TYPES = (
+    'integer',
+    'varchar(50)',
+    'numeric(10, 2)',
+    'date',
+    'text',
+    'timestamp',
+    'boolean',
+    'float',
+)
+
+
+# Subcommands whose cold start is timed, run with --help so only the
+# imports and argument parsing are measured.
+STARTUP_COMMANDS = (
+    ('main', ['--help']),
+    ('sql', ['sql', '--help']),
+    ('redcap csv', ['redcap', 'csv', '--help']),
+    ('redcap dball', ['redcap', 'dball', '--help']),
+    ('redcap apibatch', ['redcap', 'apibatch', '--help']),
+    ('diff', ['diff', '--help']),
+    ('ddl', ['ddl', '--help']),
+    ('graph', ['graph', '--help']),
+    ('store', ['store', '--help']),
+    ('serve', ['serve', '--help']),
+)
+
+# Packages worth reporting when a subcommand loads them.
+HEAVY_PACKAGES = (
+    'sqlalchemy',
+    'redcap',
+    'requests',
+    'psycopg2',
+    'cx_Oracle',
+    'pymysql',
+    'MySQLdb',
+)
+
+# Runs main.py with the given arguments and prints the heavy packages that
+# were loaded.
+STARTUP_PROBE = '''
+import os, sys, json, runpy
+path, argv, heavy = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3:]
+sys.argv = [path] + argv
+sys.path.insert(0, os.path.dirname(path))
+try:
+    runpy.run_path(path, run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps(sorted({m.split('.')[0] for m in sys.modules} & set(heavy))),
+      file=sys.stderr)
+'''
+
+
+def synthetic_fields(n, seed=0, per_form=50):
+    "Yields `n` synthetic REDCap field records."
+    rand = random.Random(seed)
+
+    for i in range(n):
+        r = rand.random()
+
+        if r < 0.5:
+            field_type, choices = 'text', ''
+        elif r < 0.9:
+            field_type, choices = rand.choice(SHARED_CHOICES)
+        else:
+            field_type = 'dropdown'
+            choices = ' | '.join('{}, Option {} of {}'.format(j, j, i)
+                                 for j in range(rand.randint(2, 12)))
+
+        yield {
+            'field_name': 'field_{}'.format(i),
+            'form_name': 'form_{}'.format(i // per_form),
+            'section_header': 'Section' if i % 20 == 0 else '',
+            'field_type': field_type,
+            'field_label': 'Field {}'.format(i),
+            'select_choices_or_calculations': choices,
+            'field_note': 'Note' if i % 3 == 0 else '',
+            'text_validation_type_or_show_slider_number': '',
+        }
+
+
+def synthetic_dictionary(path, forms, per_form, seed=0):
+    "Writes a REDCap data dictionary of `forms` forms of `per_form` fields."
+    with open(path, 'w', encoding='latin-1', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(rc.redcap_fields)
+
+        for field in synthetic_fields(forms * per_form, seed, per_form):
+            w.writerow([field.get(k, '') for k in rc.redcap_fields])
+
+
+def synthetic_database(path, tables, columns, seed=0):
+    """Creates a SQLite database of `tables` tables of `columns` columns.
+
+    Every table has a primary key, a unique column and an index, and all
+    but the first refer to a random earlier table.
+    """
+    rand = random.Random(seed)
+    conn = sqlite3.connect(path)
+
+    for i in range(tables):
+        defs = [
+            'id integer primary key',
+            'code varchar(20) not null unique',
+        ]
+
+        for j in range(columns):
+            defs.append('c_{} {}'.format(
+                j, SYNTHETIC_TYPES[j % len(SYNTHETIC_TYPES)]))
+
+        if i:
+            defs.append('parent_id integer references t_{}(id)'.format(
+                rand.randrange(i)))
+
+        conn.execute('create table t_{} ({})'.format(i, ', '.join(defs)))
+
+        if columns > 1:
+            conn.execute('create index ix_t_{0} on t_{0} (c_0, c_1)'
+                         .format(i))
+
+    conn.commit()
+    conn.close()
+
+
+def legacy_parse_choices(s):
+    "The uncached choice parser, kept as a baseline."
+    choices = []
+
+    if not s:
+        return
+
+    for t in s.split('|'):
+        c = t.split(',', 1)
+
+        if len(c) < 2:
+            return
+
+        choices.append(c[1].strip())
+
+    return choices
+
+
+def legacy_get_field_description(field):
+    "The uncached description builder, kept as a baseline."
+    toks = []
+
+    if field['field_note']:
+        toks.append(field['field_note'])
+
+    if field['section_header']:
+        toks.append('Under section {}.'.format(field['section_header']))
+
+    choices = legacy_parse_choices(field['select_choices_or_calculations'])
+
+    if choices:
+        toks.append('Choices include: {}'.format(', '.join(choices)))
+
+    return ' '.join(toks)
+
+
+def clear_caches():
+    rc.parse_choices.cache_clear()
+    rc.parse_slider.cache_clear()
+    rc.describe_choices.cache_clear()
+
+
+def best_of(func, repeat):
+    "Returns the best wall time of calling `func` `repeat` times."
+    times = []
+
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def timed(func):
+    "Returns the result of calling `func` and the wall time it took."
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def best_phases(func, repeat):
+    """Calls `func` `repeat` times and returns the best time of each phase
+    in the dicts of (phase, seconds) it returns."""
+    phases = {}
+
+    for _ in range(repeat):
+        clear_caches()
+
+        for phase, seconds in func().items():
+            phases[phase] = min(seconds, phases.get(phase, seconds))
+
+    return phases
+
+
+def count_files(path):
+    "Returns the number of files under a directory."
+    return sum(len(files) for _, _, files in os.walk(path))
+
+
+def peak_rss():
+    "Returns the peak resident set size of the process in kilobytes."
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes rather than kilobytes.
+    if sys.platform == 'darwin':
+        rss //= 1024
+
+    return rss
+
+
+def environment():
+    "Returns details identifying the code and platform of a run."
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.utcnow().isoformat(),
+    }
+
+
+def bench_sql(tables, columns, workers, repeat):
+    """Times the reflection, transformation and writing of a synthetic
+    SQLite database, as well as sql.generate end to end."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.sqlite')
+        synthetic_database(path, tables, columns)
+
+        engine = sql.connect(URL('sqlite', database=path), workers)
+        outdir = os.path.join(tmp, 'out')
+
+        def run():
+            records, reflect_seconds = timed(lambda: [
+                future.result()
+                for _, future in reflect(engine, workers=workers)])
+
+            typemap = TypeMap()
+
+            files, transform_seconds = timed(lambda: [
+                sql.table_files('bench', 'v1', info, typemap)
+                for info in records])
+
+            def write():
+                with DirectorySink(outdir) as sink:
+                    for batch in files:
+                        sink.write(batch)
+
+            _, write_seconds = timed(write)
+
+            def generate():
+                with DirectorySink(outdir) as sink:
+                    sql.generate(engine, 'bench', 'v1', sink, workers=workers)
+
+            _, total_seconds = timed(generate)
+
+            return {
+                'reflect': reflect_seconds,
+                'transform': transform_seconds,
+                'write': write_seconds,
+                'total': total_seconds,
+            }
+
+        phases = best_phases(run, repeat)
+        nfiles = count_files(outdir)
+
+    return {
+        'benchmark': 'sql',
+        'parameters': {
+            'tables': tables,
+            'columns': columns,
+            'workers': workers,
+            'repeat': repeat,
+        },
+        'seconds': phases,
+        'tables_per_second': tables / phases['total'],
+        'files': nfiles,
+        'peak_rss_kb': peak_rss(),
+    }
+
+
+def bench_redcap(forms, per_form, repeat):
+    """Times the reading, transformation and writing of a synthetic REDCap
+    data dictionary, as well as rc.generate end to end."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.csv')
+        synthetic_dictionary(path, forms, per_form)
+
+        outdir = os.path.join(tmp, 'out')
+
+        def run():
+            fields, read_seconds = timed(
+                lambda: list(rc.read_dictionary(path)))
+
+            tables, transform_seconds = timed(lambda: [
+                (table, rc.form_data('bench', 'v1', table, fields)[0])
+                for table, fields in rc.group_forms(fields)])
+
+            def write():
+                with DirectorySink(outdir) as sink:
+                    for table, data in tables:
+                        rc.generate_table_files(sink, 'bench', 'v1', table,
+                                                data)
+
+            _, write_seconds = timed(write)
+
+            clear_caches()
+
+            def generate():
+                with DirectorySink(outdir) as sink:
+                    rc.generate(rc.read_dictionary(path), 'bench', 'v1', sink)
+
+            _, total_seconds = timed(generate)
+
+            return {
+                'read': read_seconds,
+                'transform': transform_seconds,
+                'write': write_seconds,
+                'total': total_seconds,
+            }
+
+        phases = best_phases(run, repeat)
+        nfiles = count_files(outdir)
+
+    return {
+        'benchmark': 'redcap',
+        'parameters': {
+            'forms': forms,
+            'fields_per_form': per_form,
+            'repeat': repeat,
+        },
+        'seconds': phases,
+        'fields_per_second': forms * per_form / phases['total'],
+        'files': nfiles,
+        'peak_rss_kb': peak_rss(),
+    }
+
+
+def run_time(argv):
+    "Returns the wall time of running a command to completion."
+    start = time.perf_counter()
+    subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def bench_startup(repeat):
+    """Times the cold start of each subcommand in a fresh interpreter and
+    reports the heavy packages it loads."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'main.py')
+
+    def timings(argv):
+        times = sorted(run_time(argv) for _ in range(repeat))
+
+        return {
+            'best': times[0],
+            'median': times[len(times) // 2],
+        }
+
+    results = {
+        'benchmark': 'startup',
+        'parameters': {
+            'repeat': repeat,
+        },
+        'interpreter': timings([sys.executable, '-c', 'pass']),
+        'commands': {},
+    }
+
+    for name, argv in STARTUP_COMMANDS:
+        entry = timings([sys.executable, path] + argv)
+
+        probe = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE, path, json.dumps(argv),
+             *HEAVY_PACKAGES],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        lines = probe.stderr.decode('utf8').strip().splitlines()
+        entry['loaded'] = json.loads(lines[-1]) if lines else None
+
+        results['commands'][name] = entry
+
+    return results
+
+
+def bench_choices(n, repeat):
+    "Compares description throughput of the legacy and cached parsers."
+    fields = list(synthetic_fields(n))
+    records = [rc.field_from_dict(f) for f in fields]
+
+    def legacy():
+        for f in fields:
+            legacy_get_field_description(f)
+
+    def cached():
+        for f in records:
+            rc.get_field_description(f)
+
+    results = {}
+
+    for name, func in (('legacy', legacy), ('cached', cached)):
+        seconds = best_of(func, repeat)
+
+        results[name] = {
+            'seconds': seconds,
+            'fields_per_second': n / seconds,
+        }
+
+    results['speedup'] = results['legacy']['seconds'] / \
+        results['cached']['seconds']
+    results['cache'] = rc.describe_choices.cache_info()._asdict()
+
+    return results
+
+
+def main(argv=None):
+    usage = """Data Models Generator Benchmarks
+
+    Usage:
+        bench.py choices [--fields=N] [--repeat=N] [--output=FILE]
+        bench.py sql [--tables=N] [--columns=N] [--workers=NUM] [--repeat=N] [--output=FILE]
+        bench.py redcap [--forms=N] [--fields-per-form=N] [--repeat=N] [--output=FILE]
+        bench.py startup [--repeat=N] [--output=FILE]
+
+    The sql and redcap benchmarks build a synthetic SQLite database or data
+    dictionary in a temporary directory and time each phase separately.
+    The startup benchmark times the cold start of each main.py subcommand.
+
+    Options:
+        -h --help       Show this screen.
+        --fields=N      Number of synthetic REDCap fields [default: 100000].
+        --tables=N      Number of synthetic tables [default: 500].
+        --columns=N     Number of columns per synthetic table besides the keys [default: 20].
+        --workers=NUM   Number of concurrent reflection workers [default: 4].
+        --forms=N       Number of synthetic REDCap forms [default: 500].
+        --fields-per-form=N     Number of fields per synthetic REDCap form [default: 50].
+        --repeat=N      Number of runs, the best is reported [default: 5].
+        --output=FILE   Also save the results as JSON to compare runs across commits.
+
+    """  # noqa
+
+    from docopt import docopt
+
+    args = docopt(usage, argv=argv, version='0.1')
+
+    repeat = int(args['--repeat'])
+
+    if args['choices']:
+        results = bench_choices(int(args['--fields']), repeat)
+    elif args['sql']:
+        results = bench_sql(int(args['--tables']), int(args['--columns']),
+                            int(args['--workers']), repeat)
+    elif args['redcap']:
+        results = bench_redcap(int(args['--forms']),
+                               int(args['--fields-per-form']), repeat)
+    elif args['startup']:
+        results = bench_startup(repeat)
+
+    results['environment'] = environment()
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -62,3 +62,28 @@ REFERENCE_COLUMNS = (
     'ref_field',
     'name',
 )
+
+PROFILE_COLUMNS = (
+    'model',
+    'version',
+    'table',
+    'field',
+    'sampled',
+    'null_fraction',
+    'max_length',
+    'min',
+    'max',
+    'distinct',
+)
+
+# Column layouts by entity, named after the file each is written to.
+ENTITIES = (
+    ('models', MODEL_COLUMNS),
+    ('tables', TABLE_COLUMNS),
+    ('fields', FIELD_COLUMNS),
+    ('schema', SCHEMA_COLUMNS),
+    ('constraints', CONSTRAINT_COLUMNS),
+    ('indexes', INDEX_COLUMNS),
+    ('references', REFERENCE_COLUMNS),
+    ('profile', PROFILE_COLUMNS),
+)
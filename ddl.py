@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from collections import OrderedDict
+from sqlalchemy import MetaData, Table, Column, Index, PrimaryKeyConstraint, \
+    UniqueConstraint, ForeignKeyConstraint
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.schema import CreateTable, CreateIndex, AddConstraint
+from typemap import model_type
+from diff import load
+from graph import Graph
+
+
+# Bulk-load commands by dialect for a CSV data file with a header line.
+# Oracle has no such statement, so the SQL*Loader control file is given.
+LOADS = {
+    'postgresql': "\\copy {table} ({columns}) FROM '{path}' "
+                  "WITH (FORMAT csv, HEADER true)",
+    'mysql': "LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table} "
+             "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+             "IGNORE 1 LINES ({columns});",
+    'sqlite': '.import --csv --skip 1 {path} {table}',
+    'oracle': '-- sqlldr direct=true control={name}.ctl\n'
+              '--   OPTIONS (SKIP=1)\n'
+              "--   LOAD DATA INFILE '{path}' APPEND INTO TABLE {table}\n"
+              "--   FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"'\n"
+              '--   TRAILING NULLCOLS ({columns})',
+}
+
+
+def get_dialect(name):
+    "Returns a dialect instance by engine name, e.g. postgresql."
+    return make_url('{}://'.format(name)).get_dialect()()
+
+
+def by_table(rows):
+    "Groups rows by table, keeping their order."
+    tables = OrderedDict()
+
+    for row in rows:
+        tables.setdefault(row['table'], []).append(row)
+
+    return tables
+
+
+def by_name(rows, *keys):
+    "Groups rows by the values of the keys, keeping their order."
+    groups = OrderedDict()
+
+    for row in rows:
+        groups.setdefault(tuple(row[k] for k in keys), []).append(row)
+
+    return groups
+
+
+def by_constraint(rows, *keys):
+    """Groups the rows of constraints by name and the other keys, keeping
+    their order, as (name, key values, rows) triples.
+
+    Unnamed constraints, such as inline ones reflected from SQLite, cannot
+    be told apart, so each of their rows is a constraint of its own.
+    """
+    groups = []
+
+    for key, group in by_name(rows, 'name', *keys).items():
+        if key[0]:
+            groups.append((key[0], key[1:], group))
+        else:
+            groups.extend((None, key[1:], [row]) for row in group)
+
+    return groups
+
+
+def _int(value):
+    return int(value) if value not in (None, '') else None
+
+
+def _name(value):
+    return value or None
+
+
+def check_fields(table, kind, name, rows, columns):
+    "Raises a ValueError if the rows of a key or index name unknown fields."
+    for row in rows:
+        if row['field'] not in columns:
+            raise ValueError('{}: {} {} refers to unknown field {}'.format(
+                table, kind, name, row['field']))
+
+
+def split_name(table):
+    "Returns the schema and name of a table, qualified if it has a schema."
+    if '.' in table:
+        return table.split('.', 1)
+
+    return None, table
+
+
+class Model:
+    """The tables of a generated model as SQLAlchemy schema objects.
+
+    The unique and foreign key constraints are marked to be added with
+    ALTER TABLE, so they are only part of CREATE TABLE for dialects that
+    cannot alter tables. They are also listed along with the indexes so
+    they can be created after loading.
+
+    Raises a ValueError if a key or index refers to a field the table does
+    not have.
+    """
+    def __init__(self, entities):
+        self.metadata = MetaData()
+        self.tables = OrderedDict()
+        self.uniques = []
+        self.indexes = []
+        self.foreign_keys = []
+        self.skipped = []
+
+        fields = by_table(entities.get('schema', ()))
+        constraints = by_table(entities.get('constraints', ()))
+        indexes = by_table(entities.get('indexes', ()))
+        references = by_table(entities.get('references', ()))
+
+        # Only references between tables of the model order their creation.
+        self.graph = Graph(fields)
+
+        for table, rows in references.items():
+            for row in rows:
+                if table in fields and row['ref_table'] in fields:
+                    self.graph.add(table, row['ref_table'])
+
+        for table in self.graph.order():
+            self.add_table(table, fields[table], constraints.get(table, ()))
+
+        for table, rows in constraints.items():
+            if table in self.tables:
+                self.add_uniques(table, rows)
+
+        for table, rows in references.items():
+            if table in self.tables:
+                self.add_foreign_keys(table, rows)
+
+        for table, rows in indexes.items():
+            if table in self.tables:
+                self.add_indexes(table, rows, constraints.get(table, ()))
+
+    def add_table(self, name, fields, constraints):
+        not_null = {row['field'] for row in constraints
+                    if row['type'] == 'not null'}
+        pk = [row for row in constraints if row['type'] == 'primary key']
+
+        columns = [Column(row['field'],
+                          model_type(row['type'],
+                                     _int(row['length']),
+                                     _int(row['precision']),
+                                     _int(row['scale'])),
+                          nullable=row['field'] not in not_null,
+                          autoincrement=False)
+                   for row in fields]
+
+        if pk:
+            check_fields(name, 'primary key', pk[0]['name'], pk,
+                         {row['field'] for row in fields})
+            columns.append(PrimaryKeyConstraint(
+                *[row['field'] for row in pk], name=_name(pk[0]['name'])))
+
+        schema, table = split_name(name)
+        self.tables[name] = Table(table, self.metadata, *columns,
+                                  schema=schema)
+
+    def add_uniques(self, table, rows):
+        rows = [row for row in rows if row['type'] == 'unique']
+
+        for name, _, group in by_constraint(rows):
+            check_fields(table, 'unique constraint', name, group,
+                         self.tables[table].c)
+            uniq = UniqueConstraint(*[row['field'] for row in group],
+                                    name=_name(name))
+
+            # CREATE TABLE leaves out constraints marked like foreign keys
+            # that are added with ALTER TABLE.
+            uniq.use_alter = True
+
+            self.tables[table].append_constraint(uniq)
+            self.uniques.append(uniq)
+
+    def add_foreign_keys(self, table, rows):
+        for name, (ref_table,), group in by_constraint(rows, 'ref_table'):
+            ref = self.tables.get(ref_table)
+
+            if ref is None or \
+                    any(row['ref_field'] not in ref.c for row in group):
+                self.skipped.append((table, name or '', ref_table))
+                continue
+
+            fk = ForeignKeyConstraint(
+                [row['field'] for row in group],
+                [ref.c[row['ref_field']] for row in group],
+                name=_name(name), use_alter=True)
+            self.tables[table].append_constraint(fk)
+            self.foreign_keys.append(fk)
+
+    def add_indexes(self, table, rows, constraints):
+        # Indexes backing a key are created with their constraint.
+        keys = {row['name'] for row in constraints if row['name']}
+
+        for (name,), group in by_name(rows, 'name').items():
+            if name in keys:
+                continue
+
+            columns = self.tables[table].c
+            check_fields(table, 'index', name, group, columns)
+            self.indexes.append(Index(name, *[columns[row['field']]
+                                              for row in group]))
+
+
+def statements(model, dialect, data=None):
+    """Yields (section, statement) pairs creating the model, in the order
+    tables, loads, indexes then constraints.
+
+    Tables are created and loaded in reference order. The unique
+    constraints, indexes and foreign keys are created once the data is
+    loaded, unless the dialect cannot add constraints, in which case they
+    are part of the table. Loads of the <table>.csv files of the `data`
+    directory are only included if it is given.
+    """
+    preparer = dialect.identifier_preparer
+
+    def compile(element):
+        return str(element.compile(dialect=dialect)).strip() + ';'
+
+    for table in model.tables.values():
+        yield 'tables', compile(CreateTable(table))
+
+    load = LOADS.get(dialect.name)
+
+    if data is not None and load is not None:
+        for key, table in model.tables.items():
+            yield 'loads', load.format(
+                name=key,
+                table=preparer.format_table(table),
+                columns=', '.join(preparer.quote(c.name)
+                                  for c in table.columns),
+                path=os.path.join(data, '{}.csv'.format(key)))
+
+    for index in model.indexes:
+        yield 'indexes', compile(CreateIndex(index))
+
+    if dialect.supports_alter:
+        for constraint in model.uniques + model.foreign_keys:
+            yield 'constraints', compile(AddConstraint(constraint))
+
+
+SECTIONS = OrderedDict((
+    ('tables', 'Tables, in reference order.'),
+    ('loads', 'Bulk loads, in reference order.'),
+    ('indexes', 'Indexes, created after loading.'),
+    ('constraints', 'Unique and foreign key constraints, added after loading.'),  # noqa
+))
+
+
+def write_script(model, dialect, file, data=None):
+    "Writes the statements as a script with a comment per section."
+    section = None
+
+    for name, statement in statements(model, dialect, data):
+        if name != section:
+            file.write('-- {}\n\n'.format(SECTIONS[name]))
+            section = name
+
+        file.write(statement)
+        file.write('\n\n')
+
+
+def main(argv=None):
+    usage = """Data Model DDL Generator
+
+    Usage:
+        ddl <model> <engine> [--output=FILE] [--data=DIR]
+
+    Writes a script creating the tables of a generated model in a database
+    of the given engine, e.g. postgresql, mysql, oracle or sqlite. The model
+    is an output directory, archive or bundle in any output format, or a
+    database URL which is reflected like the sql command does.
+
+    Tables are created without their unique constraints, indexes and
+    foreign keys, which are created last so bulk loads are not slowed down
+    by them. Tables are created and loaded so that referred tables come
+    first. Column defaults are not included.
+
+    Options:
+        -h --help       Show this screen.
+        --output=FILE   Write the script to a file rather than stdout.
+        --data=DIR      Directory of <table>.csv data files with a header line to bulk load after creating the tables, with COPY for postgresql, LOAD DATA for mysql, .import for sqlite and a SQL*Loader control file for oracle.
+
+    """  # noqa
+
+    from docopt import docopt
+
+    args = docopt(usage, argv=argv, version='0.1')
+
+    try:
+        dialect = get_dialect(args['<engine>'])
+    except Exception:
+        print('error: unknown engine {}'.format(args['<engine>']),
+              file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        model = Model(load(args['<model>']))
+    except Exception as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+    for table, name, ref_table in model.skipped:
+        print('warning: {}: skipped foreign key {} to {}, which is not in '
+              'the model'.format(table, name, ref_table), file=sys.stderr)
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            write_script(model, dialect, f, args['--data'])
+    else:
+        write_script(model, dialect, sys.stdout, args['--data'])
+
+
+if __name__ == '__main__':
+    main()
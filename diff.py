@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import csv
+import json
+import tarfile
+import zipfile
+from collections import defaultdict
+from constants import ENTITIES
+from output import MemorySink, BundleSink, read_archive, read_jsonl, \
+    read_sqlite
+
+
+# Columns identifying a row of each entity and whether several rows may
+# share a key, such as the fields of an index. The remaining columns, other
+# than the model and version, are compared, and rows sharing a key are
+# compared as a sequence and reported as a list.
+KEYS = (
+    ('tables', ('table',), False),
+    ('fields', ('table', 'field'), False),
+    ('schema', ('table', 'field'), False),
+    ('constraints', ('table', 'field', 'type'), True),
+    ('indexes', ('table', 'name'), True),
+    ('references', ('table', 'field'), True),
+)
+
+IGNORED = ('model', 'version')
+
+
+def read_files(path):
+    "Yields the (path, data) pairs of an output tree, archive or bundle."
+    if os.path.isdir(path):
+        for dirpath, _, names in os.walk(path):
+            for name in names:
+                fn = os.path.join(dirpath, name)
+
+                with open(fn, 'rb') as f:
+                    yield os.path.relpath(fn, path), f.read()
+
+    elif zipfile.is_zipfile(path) or tarfile.is_tarfile(path):
+        yield from read_archive(path).items()
+
+    else:
+        with open(path, 'rb') as f:
+            yield os.path.basename(path), f.read()
+
+
+def load_files(files):
+    """Returns the rows by entity, as dicts of strings, of the files of an
+    output in any of the output formats."""
+    headers = dict(ENTITIES)
+    entities = defaultdict(list)
+
+    def add(entity, header, rows):
+        for row in rows:
+            entities[entity].append({
+                c: '' if v is None else str(v) for c, v in zip(header, row)})
+
+    for path, data in files:
+        name = os.path.basename(path)
+
+        if name == BundleSink.FILES['jsonl']:
+            for entity, rows in read_jsonl(data, headers).items():
+                add(entity, headers[entity], rows)
+
+        elif name == BundleSink.FILES['sqlite']:
+            for entity, rows in read_sqlite(data).items():
+                add(entity, headers[entity], rows)
+
+        elif name.endswith('.csv') and name[:-4] in headers:
+            reader = csv.reader(io.StringIO(data.decode('utf8')))
+            add(name[:-4], next(reader), reader)
+
+    return entities
+
+
+def load_database(url, workers=None):
+    "Reflects a database as sql.generate does and returns its rows."
+    from sql import generate, connect
+    from sqlalchemy.engine.url import make_url
+
+    workers = workers or os.cpu_count()
+    sink = MemorySink()
+
+    errors = generate(connect(make_url(url), workers), 'diff', 'diff', sink,
+                      workers=workers)
+
+    if errors:
+        raise ValueError('{} table(s) of {} failed'.format(len(errors), url))
+
+    return load_files(sink.files.items())
+
+
+def load(source, workers=None):
+    "Returns the rows by entity of an output path or database URL."
+    if '://' in source:
+        return load_database(source, workers)
+
+    if not os.path.exists(source):
+        raise ValueError('{} does not exist'.format(source))
+
+    return load_files(read_files(source))
+
+
+def index(rows, key):
+    """Returns the compared values of rows by key, each a tuple of the
+    rows sharing the key."""
+    indexed = defaultdict(list)
+
+    for row in rows:
+        indexed[tuple(row[c] for c in key)].append(tuple(
+            (c, v) for c, v in row.items()
+            if c not in key and c not in IGNORED))
+
+    return {k: tuple(v) for k, v in indexed.items()}
+
+
+def _values(value, many):
+    "Returns the compared values of a key, a list if rows may share it."
+    values = [dict(v) for v in value]
+    return values if many else values[-1]
+
+
+def _entry(k, key, value, many):
+    entry = dict(zip(key, k))
+
+    if many:
+        entry['rows'] = _values(value, many)
+    else:
+        entry.update(_values(value, many))
+
+    return entry
+
+
+def compare(left, right):
+    """Returns the added, removed and changed entries of each entity
+    between two loaded outputs.
+
+    Each output is indexed by key once, so the comparison is linear in the
+    size of the catalogs. The entries of tables that were added or removed
+    as a whole are only reported as tables. A table is changed if any of
+    its entries were added, removed or changed.
+    """
+    result = {}
+    whole = set()
+    touched = set()
+
+    for entity, key, many in KEYS:
+        before = index(left.get(entity, ()), key)
+        after = index(right.get(entity, ()), key)
+
+        added = [k for k in after if k not in before]
+        removed = [k for k in before if k not in after]
+        changed = [k for k in after if k in before and before[k] != after[k]]
+
+        if entity == 'tables':
+            whole = {k[0] for k in added + removed}
+        else:
+            added = [k for k in added if k[0] not in whole]
+            removed = [k for k in removed if k[0] not in whole]
+
+        touched.update(k[0] for k in added + removed + changed)
+
+        result[entity] = {
+            'added': [_entry(k, key, after[k], many)
+                      for k in sorted(added)],
+            'removed': [_entry(k, key, before[k], many)
+                        for k in sorted(removed)],
+            'changed': [{
+                'key': dict(zip(key, k)),
+                'before': _values(before[k], many),
+                'after': _values(after[k], many),
+            } for k in sorted(changed)],
+        }
+
+    tables = result['tables']
+    described = {e['key']['table'] for e in tables['changed']}
+
+    tables['changed'].extend({'key': {'table': t}}
+                             for t in touched - whole - described)
+    tables['changed'].sort(key=lambda e: e['key']['table'])
+
+    return result
+
+
+def summarize(result):
+    "Returns the number of added, removed and changed entries per entity."
+    return {entity: {kind: len(entries) for kind, entries in kinds.items()}
+            for entity, kinds in result.items()}
+
+
+def differs(result, kinds):
+    """Returns true if there are differences of the given kinds. Tables
+    that only changed through their entries are not counted themselves, so
+    only adding fields to a table is an addition."""
+    for entity, entries in result.items():
+        for kind in kinds:
+            for entry in entries[kind]:
+                if kind != 'changed' or 'before' in entry:
+                    return True
+
+    return False
+
+
+def main(argv=None):
+    usage = """Data Model Diff
+
+    Usage:
+        diff <left> <right> [--output=FILE] [--allow-added] [--workers=NUM]
+
+    Compares two generated models, given as output directories, archives or
+    bundles in any output format, or as database URLs which are reflected
+    like the sql command does. The differences are written as JSON.
+
+    The exit status is 0 if the models are the same, 1 if they differ and 2
+    if either could not be loaded.
+
+    Options:
+        -h --help       Show this screen.
+        --output=FILE   Write the JSON report to a file rather than stdout.
+        --allow-added   Exit with 0 if tables, fields and the like were only added.
+        --workers=NUM   Number of concurrent reflection workers for database URLs.
+
+    """  # noqa
+
+    from docopt import docopt
+
+    args = docopt(usage, argv=argv, version='0.1')
+
+    workers = int(args['--workers']) if args['--workers'] else None
+
+    try:
+        left = load(args['<left>'], workers)
+        right = load(args['<right>'], workers)
+    except Exception as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(2)
+
+    result = compare(left, right)
+    summary = summarize(result)
+
+    report = {
+        'left': args['<left>'],
+        'right': args['<right>'],
+        'summary': summary,
+        'differences': result,
+    }
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    kinds = ('removed', 'changed') if args['--allow-added'] else \
+        ('added', 'removed', 'changed')
+
+    if differs(result, kinds):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
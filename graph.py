@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+import sys
+import csv
+import json
+import heapq
+from collections import deque
+
+
+class Graph:
+    """Foreign key graph of the tables of a model as adjacency lists.
+
+    An edge goes from a table to each table it refers to, its parents.
+    Tables referring to a table are its children, so they are downstream
+    of it: they depend on it being loaded first and are affected when it
+    changes.
+    """
+    def __init__(self, tables=()):
+        self.parents = {}
+        self.children = {}
+
+        for table in tables:
+            self.add_table(table)
+
+    @classmethod
+    def from_entities(cls, entities):
+        """Returns the graph of the tables and references of a loaded
+        model. Referred tables that are not in the model are included."""
+        graph = cls(row['table'] for row in entities.get('tables', ()))
+
+        for row in entities.get('references', ()):
+            graph.add(row['table'], row['ref_table'])
+
+        return graph
+
+    def add_table(self, table):
+        if table not in self.parents:
+            self.parents[table] = set()
+            self.children[table] = set()
+
+    def add(self, table, ref):
+        "Adds a reference from a table to another."
+        self.add_table(table)
+        self.add_table(ref)
+        self.parents[table].add(ref)
+        self.children[ref].add(table)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def edges(self):
+        "Yields the (table, referred table) pairs in name order."
+        for table in sorted(self.parents):
+            for ref in sorted(self.parents[table]):
+                yield table, ref
+
+    def components(self):
+        """Returns the strongly connected components, each a sorted list of
+        tables, with every component after the components it refers to.
+
+        Uses an iterative version of Tarjan's algorithm, which finds the
+        components in that order in a single pass.
+        """
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in sorted(self.parents):
+            if root in index:
+                continue
+
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(sorted(self.parents[root])))]
+
+            while work:
+                table, refs = work[-1]
+
+                for ref in refs:
+                    if ref not in index:
+                        index[ref] = low[ref] = len(index)
+                        stack.append(ref)
+                        on_stack.add(ref)
+                        work.append((ref, iter(sorted(self.parents[ref]))))
+                        break
+
+                    if ref in on_stack:
+                        low[table] = min(low[table], index[ref])
+                else:
+                    work.pop()
+
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[table])
+
+                    if low[table] == index[table]:
+                        component = []
+
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+
+                            if member == table:
+                                break
+
+                        components.append(sorted(component))
+
+        return components
+
+    def cycles(self):
+        "Returns the components that are cycles, including self-references."
+        return [c for c in self.components()
+                if len(c) > 1 or c[0] in self.parents[c[0]]]
+
+    def levels(self):
+        """Returns the tables in load levels. Each table is in the level
+        after the last level of the tables it refers to, so the tables of a
+        level can be loaded in parallel once the previous levels are.
+        Tables in a cycle share a level."""
+        level = {}
+        levels = []
+
+        for component in self.components():
+            members = set(component)
+            n = max((level[ref] + 1
+                     for table in component
+                     for ref in self.parents[table]
+                     if ref not in members), default=0)
+
+            for table in component:
+                level[table] = n
+
+            if n == len(levels):
+                levels.append([])
+
+            levels[n].extend(component)
+
+        return [sorted(tables) for tables in levels]
+
+    def order(self):
+        """Returns the tables so that tables come after the tables they
+        refer to, level by level and by name within a level."""
+        return [table for tables in self.levels() for table in tables]
+
+    def schedule(self, workers, weights=None):
+        """Returns a parallel load plan as waves, one per level, of the
+        tables assigned to each of up to `workers` workers.
+
+        Within a wave, tables are assigned heaviest first to the worker
+        with the least total weight so far. Weights default to 1.
+        """
+        weights = weights or {}
+        waves = []
+
+        for tables in self.levels():
+            loads = [(0, i, []) for i in range(min(workers, len(tables)))]
+
+            for table in sorted(tables,
+                                key=lambda t: (-weights.get(t, 1), t)):
+                load, i, assigned = heapq.heappop(loads)
+                assigned.append(table)
+                heapq.heappush(loads, (load + weights.get(table, 1), i,
+                                       assigned))
+
+            waves.append([assigned for _, _, assigned in sorted(
+                loads, key=lambda w: w[1])])
+
+        return waves
+
+    def reachable(self, table, adjacency):
+        "Returns the tables reachable from a table, in name order."
+        seen = {table}
+        queue = deque([table])
+
+        while queue:
+            for other in adjacency[queue.popleft()]:
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+
+        seen.discard(table)
+
+        return sorted(seen)
+
+    def downstream(self, table):
+        """Returns every table referring to the table, directly or through
+        other tables, in time linear in the size of the graph."""
+        return self.reachable(table, self.children)
+
+    def upstream(self, table):
+        "Returns every table the table refers to, directly or not."
+        return self.reachable(table, self.parents)
+
+    def to_json(self, workers=None, weights=None):
+        "Returns the graph, cycles, levels and schedule as a JSON object."
+        data = {
+            'tables': sorted(self.parents),
+            'references': [{'table': t, 'ref_table': r}
+                           for t, r in self.edges()],
+            'cycles': self.cycles(),
+            'levels': self.levels(),
+        }
+
+        if workers:
+            data['schedule'] = {
+                'workers': workers,
+                'waves': self.schedule(workers, weights),
+            }
+
+        return data
+
+    def to_dot(self):
+        "Returns the graph in the DOT language, with cycles highlighted."
+        cycle = {t: i for i, c in enumerate(self.cycles()) for t in c}
+        lines = ['digraph references {', '    rankdir=RL;']
+
+        for table in sorted(self.parents):
+            attrs = ' [color=red]' if table in cycle else ''
+            lines.append('    {}{};'.format(_quote(table), attrs))
+
+        for table, ref in self.edges():
+            same = table in cycle and cycle.get(ref) == cycle[table]
+            lines.append('    {} -> {}{};'.format(
+                _quote(table), _quote(ref), ' [color=red]' if same else ''))
+
+        lines.append('}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _quote(name):
+    return json.dumps(name)
+
+
+def read_weights(path):
+    "Returns the weights by table of a CSV file of table, weight rows."
+    with open(path) as f:
+        reader = csv.reader(f)
+        next(reader)
+
+        return {table: float(weight) for table, weight in reader}
+
+
+def main(argv=None):
+    usage = """Data Model Reference Graph
+
+    Usage:
+        graph <model> [--output=FILE] [--format=FORMAT] [--workers=NUM] [--weights=FILE] [--downstream=TABLE...] [--upstream=TABLE...]
+
+    Builds the foreign key graph of a generated model, given as an output
+    directory, archive or bundle in any output format, or as a database URL
+    which is reflected like the sql command does.
+
+    The json format lists the tables, references, reference cycles and the
+    load levels, where each level only refers to earlier levels, and a
+    parallel load schedule of each level if the number of workers is
+    given. The dot format is for Graphviz. With the downstream or upstream
+    options, only the tables referring to, or referred to by, the given
+    tables are written.
+
+    Options:
+        -h --help       Show this screen.
+        --output=FILE   Write to a file rather than stdout.
+        --format=FORMAT     Output format, json or dot [default: json].
+        --workers=NUM   Number of parallel loaders to schedule each level for.
+        --weights=FILE  CSV file of table and weight, such as the row count, to balance the schedule by.
+        --downstream=TABLE  Table whose downstream tables are written, may be repeated.
+        --upstream=TABLE    Table whose upstream tables are written, may be repeated.
+
+    """  # noqa
+
+    from docopt import docopt
+    from diff import load
+
+    args = docopt(usage, argv=argv, version='0.1')
+
+    if args['--format'] not in ('json', 'dot'):
+        print('error: unknown format {}'.format(args['--format']),
+              file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        graph = Graph.from_entities(load(args['<model>']))
+        weights = read_weights(args['--weights']) \
+            if args['--weights'] else None
+    except Exception as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+    queries = [(key, table)
+               for key in ('downstream', 'upstream')
+               for table in args['--' + key]]
+
+    for _, table in queries:
+        if table not in graph.parents:
+            print('error: table {} is not in the model'.format(table),
+                  file=sys.stderr)
+            sys.exit(1)
+
+    if queries:
+        output = {'downstream': {}, 'upstream': {}}
+
+        for key, table in queries:
+            output[key][table] = getattr(graph, key)(table)
+
+        output = json.dumps(output, indent=2) + '\n'
+    elif args['--format'] == 'dot':
+        output = graph.to_dot()
+    else:
+        workers = int(args['--workers']) if args['--workers'] else None
+        output = json.dumps(graph.to_json(workers, weights), indent=2) + '\n'
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+if __name__ == '__main__':
+    main()
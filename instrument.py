@@ -0,0 +1,404 @@
+import os
+import sys
+import json
+import time
+import bisect
+import cProfile
+import importlib
+import threading
+import importlib.machinery
+from contextlib import contextmanager
+from collections import defaultdict
+from functools import wraps
+
+
+def _arg(index, name):
+    "Returns a function getting an argument by position or keyword."
+    def get(args, kwargs):
+        if len(args) > index:
+            return args[index]
+
+        return kwargs.get(name)
+
+    return get
+
+
+def _record_name(index, name):
+    get = _arg(index, name)
+    return lambda args, kwargs: get(args, kwargs)['name']
+
+
+def _batch_table(args, kwargs):
+    """Returns the table directory of the first file of a batch. Batches
+    given as iterators are not consumed, so they have no table."""
+    files = _arg(1, 'files')(args, kwargs)
+
+    if isinstance(files, (list, tuple)) and files:
+        path = files[0][0]
+
+        if os.sep in path:
+            return path.split(os.sep, 1)[0]
+
+
+# Instrumented functions as (module, attribute, phase, table) where the
+# attribute may be a method of a class in the module and table returns the
+# table name from the arguments of a call, if it concerns one. Methods are
+# listed for every class overriding them, since overrides bypass the base.
+TARGETS = (
+    ('sql', 'connect', 'connect', None),
+    ('sqlalchemy.engine.base', 'Engine.connect', 'connection checkout', None),
+    ('sql', 'versions', 'catalog versions', None),
+    ('reflect', 'fetch_rows', 'catalog query', None),
+    ('sqlalchemy.engine.reflection', 'Inspector.get_table_names',
+     'inspector tables', None),
+    ('sqlalchemy.engine.reflection', 'Inspector.get_columns',
+     'inspector columns', _arg(1, 'table_name')),
+    ('sqlalchemy.engine.reflection', 'Inspector.get_pk_constraint',
+     'inspector primary key', _arg(1, 'table_name')),
+    ('sqlalchemy.engine.reflection', 'Inspector.get_foreign_keys',
+     'inspector foreign keys', _arg(1, 'table_name')),
+    ('sqlalchemy.engine.reflection', 'Inspector.get_indexes',
+     'inspector indexes', _arg(1, 'table_name')),
+    ('sqlalchemy.engine.reflection', 'Inspector.get_unique_constraints',
+     'inspector unique constraints', _arg(1, 'table_name')),
+    ('sql', 'generate_table_files', 'table files', _record_name(3, 'info')),
+    ('sql', 'generate_fields', 'fields and types', _arg(2, 'table')),
+    ('sampling', 'profile_table', 'data profile', _record_name(1, 'info')),
+    ('rc', 'db_metadata', 'redcap metadata query', _arg(1, 'project')),
+    ('rc_all', 'db_metadata_all', 'redcap metadata query', None),
+    ('rc', 'form_data', 'form fields and types', _arg(2, 'table')),
+    ('rc', 'generate_table_files', 'table files', _arg(3, 'table')),
+    ('redcap', 'Project.export_metadata', 'redcap api export', None),
+    ('rc_api', 'fetch_metadata', 'redcap api export', None),
+    ('output', 'Sink.write', 'csv write', _batch_table),
+    ('output', 'BundleSink.write', 'csv write', _batch_table),
+    ('output', 'StoreSink.write', 'csv write', _batch_table),
+    ('output', 'BundleSink.commit', 'bundle write', None),
+)
+
+# Targets returning an iterator, which are timed until it is exhausted
+# since the rows are only fetched as they are consumed.
+STREAMS = (
+    ('rc', 'db_metadata'),
+    ('rc_all', 'db_metadata_all'),
+)
+
+
+# Upper bounds in seconds of the latency histogram buckets.
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5,
+           10, 30, 60)
+
+
+class Recorder:
+    """Collects a span for every call of an instrumented function.
+
+    Functions are only wrapped once the recorder is enabled, so nothing is
+    measured and nothing is slowed down otherwise. Targets are patched in
+    the modules the command has imported, and in the others once the
+    command imports them, so profiling loads nothing the command does not.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.patched = []
+        self.pending = defaultdict(list)
+        self.finder = None
+
+    def record(self, phase, table, start):
+        end = time.perf_counter()
+
+        with self.lock:
+            self.spans.append((phase, table, start, end,
+                               threading.get_ident()))
+
+    def wrap(self, func, phase, table, stream=False):
+        recorder = self
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            name = recorder.table(table, args, kwargs)
+
+            if stream:
+                return recorder.consume(func(*args, **kwargs), phase, name,
+                                        start)
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.record(phase, name, start)
+
+        return wrapper
+
+    def table(self, table, args, kwargs):
+        """Returns the table of a call, or None if it has none or it cannot
+        be told, so profiling never breaks the call measured."""
+        if table is None:
+            return None
+
+        try:
+            return table(args, kwargs)
+        except Exception:
+            return None
+
+    def consume(self, items, phase, table, start):
+        "Yields the items, recording a span once they are exhausted."
+        try:
+            yield from items
+        finally:
+            self.record(phase, table, start)
+
+    def enable(self, targets=TARGETS):
+        """Wraps the target functions of imported modules and patches the
+        others when they are imported. Missing ones are skipped."""
+        for target in targets:
+            module = target[0]
+
+            if module in sys.modules:
+                self.patch(sys.modules[module], *target[1:])
+            else:
+                self.pending[module].append(target[1:])
+
+        if self.pending:
+            self.finder = _PatchFinder(self)
+            sys.meta_path.insert(0, self.finder)
+
+    def patch(self, module, attr, phase, table):
+        owner = module
+        *path, name = attr.split('.')
+
+        for part in path:
+            owner = getattr(owner, part)
+
+        func = getattr(owner, name, None)
+
+        if func is None:
+            return
+
+        stream = (module.__name__, attr) in STREAMS
+
+        with self.lock:
+            self.patched.append((owner, name, func))
+
+        setattr(owner, name, self.wrap(func, phase, table, stream))
+
+    def imported(self, module):
+        "Patches the pending targets of a module that was just imported."
+        with self.lock:
+            targets = self.pending.pop(module.__name__, ())
+
+        for target in targets:
+            self.patch(module, *target)
+
+    def disable(self):
+        "Restores the original functions."
+        if self.finder in sys.meta_path:
+            sys.meta_path.remove(self.finder)
+
+        self.finder = None
+        self.pending.clear()
+
+        for owner, name, func in reversed(self.patched):
+            setattr(owner, name, func)
+
+        self.patched = []
+
+    def exclusive(self):
+        """Returns (phase, table, seconds) for each span excluding the time
+        spent in spans nested within it."""
+        by_thread = defaultdict(list)
+
+        for span in self.spans:
+            by_thread[span[4]].append(span)
+
+        result = []
+
+        for spans in by_thread.values():
+            spans.sort(key=lambda s: (s[2], -s[3]))
+            stack = []
+
+            for phase, table, start, end, _ in spans:
+                while stack and stack[-1][3] <= start:
+                    stack.pop()
+
+                entry = [phase, table, end - start, end]
+
+                # Nested spans are subtracted from their parent.
+                if stack:
+                    stack[-1][2] -= end - start
+
+                stack.append(entry)
+                result.append(entry)
+
+        return [(phase, table, seconds) for phase, table, seconds, _ in
+                result]
+
+    def phases(self):
+        "Returns the inclusive durations of the spans by phase."
+        phases = defaultdict(list)
+
+        for phase, _, start, end, _ in self.spans:
+            phases[phase].append(end - start)
+
+        return phases
+
+    def tables(self):
+        "Returns the exclusive durations by phase of each table."
+        tables = defaultdict(lambda: defaultdict(float))
+
+        for phase, table, seconds in self.exclusive():
+            if table is not None:
+                tables[table][phase] += seconds
+
+        return tables
+
+    def report(self, slowest=10, file=sys.stderr):
+        "Prints the latency of each phase and the slowest tables."
+        print('{:30} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+            'phase', 'count', 'total', 'mean', 'p50', 'p95', 'max'),
+            file=file)
+
+        phases = self.phases()
+
+        for phase, durations in sorted(phases.items(),
+                                       key=lambda p: -sum(p[1])):
+            durations.sort()
+            total = sum(durations)
+
+            print('{:30} {:7} {:9.3f} {:9.4f} {:9.4f} {:9.4f} {:9.4f}'.format(
+                phase,
+                len(durations),
+                total,
+                total / len(durations),
+                _percentile(durations, 0.5),
+                _percentile(durations, 0.95),
+                durations[-1]), file=file)
+
+            print('  {}'.format(' '.join(
+                '{}{}s:{}'.format('<' if bound in BUCKETS else '>=',
+                                  min(bound, BUCKETS[-1]), count)
+                for bound, count in histogram(durations) if count)),
+                file=file)
+
+        tables = self.tables()
+
+        if not tables or not slowest:
+            return
+
+        print('slowest tables:', file=file)
+
+        ranked = sorted(tables.items(), key=lambda t: -sum(t[1].values()))
+
+        for table, by_phase in ranked[:slowest]:
+            by_phase = sorted(by_phase.items(), key=lambda p: -p[1])
+
+            print('  {:30} {:9.3f}  {}'.format(
+                table,
+                sum(seconds for _, seconds in by_phase),
+                ', '.join('{} {:.3f}'.format(phase, seconds)
+                          for phase, seconds in by_phase)), file=file)
+
+    def trace(self, path):
+        "Writes the spans as Chrome trace events."
+        pid = os.getpid()
+        events = []
+
+        for phase, table, start, end, tid in self.spans:
+            event = {
+                'name': phase,
+                'cat': 'phase',
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': pid,
+                'tid': tid,
+            }
+
+            if table is not None:
+                event['args'] = {'table': table}
+
+            events.append(event)
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+
+class _PatchFinder:
+    """Finds the modules with pending targets like the path finder does,
+    patching them once they are executed."""
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in self.recorder.pending:
+            return None
+
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+
+        if spec is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+
+        exec_module = spec.loader.exec_module
+        recorder = self.recorder
+
+        def patched(module):
+            exec_module(module)
+            recorder.imported(module)
+
+        spec.loader.exec_module = patched
+
+        return spec
+
+
+def histogram(durations):
+    "Returns (bound, count) pairs of sorted durations per bucket."
+    counts = []
+    lower = 0
+
+    for bound in BUCKETS + (float('inf'),):
+        upper = bisect.bisect_left(durations, bound)
+        counts.append((bound, upper - lower))
+        lower = upper
+
+    return counts
+
+
+def _percentile(durations, q):
+    return durations[min(len(durations) - 1, int(q * len(durations)))]
+
+
+@contextmanager
+def profiling(summary=False, slowest=10, trace=None, cprofile=None,
+              file=sys.stderr):
+    """Instruments the block if a summary or trace is requested, and runs
+    it under cProfile if a dump file is given.
+
+    The summary and outputs are produced even if the block exits early.
+    """
+    recorder = None
+    profiler = None
+
+    if summary or trace:
+        recorder = Recorder()
+        recorder.enable()
+
+    if cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield recorder
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+
+        if recorder:
+            recorder.disable()
+
+            if summary:
+                recorder.report(slowest=slowest, file=file)
+
+            if trace:
+                recorder.trace(trace)
@@ -0,0 +1,111 @@
+import os
+import json
+from collections import OrderedDict
+
+
+# Identifies the header line of a journal.
+FORMAT = 'data-models-journal'
+
+
+def default_path(path, store=None):
+    """Returns the journal of an output, next to the output directory or
+    archive, or under journals/ in the blob store the output is named in."""
+    if store:
+        return os.path.join(store, 'journals', path + '.jsonl')
+
+    parent, name = os.path.split(os.path.abspath(path))
+
+    return os.path.join(parent, '.{}.journal'.format(name))
+
+
+class Journal:
+    """A checkpoint of the tables completed by a run.
+
+    A JSON line with the manifest entry and files of each table is appended
+    and flushed as soon as the table is written, so a run that dies midway
+    can be resumed without reflecting those tables again. The journal is
+    removed once a run completes without errors.
+    """
+    def __init__(self, path, model, version, resume=False):
+        self.path = path
+        self.done = OrderedDict()
+
+        if resume:
+            self.done = self.load(model, version)
+
+        dirname = os.path.dirname(os.path.abspath(path))
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # The completed tables are written again, which also drops a line
+        # left incomplete by a crash.
+        self.file = open(path, 'w')
+        self.append({'format': FORMAT, 'model': model, 'version': version})
+
+        for record in self.done.values():
+            self.append(record)
+
+    def load(self, model, version):
+        "Returns the records of the tables completed by the previous run."
+        done = OrderedDict()
+
+        if not os.path.exists(self.path):
+            return done
+
+        with open(self.path) as f:
+            lines = iter(f)
+
+            try:
+                header = json.loads(next(lines))
+            except (StopIteration, ValueError):
+                return done
+
+            if (header.get('format'), header.get('model'),
+                    header.get('version')) != (FORMAT, model, version):
+                raise ValueError('{} is not a journal of {} {}'.format(
+                    self.path, model, version))
+
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+
+                done[record['table']] = record
+
+        return done
+
+    def append(self, record):
+        self.file.write(json.dumps(record, default=str))
+        self.file.write('\n')
+        self.file.flush()
+
+    def record(self, table, entry, files=None):
+        """Records a completed table with its manifest entry and files, or
+        no files if it was carried over from the previous output."""
+        self.append({
+            'table': table,
+            'entry': entry,
+            'files': files,
+        })
+
+    def completed(self):
+        "Yields (table, entry, files) for the tables of the previous run."
+        for table, record in self.done.items():
+            files = record['files']
+
+            if files is not None:
+                files = [tuple(f) for f in files]
+
+            yield table, record['entry'], files
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        "Closes and deletes the journal."
+        self.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
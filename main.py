@@ -1,18 +1,52 @@
 #!/usr/bin/env python3
 
 import sys
-import sql
-import rc
+import importlib
+
+
+# Modules of the redcap subcommands other than the single-project ones.
+REDCAP_MODULES = {
+    'dball': 'rc_all',
+    'apibatch': 'rc_api',
+}
+
+
+def command_module(args, sub_argv):
+    """Returns the name of the module implementing a subcommand. Only that
+    module is imported so each subcommand loads just what it needs."""
+    if args['sql']:
+        return 'sql'
+
+    if args['redcap']:
+        return REDCAP_MODULES.get(sub_argv[0] if sub_argv else None, 'rc')
+
+    if args['serve']:
+        return 'serve'
+
+    if args['ddl']:
+        return 'ddl'
+
+    if args['graph']:
+        return 'graph'
+
+    if args['store']:
+        return 'store'
+
+    return 'diff'
 
 
 def main():
     usage = """Data Models Generator
 
-    Usage: main.py (sql | redcap) [--dir=DIR] <args>...
+    Usage: main.py [--profile] [--slowest=N] [--trace=FILE] [--cprofile=FILE] (sql | redcap | diff | ddl | graph | store | serve) [--dir=DIR] [<args>...]
 
     Options:
         -h --help       Show this screen.
         --dir=DIR       Name of the directory to output the files.
+        --profile       Print the count and latency of each phase and the slowest tables.
+        --slowest=N     Number of slowest tables to print with --profile [default: 10].
+        --trace=FILE    Write the timed phases as Chrome trace events (chrome://tracing).
+        --cprofile=FILE  Write a cProfile dump of the main thread.
 
     """  # noqa
 
@@ -21,15 +55,25 @@ def main():
     # Ignore command name.
     argv = sys.argv[1:]
 
-    args = docopt(usage, argv=argv, version='0.1')
+    # Subcommand options are passed through untouched.
+    args = docopt(usage, argv=argv, version='0.1', options_first=True)
 
-    # Trim subcommand.
-    sub_argv = argv[1:]
+    # Arguments following the subcommand.
+    sub_argv = args['<args>']
 
-    if args['sql']:
-        sql.main(sub_argv)
-    elif args['redcap']:
-        rc.main(sub_argv)
+    module = importlib.import_module(command_module(args, sub_argv))
+
+    if not (args['--profile'] or args['--trace'] or args['--cprofile']):
+        module.main(sub_argv)
+        return
+
+    from instrument import profiling
+
+    with profiling(summary=args['--profile'],
+                   slowest=int(args['--slowest']),
+                   trace=args['--trace'],
+                   cprofile=args['--cprofile']):
+        module.main(sub_argv)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,100 @@
+import sys
+import json
+import hashlib
+
+
+# Name of the manifest file in the output root.
+MANIFEST = 'manifest.json'
+
+# Bumped whenever the generated files change for the same input so
+# previous manifests are invalidated.
+FORMAT = 4
+
+
+def fingerprint(value):
+    "Returns a content hash of a value composed of tuples, lists and scalars."
+    return hashlib.sha1(repr(value).encode('utf8')).hexdigest()
+
+
+def load(sink, model, version):
+    """Returns the table entries of the manifest of the previous output.
+
+    An empty dict is returned if there is no manifest or it was written
+    for a different model, version or format, or for an output of another
+    format or compression, whose files the sink cannot keep.
+    """
+    content = sink.read(MANIFEST)
+
+    if content is None:
+        return {}
+
+    try:
+        data = json.loads(content.decode('utf8'))
+    except ValueError:
+        return {}
+
+    if (data.get('format'), data.get('model'), data.get('version')) != \
+            (FORMAT, model, version) or data.get('output') != sink.settings():
+        return {}
+
+    return data.get('tables', {})
+
+
+def save(sink, model, version, tables):
+    "Writes the manifest of table entries to the output."
+    data = {
+        'format': FORMAT,
+        'model': model,
+        'version': version,
+        'output': sink.settings(),
+        'tables': tables,
+    }
+
+    content = json.dumps(data, indent=2, sort_keys=True)
+
+    sink.put(MANIFEST, content.encode('utf8'))
+
+
+def new_changes():
+    return {
+        'added': [],
+        'changed': [],
+        'removed': [],
+        'unchanged': [],
+    }
+
+
+def compare(previous, table, fp, changes):
+    """Records the change status of a table and returns true if it must be
+    written."""
+    entry = previous.get(table)
+
+    if entry is None:
+        changes['added'].append(table)
+    elif entry['fingerprint'] != fp:
+        changes['changed'].append(table)
+    else:
+        changes['unchanged'].append(table)
+        return False
+
+    return True
+
+
+def removed(previous, current, changes):
+    "Records the tables of the previous output that no longer exist."
+    for table in sorted(previous):
+        if table not in current:
+            changes['removed'].append(table)
+
+
+def report(changes, file=sys.stderr):
+    "Prints a summary of added, changed and removed tables."
+    print('{} added, {} changed, {} removed, {} unchanged'.format(
+        len(changes['added']),
+        len(changes['changed']),
+        len(changes['removed']),
+        len(changes['unchanged'])), file=file)
+
+    for key in ('added', 'changed', 'removed'):
+        for table in sorted(changes[key]):
+            print('  {:8} {}'.format(key, table), file=file)
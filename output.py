@@ -0,0 +1,970 @@
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import shutil
+import sqlite3
+import tarfile
+import zipfile
+import hashlib
+import ctypes
+import tempfile
+import itertools
+import threading
+from collections import defaultdict
+from constants import ENTITIES
+
+
+class Sink:
+    """Base class for output backends.
+
+    Generators hand over the files of a table as one batch. The CSV files
+    are rendered in memory and stored together, and nothing is visible at
+    the final location until the sink is committed.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, tb):
+        if typ is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def write(self, files):
+        "Renders a batch of (path, header, rows) CSV files and stores them."
+        batch = [(path, render_csv(header, rows))
+                 for path, header, rows in files]
+
+        if batch:
+            with self.lock:
+                self.store(batch)
+
+    def append(self, files):
+        """Renders the rows of a batch of (path, header, rows) CSV files and
+        appends them to files written or kept earlier in the run."""
+        batch = [(path, render_csv(None, rows)) for path, _, rows in files]
+
+        if batch:
+            with self.lock:
+                self.extend(batch)
+
+    def put(self, path, data):
+        "Stores a single file of raw bytes."
+        with self.lock:
+            self.store([(path, data)])
+
+    def read(self, path):
+        "Returns the contents of a file of the previous output, if any."
+        return None
+
+    def settings(self):
+        """Returns the format and compression of the output, which the
+        previous output must share for its files to be kept."""
+        return {'format': 'tree', 'compression': 'none'}
+
+    def keep(self, path):
+        "Carries a file or directory over from the previous output."
+        raise ValueError('{} cannot keep previous output'.format(
+            self.__class__.__name__))
+
+    def store(self, batch):
+        "Stores a batch of (path, data) pairs."
+        raise NotImplementedError
+
+    def extend(self, batch):
+        "Appends the data of a batch of (path, data) pairs to their files."
+        raise ValueError('{} cannot append to files'.format(
+            self.__class__.__name__))
+
+    def commit(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class DirectorySink(Sink):
+    """Writes a plain directory tree.
+
+    Files are written to a staging directory of each sink next to the root,
+    which replaces the previous tree on commit. Where the system can
+    exchange two paths atomically (Linux), readers see either tree. Else the
+    previous tree is renamed aside first, so the root is missing between
+    the two renames.
+    """
+    def __init__(self, root):
+        super().__init__()
+
+        self.root = os.path.abspath(root)
+
+        parent, name = os.path.split(self.root)
+
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+
+        # Sinks of the same root in one process, such as concurrent jobs,
+        # each have their own staging directory.
+        prefix = '.{}.staging-'.format(name)
+        self.staging = os.path.join(parent, '{}{}-{}'.format(
+            prefix, os.getpid(), next(_staging_ids)))
+
+        # Remove what runs that died left staged.
+        for fn in os.listdir(parent):
+            pid = fn[len(prefix):].split('-', 1)[0]
+
+            if fn.startswith(prefix) and pid.isdigit() and \
+                    not _alive(int(pid)):
+                shutil.rmtree(os.path.join(parent, fn), ignore_errors=True)
+
+        os.mkdir(self.staging)
+
+    def store(self, batch):
+        for path, data in batch:
+            fn = os.path.join(self.staging, path)
+            dirname = os.path.dirname(fn)
+
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+            with open(fn, 'wb') as f:
+                f.write(data)
+
+    def extend(self, batch):
+        for path, data in batch:
+            fn = os.path.join(self.staging, path)
+
+            # Kept files are linked to the previous tree, which must stay
+            # intact until the commit.
+            if os.path.exists(fn) and os.stat(fn).st_nlink > 1:
+                shutil.copyfile(fn, fn + '.tmp')
+                os.replace(fn + '.tmp', fn)
+
+            with open(fn, 'ab') as f:
+                f.write(data)
+
+    def read(self, path):
+        fn = os.path.join(self.root, path)
+
+        if not os.path.isfile(fn):
+            return None
+
+        with open(fn, 'rb') as f:
+            return f.read()
+
+    def keep(self, path):
+        src = os.path.join(self.root, path)
+        dst = os.path.join(self.staging, path)
+
+        if not os.path.exists(src):
+            return
+
+        # Hard link unchanged files rather than copying them.
+        with self.lock:
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, copy_function=_link)
+            else:
+                dirname = os.path.dirname(dst)
+
+                if not os.path.exists(dirname):
+                    os.makedirs(dirname)
+
+                _link(src, dst)
+
+    def commit(self):
+        if os.path.exists(self.root) and _exchange(self.staging, self.root):
+            shutil.rmtree(self.staging)
+            return
+
+        # Move the previous tree aside so the swap is a pair of renames.
+        old = None
+
+        if os.path.exists(self.root):
+            old = '{}.old-{}'.format(self.staging, int(time.time()))
+            os.rename(self.root, old)
+
+        os.rename(self.staging, self.root)
+
+        if old:
+            shutil.rmtree(old)
+
+    def abort(self):
+        if os.path.exists(self.staging):
+            shutil.rmtree(self.staging)
+
+
+class ArchiveSink(Sink):
+    """Writes a single tar or zip archive.
+
+    The archive is written to a temporary file which replaces the target
+    on commit. The format is chosen by the file extension. Members cannot
+    be appended to once written, so appended rows are held until the
+    commit, which then rewrites the archive with them.
+    """
+    def __init__(self, path):
+        super().__init__()
+
+        self.path = os.path.abspath(path)
+        self.tmp = '{}.tmp-{}'.format(self.path, os.getpid())
+
+        parent = os.path.dirname(self.path)
+
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+
+        if self.path.endswith('.zip'):
+            self.compression = 'zip'
+        elif self.path.endswith(('.tar.gz', '.tgz')):
+            self.compression = 'gzip'
+        else:
+            self.compression = 'none'
+
+        self.archive = self.open(self.tmp)
+        self.previous = None
+        self.appended = {}
+
+    def open(self, path):
+        "Opens a new archive of the format of the target for writing."
+        if self.compression == 'zip':
+            return zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+        return tarfile.open(path, 'w:gz' if self.compression == 'gzip'
+                            else 'w')
+
+    def settings(self):
+        return {'format': 'tree', 'compression': self.compression}
+
+    def previous_files(self):
+        "Returns the files of the archive being replaced, read on first use."
+        if self.previous is None:
+            self.previous = read_archive(self.path)
+
+        return self.previous
+
+    def read(self, path):
+        with self.lock:
+            return self.previous_files().get(path)
+
+    def keep(self, path):
+        prefix = path.rstrip('/') + '/'
+
+        with self.lock:
+            self.store([(name, data)
+                        for name, data in self.previous_files().items()
+                        if name == path or name.startswith(prefix)])
+
+    def store(self, batch):
+        for path, data in batch:
+            if isinstance(self.archive, zipfile.ZipFile):
+                self.archive.writestr(path, data)
+            else:
+                info = tarfile.TarInfo(path)
+                info.size = len(data)
+                info.mtime = time.time()
+                self.archive.addfile(info, io.BytesIO(data))
+
+    def extend(self, batch):
+        for path, data in batch:
+            self.appended.setdefault(path, []).append(data)
+
+    def merge(self):
+        "Rewrites the archive with the appended data added to its files."
+        tmp = '{}.merge'.format(self.tmp)
+        self.archive = self.open(tmp)
+
+        try:
+            for name, data in archive_members(self.tmp):
+                self.store([(name, data + b''.join(
+                    self.appended.pop(name, ())))])
+
+            self.store([(name, b''.join(chunks))
+                        for name, chunks in self.appended.items()])
+        finally:
+            self.archive.close()
+
+        os.replace(tmp, self.tmp)
+
+    def commit(self):
+        self.archive.close()
+
+        if self.appended:
+            self.merge()
+
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.archive.close()
+        os.remove(self.tmp)
+
+
+class MemorySink(Sink):
+    "Keeps the files in a dict of path to bytes, e.g. for tests."
+    def __init__(self, previous=None):
+        super().__init__()
+
+        self.previous = previous or {}
+        self.files = {}
+
+    def store(self, batch):
+        self.files.update(batch)
+
+    def extend(self, batch):
+        for path, data in batch:
+            self.files[path] = self.files.get(path, b'') + data
+
+    def read(self, path):
+        return self.previous.get(path)
+
+    def keep(self, path):
+        prefix = path.rstrip('/') + '/'
+
+        with self.lock:
+            for name, data in self.previous.items():
+                if name == path or name.startswith(prefix):
+                    self.files[name] = data
+
+
+class BundleSink(Sink):
+    """Collects the rows of every table per entity and writes them to
+    another sink on commit, rather than a directory of files per table.
+
+    The flat format writes one CSV file per entity, e.g. a single
+    schema.csv with the fields of all tables. The jsonl format writes a
+    single gzipped JSON-lines file with a line per row, keyed by the column
+    names and tagged with the entity. The sqlite format writes a single
+    SQLite database with a table per entity. Other files, such as the
+    manifest, are passed through.
+    """
+    # Entities rewritten as a whole on every run rather than per table.
+    WHOLE = ('models', 'tables')
+
+    FILES = {
+        'jsonl': 'model.jsonl.gz',
+        'sqlite': 'model.sqlite',
+    }
+
+    def __init__(self, sink, format):
+        super().__init__()
+
+        if format not in ('flat', 'jsonl', 'sqlite'):
+            raise ValueError('unknown output format {}'.format(format))
+
+        self.sink = sink
+        self.format = format
+        self.headers = dict(ENTITIES)
+        self.rows = defaultdict(list)
+        self.previous = None
+
+    def write(self, files):
+        with self.lock:
+            for path, header, rows in files:
+                entity = os.path.splitext(os.path.basename(path))[0]
+                self.headers.setdefault(entity, tuple(header))
+                self.rows[entity].extend(tuple(row) for row in rows)
+
+    def append(self, files):
+        self.write(files)
+
+    def put(self, path, data):
+        self.sink.put(path, data)
+
+    def read(self, path):
+        return self.sink.read(path)
+
+    def settings(self):
+        return {
+            'format': self.format,
+            'compression': self.sink.settings()['compression'],
+        }
+
+    def keep(self, path):
+        "Carries the rows of a table over from the previous output."
+        with self.lock:
+            if self.previous is None:
+                self.previous = self.by_table(self.load())
+
+            for entity, tables in self.previous.items():
+                self.rows[entity].extend(tables.get(path, ()))
+
+    def by_table(self, previous):
+        """Returns the rows of the per-table entities by entity and table,
+        so each kept table is looked up rather than scanned for."""
+        grouped = {}
+
+        for entity, rows in previous.items():
+            header = self.headers.get(entity)
+
+            if entity in self.WHOLE or not header or 'table' not in header:
+                continue
+
+            i = header.index('table')
+            tables = grouped[entity] = defaultdict(list)
+
+            for row in rows:
+                tables[row[i]].append(row)
+
+        return grouped
+
+    def load(self):
+        "Returns the rows by entity of the previous output."
+        if self.format == 'flat':
+            previous = {}
+
+            for entity in self.headers:
+                data = self.sink.read(entity + '.csv')
+
+                if data is not None:
+                    reader = csv.reader(io.StringIO(data.decode('utf8')))
+                    next(reader)
+                    previous[entity] = [tuple(row) for row in reader]
+
+            return previous
+
+        data = self.sink.read(self.FILES[self.format])
+
+        if data is None:
+            return {}
+
+        if self.format == 'jsonl':
+            return read_jsonl(data, self.headers)
+
+        return read_sqlite(data)
+
+    def entities(self):
+        "Yields (entity, header, rows) with rows ordered by table."
+        for entity, header in self.headers.items():
+            rows = self.rows.get(entity)
+
+            if rows is None:
+                continue
+
+            # Tables are written concurrently, so order them for a stable
+            # output while keeping the order of rows within a table.
+            if 'table' in header:
+                i = header.index('table')
+                rows.sort(key=lambda row: str(row[i]))
+
+            yield entity, header, rows
+
+    def commit(self):
+        try:
+            if self.format == 'flat':
+                super(BundleSink, self).write(
+                    (entity + '.csv', header, rows)
+                    for entity, header, rows in self.entities())
+            elif self.format == 'jsonl':
+                self.commit_jsonl()
+            else:
+                self.commit_sqlite()
+        except Exception:
+            self.sink.abort()
+            raise
+
+        self.sink.commit()
+
+    def store(self, batch):
+        self.sink.store(batch)
+
+    def commit_jsonl(self):
+        buf = io.BytesIO()
+
+        # A fixed mtime keeps the bundle identical for the same rows.
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+            for entity, header, rows in self.entities():
+                for row in rows:
+                    record = {'entity': entity}
+                    record.update(zip(header, row))
+                    f.write(json.dumps(record).encode('utf8'))
+                    f.write(b'\n')
+
+        self.sink.put(self.FILES['jsonl'], buf.getvalue())
+
+    def commit_sqlite(self):
+        fd, tmp = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+
+        try:
+            conn = sqlite3.connect(tmp)
+
+            for entity, header, rows in self.entities():
+                conn.execute('CREATE TABLE "{}" ({})'.format(
+                    entity, ', '.join('"{}"'.format(c) for c in header)))
+                conn.executemany('INSERT INTO "{}" VALUES ({})'.format(
+                    entity, ', '.join('?' * len(header))), rows)
+
+            conn.commit()
+            conn.close()
+
+            with open(tmp, 'rb') as f:
+                self.sink.put(self.FILES['sqlite'], f.read())
+        finally:
+            os.remove(tmp)
+
+    def abort(self):
+        self.sink.abort()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd compression requires the zstandard package')
+
+    return zstandard
+
+
+def _gzip(data):
+    # A fixed mtime keeps identical files identical once compressed.
+    return gzip.compress(data, mtime=0)
+
+
+# Compression methods of blobs by name, as (extension, compress,
+# decompress). Blobs are stored under the extension of their method.
+COMPRESSIONS = {
+    'none': ('', lambda data: data, lambda data: data),
+    'gzip': ('.gz', _gzip, gzip.decompress),
+    'zstd': ('.zst',
+             lambda data: _zstd().ZstdCompressor().compress(data),
+             lambda data: _zstd().ZstdDecompressor().decompress(data)),
+}
+
+
+def check_compression(name):
+    "Raises a ValueError if a compression method is unknown or unavailable."
+    if name not in COMPRESSIONS:
+        raise ValueError('unknown compression {}'.format(name))
+
+    if name == 'zstd':
+        _zstd()
+
+
+# Identifies the manifests of a blob store.
+STORE_FORMAT = 'data-models-store'
+
+# Leading columns of the generated files that are kept out of blobs.
+SHARED_COLUMNS = ('model', 'version')
+
+
+class BlobStore:
+    """A content-addressed store of files.
+
+    The contents of each file are stored once as a blob named by their
+    SHA-256 hash under blobs/, whatever their path and however many outputs
+    share them, and optionally compressed. Each output is a manifest under
+    manifests/ mapping its paths to blobs, named e.g. by model and version.
+
+    Blobs and manifests are written to temporary files and renamed into
+    place, so several processes can write to the same store. New blobs may
+    be staged in a directory of their own and published once the output
+    referring to them is complete.
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def blob_path(self, digest, compression, root=None):
+        return os.path.join(root or self.root, 'blobs', digest[:2],
+                            digest[2:] + COMPRESSIONS[compression][0])
+
+    def manifest_path(self, name):
+        return os.path.join(self.root, 'manifests', name + '.json')
+
+    def put(self, data, compression='none', staging=None):
+        """Stores the contents of a file unless an identical one is stored,
+        in which case that blob is shared. New blobs are written to the
+        staging directory if one is given. Returns the manifest entry."""
+        digest = hashlib.sha256(data).hexdigest()
+
+        for method in COMPRESSIONS:
+            if os.path.exists(self.blob_path(digest, method)) or \
+                    staging and os.path.exists(
+                        self.blob_path(digest, method, staging)):
+                compression = method
+                break
+        else:
+            _replace(self.blob_path(digest, compression, staging),
+                     COMPRESSIONS[compression][1](data))
+
+        return {
+            'blob': digest,
+            'size': len(data),
+            'compression': compression,
+        }
+
+    def put_csv(self, header, rows, compression='none', staging=None):
+        """Stores a CSV file like put.
+
+        Leading model and version columns with the same value in every row
+        are left out of the blob and kept in the entry instead, so the same
+        table of different models or versions shares its blob.
+        """
+        rows = [list(row) for row in rows]
+        n = 0
+
+        while n < min(len(SHARED_COLUMNS), len(header)) and rows and \
+                header[n] == SHARED_COLUMNS[n] and \
+                all(row[n] == rows[0][n] for row in rows):
+            n += 1
+
+        entry = self.put(render_csv(header[n:], [row[n:] for row in rows]),
+                         compression, staging)
+
+        if n:
+            entry['columns'] = [[header[i], _text(rows[0][i])]
+                                for i in range(n)]
+            entry['size'] = len(render_csv(header, rows))
+
+        return entry
+
+    def get(self, entry, staging=None):
+        """Returns the contents of a file by its manifest entry, which may
+        refer to a blob of the staging directory if one is given."""
+        fn = self.blob_path(entry['blob'], entry['compression'])
+
+        if staging and not os.path.exists(fn):
+            fn = self.blob_path(entry['blob'], entry['compression'], staging)
+
+        with open(fn, 'rb') as f:
+            data = COMPRESSIONS[entry['compression']][2](f.read())
+
+        if not entry.get('columns'):
+            return data
+
+        names, values = zip(*entry['columns'])
+        reader = csv.reader(io.StringIO(data.decode('utf8')))
+        header = next(reader)
+
+        return render_csv(list(names) + header,
+                          (list(values) + row for row in reader))
+
+    def stage(self):
+        """Returns a new staging directory for the blobs of an output, after
+        removing those left by processes that died."""
+        root = os.path.join(self.root, 'staging')
+
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+
+        for fn in os.listdir(root):
+            pid = fn.split('-', 1)[0]
+
+            if pid.isdigit() and not _alive(int(pid)):
+                shutil.rmtree(os.path.join(root, fn), ignore_errors=True)
+
+        return tempfile.mkdtemp(prefix='{}-'.format(os.getpid()), dir=root)
+
+    def publish(self, staging):
+        "Moves the blobs of a staging directory into the store."
+        root = os.path.join(staging, 'blobs')
+
+        for dirpath, _, files in os.walk(root):
+            for fn in files:
+                src = os.path.join(dirpath, fn)
+                dst = os.path.join(self.root, 'blobs',
+                                   os.path.relpath(src, root))
+
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(src, dst)
+
+        shutil.rmtree(staging)
+
+    def names(self):
+        "Returns the names of the stored manifests."
+        root = os.path.join(self.root, 'manifests')
+        names = []
+
+        for dirpath, _, files in os.walk(root):
+            for fn in files:
+                if fn.endswith('.json'):
+                    names.append(os.path.relpath(
+                        os.path.join(dirpath, fn), root)[:-5])
+
+        return sorted(names)
+
+    def load(self, name):
+        "Returns the entries by path of a manifest, or None if it is missing."
+        try:
+            with open(self.manifest_path(name)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        if data.get('format') != STORE_FORMAT:
+            raise ValueError('{} is not a store manifest'.format(name))
+
+        return data['files']
+
+    def save(self, name, files):
+        "Writes the manifest of an output."
+        data = {
+            'format': STORE_FORMAT,
+            'version': 1,
+            'files': files,
+        }
+
+        _replace(self.manifest_path(name), json.dumps(
+            data, indent=2, sort_keys=True).encode('utf8'))
+
+    def gc(self):
+        """Removes the blobs no manifest refers to, e.g. left by aborted
+        runs or replaced outputs. Returns the number of blobs and bytes
+        removed. It must not run while outputs are being written."""
+        used = set()
+
+        for name in self.names():
+            for entry in self.load(name).values():
+                used.add(self.blob_path(entry['blob'], entry['compression']))
+
+        count = size = 0
+
+        for dirpath, _, files in os.walk(os.path.join(self.root, 'blobs')):
+            for fn in files:
+                path = os.path.join(dirpath, fn)
+
+                if path not in used:
+                    size += os.path.getsize(path)
+                    count += 1
+                    os.remove(path)
+
+        return count, size
+
+
+class StoreSink(Sink):
+    """Writes the files of an output to a blob store.
+
+    Only files whose contents are not yet stored take space, so outputs
+    sharing most of their files, such as projects built on the same
+    instruments or successive runs of a database, are cheap to keep.
+
+    New blobs are staged and only published on commit, when the manifest
+    of the output replaces the previous one. Aborting removes them.
+    """
+    def __init__(self, root, name, compression='none'):
+        super().__init__()
+
+        check_compression(compression)
+
+        self.blobs = BlobStore(root)
+        self.name = name
+        self.compression = compression
+        self.previous = self.blobs.load(name) or {}
+        self.files = {}
+        self.staging = self.blobs.stage()
+
+    def settings(self):
+        return {'format': 'tree', 'compression': self.compression}
+
+    def write(self, files):
+        # Files are hashed and compressed outside of the lock.
+        entries = [(path, self.blobs.put_csv(header, rows, self.compression,
+                                             self.staging))
+                   for path, header, rows in files]
+
+        with self.lock:
+            self.files.update(entries)
+
+    def store(self, batch):
+        for path, data in batch:
+            self.files[path] = self.blobs.put(data, self.compression,
+                                              self.staging)
+
+    def extend(self, batch):
+        # Blobs are immutable, so the file is stored again as a whole.
+        for path, data in batch:
+            old = self.blobs.get(self.files[path], self.staging)
+            self.store([(path, old + data)])
+
+    def read(self, path):
+        entry = self.previous.get(path)
+
+        if entry is None:
+            return None
+
+        return self.blobs.get(entry)
+
+    def keep(self, path):
+        # Unchanged files only need their manifest entries.
+        prefix = path.rstrip('/') + '/'
+
+        with self.lock:
+            for name, entry in self.previous.items():
+                if name == path or name.startswith(prefix):
+                    self.files[name] = entry
+
+    def commit(self):
+        # Blobs are published first so the manifest never refers to
+        # missing ones.
+        self.blobs.publish(self.staging)
+        self.blobs.save(self.name, self.files)
+
+    def abort(self):
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def read_archive(path):
+    """Returns the files of a zip or tar archive by path, or an empty dict
+    if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+
+    return dict(archive_members(path))
+
+
+def archive_members(path):
+    "Yields the (path, data) pairs of the files of a zip or tar archive."
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if not name.endswith('/'):
+                    yield name, archive.read(name)
+
+        return
+
+    with tarfile.open(path) as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member).read()
+
+
+def read_jsonl(data, headers):
+    """Returns the rows by entity of a JSON-lines bundle, with the columns
+    in the order of the entity's header."""
+    rows = defaultdict(list)
+
+    for line in gzip.decompress(data).decode('utf8').splitlines():
+        record = json.loads(line)
+        entity = record.pop('entity')
+        header = headers.get(entity, tuple(record))
+        rows[entity].append(tuple(record.get(c) for c in header))
+
+    return rows
+
+
+def read_sqlite(data):
+    "Returns the rows by entity of a SQLite bundle."
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as f:
+        f.write(data)
+        f.flush()
+
+        conn = sqlite3.connect(f.name)
+
+        try:
+            names = conn.execute("SELECT name FROM sqlite_master "
+                                 "WHERE type = 'table'").fetchall()
+
+            return {entity: conn.execute(
+                'SELECT * FROM "{}" ORDER BY rowid'.format(entity))
+                .fetchall() for (entity,) in names}
+        finally:
+            conn.close()
+
+
+FORMATS = ('tree', 'flat', 'jsonl', 'sqlite')
+
+
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.zip')
+
+
+def open_sink(path, format='tree', store=None, compression='none'):
+    """Returns the sink for an output path based on its extension and the
+    output format, one of FORMATS. If a blob store directory is given, the
+    output is written to it instead, with the path as the manifest name."""
+    if store is not None:
+        sink = StoreSink(store, path, compression)
+    elif path.endswith(ARCHIVE_EXTENSIONS):
+        sink = ArchiveSink(path)
+    else:
+        sink = DirectorySink(path)
+
+    if format == 'tree':
+        return sink
+
+    return BundleSink(sink, format)
+
+
+def render_csv(header, rows):
+    "Returns the bytes of a CSV file, without a header line if it is None."
+    buf = io.StringIO()
+    w = csv.writer(buf)
+
+    if header is not None:
+        w.writerow(header)
+
+    w.writerows(rows)
+
+    return buf.getvalue().encode('utf8')
+
+
+def _text(value):
+    # Values as the csv module writes them.
+    return '' if value is None else str(value)
+
+
+def _replace(path, data):
+    "Writes a file through a temporary file renamed into place."
+    dirname = os.path.dirname(path)
+
+    if not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+
+    tmp = '{}.tmp-{}-{}'.format(path, os.getpid(), threading.get_ident())
+
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# Distinguishes the staging directories of the sinks of a process.
+_staging_ids = itertools.count()
+
+# renameat2 flag exchanging two paths.
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+
+def _exchange(a, b):
+    """Atomically exchanges two paths if the system supports it and returns
+    whether it did."""
+    if not sys.platform.startswith('linux'):
+        return False
+
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+
+    return renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b),
+                     RENAME_EXCHANGE) == 0
+
+
+def _alive(pid):
+    "Returns true unless the process is known not to be running."
+    if os.name != 'posix':
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
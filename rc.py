@@ -1,19 +1,18 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import sys
 import csv
-import shutil
 from getpass import getpass
-from concurrent.futures import ThreadPoolExecutor
-from redcap import Project
-from sqlalchemy import create_engine
-from sqlalchemy.sql import text
-from sqlalchemy.engine.url import URL
+from functools import lru_cache
+from itertools import groupby
+from operator import attrgetter
+from collections import namedtuple, OrderedDict
 from constants import MODEL_COLUMNS, TABLE_COLUMNS, FIELD_COLUMNS, \
     SCHEMA_COLUMNS
-import _redcap
-
-_redcap.patch()
+import manifest
+from output import open_sink, check_compression, FORMATS
 
 
 # Standard set of fields for REDCap metadata.
@@ -37,210 +36,507 @@ redcap_fields = (
     'matrix_ranking',
 )
 
+# Record of a field's metadata with the attributes of `redcap_fields`.
+Field = namedtuple('Field', redcap_fields)
+
+
+def field_from_row(row):
+    """Returns the record of a data dictionary row, ignoring extra columns
+    and filling in missing ones with None."""
+    n = len(redcap_fields)
+
+    if len(row) < n:
+        row = list(row) + [None] * (n - len(row))
+
+    return Field._make(row[:n])
+
+
+def field_from_dict(data):
+    "Returns the record of a field exported from the API."
+    return Field._make(data.get(k) for k in redcap_fields)
 
-def db_connect(database, host, port, user, password):
-    # Construct engine URL
-    url = URL('mysql+pymysql',
-              username=user,
-              password=password,
-              host=host,
-              port=port,
-              database=database)
 
-    return create_engine(url)
+def db_url(database, host, port, user, password):
+    "Returns the URL of a REDCap database."
+    # SQLAlchemy is only needed for the database modes.
+    from sqlalchemy.engine.url import URL
+
+    return URL('mysql+pymysql',
+               username=user,
+               password=password,
+               host=host,
+               port=port,
+               database=database)
+
+
+def db_connect(database, host, port, user, password):
+    from sqlalchemy import create_engine
+
+    return create_engine(db_url(database, host, port, user, password))
+
+
+# Column of redcap_metadata holding each field.
+DB_COLUMNS = {
+    'field_name': 'field_name',
+    'form_name': 'form_name',
+    'section_header': 'element_preceding_header',
+    'field_type': 'element_type',
+    'field_label': 'element_label',
+    'select_choices_or_calculations': 'element_enum',
+    'field_note': 'element_note',
+    'text_validation_type_or_show_slider_number': 'element_validation_type',
+    'text_validation_min': 'element_validation_min',
+    'text_validation_max': 'element_validation_max',
+    'identifier': 'field_phi',
+    'branching_logic': 'branching_logic',
+    'required_field': 'field_req',
+    'custom_alignment': 'custom_alignment',
+    'question_number': 'question_num',
+    'matrix_group_name': 'grid_name',
+    'matrix_ranking': 'grid_rank',
+}
+
+# Select list of the redcap_metadata columns in the order of the Field
+# attributes, so rows map onto records by position.
+db_metadata_columns = ', '.join(
+    'redcap_metadata.{} AS {}'.format(DB_COLUMNS[field], field)
+    for field in redcap_fields)
 
 
 def db_metadata(conn, project):
-    "Returns records from a REDCap database."
+    """Returns an iterator of the field records of a project in a REDCap
+    database.
+
+    Rows are streamed with a server-side cursor and turned into records
+    as they are read, so a project is never held in memory as a whole.
+    """
+    from sqlalchemy.sql import text
 
     sql = text('''
-        SELECT
-            field_name,
-            form_name,
-            element_preceding_header as section_header,
-            element_type as field_type,
-            element_label as field_label,
-            element_enum as choices_calc_slider,
-            element_note as field_note,
-            element_validation_type as validation_type,
-            element_validation_min as validation_min,
-            element_validation_max as validation_max,
-            field_phi as identifier,
-            branching_logic,
-            field_req as required,
-            custom_alignment,
-            question_num as question_number,
-            grid_name as matrix_group_name
+        SELECT {}
         FROM redcap_metadata JOIN redcap_projects
             ON (redcap_metadata.project_id = redcap_projects.project_id)
         WHERE redcap_projects.project_name = :project
         ORDER BY field_order
-    ''')
+    '''.format(db_metadata_columns))
 
-    query = conn.execute(sql, project=project)
+    query = conn.execution_options(stream_results=True).execute(
+        sql, project=project)
 
-    return [dict(zip(redcap_fields, row)) for row in query]
+    return _records(query)
 
 
-def get_field_type(field):
-    "Returns the data models field type based on properties of the field."
-    val_type = field['text_validation_type_or_show_slider_number']
+def _records(query):
+    try:
+        for row in query:
+            yield Field._make(row)
+    finally:
+        query.close()
 
-    if val_type == 'date_ymd':
-        return 'date'
 
-    return 'string'
+# Separates choices and slider labels. Exported dictionaries use pipes
+# while the database stores literal "\n" sequences.
+choices_separator = re.compile(r'\s*(?:\||\\n)\s*')
 
 
+def split_choices(s):
+    "Splits a choices string on its separators."
+    # Plain string splitting is much faster for the common export format.
+    if '\\n' in s:
+        return choices_separator.split(s.strip())
+
+    return s.split('|')
+
+
+# Bound on the number of distinct choice strings kept parsed. The same
+# enumerations (yes/no, matrix groups) repeat across fields and projects.
+CHOICES_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CHOICES_CACHE_SIZE)
 def parse_choices(s):
-    "Parses and returns field choices."
+    "Parses and returns field choices as a tuple of (code, label) pairs."
     choices = []
 
     if not s:
-        return
+        return ()
 
-    # Split by pipe, then by the first comma.
-    for t in s.split('|'):
+    # Split by separator, then by the first comma.
+    for t in split_choices(s):
         c = t.split(',', 1)
 
         # Could not parse, assume it is a calculation intead.
         if len(c) < 2:
-            return
+            return ()
+
+        choices.append((c[0].strip(), c[1].strip()))
+
+    return tuple(choices)
+
+
+@lru_cache(maxsize=CHOICES_CACHE_SIZE)
+def parse_slider(s):
+    "Parses and returns the left, middle and right labels of a slider."
+    if not s:
+        return ()
+
+    return tuple(t.strip() for t in split_choices(s) if t.strip())
+
+
+@lru_cache(maxsize=CHOICES_CACHE_SIZE)
+def describe_choices(field_type, s):
+    "Describes the choices, calculation or slider labels of a field."
+    if not s:
+        return ''
+
+    if field_type == 'calc':
+        return 'Calculated as {}.'.format(s.strip())
+
+    if field_type == 'slider':
+        labels = parse_slider(s)
+
+        if labels:
+            return 'Slider labels: {}.'.format(', '.join(labels))
 
-        choices.append(c[1].strip())
+        return ''
+
+    # The column holds a query for sql fields.
+    if field_type == 'sql':
+        return ''
+
+    choices = parse_choices(s)
+
+    if choices:
+        return 'Choices include: {}'.format(
+            ', '.join(label for _, label in choices))
 
-    return choices
+    return ''
 
 
 def get_field_description(field):
     "Combines section header, field note and choices to form a description."
     toks = []
 
-    if field['field_note']:
-        toks.append(field['field_note'])
+    if field.field_note:
+        toks.append(field.field_note)
 
-    if field['section_header']:
-        toks.append('Under section {}.'.format(field['section_header']))
+    if field.section_header:
+        toks.append('Under section {}.'.format(field.section_header))
 
-    choices = parse_choices(field['select_choices_or_calculations'])
+    if field.select_choices_or_calculations:
+        choices = describe_choices(field.field_type,
+                                   field.select_choices_or_calculations)
 
-    if choices:
-        toks.append('Choices include: {}'.format(', '.join(choices)))
+        if choices:
+            toks.append(choices)
 
     return ' '.join(toks)
 
 
-def generate(rc_fields, model, version, root):
-    # Models file.
-    with open(os.path.join(root, 'models.csv'), 'w') as f:
-        w = csv.writer(f)
-        w.writerows([
-            MODEL_COLUMNS,
-            (model, version, '', '', ''),
-        ])
+# Schema of a field whose type is determined by its choice codes.
+CODED = object()
 
-    tables = {}
+# Schema used for field types not in the table below.
+DEFAULT_SCHEMA = ('string', '', '', '')
 
-    for f in rc_fields:
-        # Treat the form as the table. The section will be included
-        # in the field description if one is present.
-        table = f['form_name']
 
-        field = f['field_name']
+def _field_schemas():
+    "Maps (field type, validation) to (type, length, precision, scale)."
+    schemas = {
+        ('text', None): DEFAULT_SCHEMA,
+        ('notes', None): DEFAULT_SCHEMA,
+        ('descriptive', None): DEFAULT_SCHEMA,
+        ('file', None): DEFAULT_SCHEMA,
+        ('sql', None): DEFAULT_SCHEMA,
+        ('calc', None): ('number', '', '', ''),
+        ('slider', None): ('integer', '', '', ''),
+        ('yesno', None): ('boolean', '', '', ''),
+        ('truefalse', None): ('boolean', '', '', ''),
+        ('radio', None): CODED,
+        ('dropdown', None): CODED,
+        ('select', None): CODED,
 
-        # Initialize table entry. Constraints could be included
-        # for the `identifier` and `field_required` fields.
-        if table not in tables:
-            tables[table] = {
-                'fields': [],
-                'schemata': [],
-            }
+        ('text', 'integer'): ('integer', '', '', ''),
+        ('text', 'int'): ('integer', '', '', ''),
+        ('text', 'number'): ('number', '', '', ''),
+        ('text', 'float'): ('number', '', '', ''),
+        ('text', 'number_comma_decimal'): ('number', '', '', ''),
+        ('text', 'date'): ('date', '', '', ''),
+        ('text', 'datetime'): ('datetime', '', '', ''),
+        ('text', 'datetime_seconds'): ('datetime', '', '', ''),
+        ('text', 'time'): ('time', '', '', ''),
+        ('text', 'time_mm_ss'): ('time', '', '', ''),
+        ('text', 'zipcode'): ('string', 10, '', ''),
+        ('text', 'ssn'): ('string', 11, '', ''),
+        ('text', 'phone'): ('string', 14, '', ''),
+    }
 
-        # Add field to table.
-        tables[table]['fields'].append((
-            model,
-            version,
-            table,
-            field,
-            f['field_label'],
-            get_field_description(f),
-        ))
+    for order in ('ymd', 'mdy', 'dmy'):
+        schemas[('text', 'date_' + order)] = ('date', '', '', '')
+        schemas[('text', 'datetime_' + order)] = ('datetime', '', '', '')
+        schemas[('text', 'datetime_seconds_' + order)] = \
+            ('datetime', '', '', '')
 
-        # Add field schema to table.
-        tables[table]['schemata'].append((
-            model,
-            version,
-            table,
-            field,
-            get_field_type(f),
-            '',  # length
-            '',  # precision
-            '',  # scale
-            '',  # default
-        ))
+    # Fixed decimal places, e.g. number_2dp and number_2dp_comma_decimal.
+    for scale in range(1, 5):
+        schema = ('number', '', '', scale)
+        schemas[('text', 'number_{}dp'.format(scale))] = schema
+        schemas[('text', 'number_{}dp_comma_decimal'.format(scale))] = schema
+
+    return schemas
+
+
+FIELD_SCHEMAS = _field_schemas()
+
+
+@lru_cache(maxsize=CHOICES_CACHE_SIZE)
+def coded_schema(s):
+    "Returns the schema of a field stored as one of its choice codes."
+    codes = [code for code, _ in parse_choices(s)]
+
+    if not codes:
+        return DEFAULT_SCHEMA
+
+    if all(code.lstrip('-').isdigit() for code in codes):
+        return ('integer', '', '', '')
+
+    return ('string', max(len(code) for code in codes), '', '')
+
+
+def get_field_schema(field):
+    "Returns the (type, length, precision, scale) of a field."
+    field_type = field.field_type
+    val_type = field.text_validation_type_or_show_slider_number or None
+
+    schema = FIELD_SCHEMAS.get((field_type, val_type)) or \
+        FIELD_SCHEMAS.get((field_type, None), DEFAULT_SCHEMA)
+
+    if schema is CODED:
+        return coded_schema(field.select_choices_or_calculations)
+
+    return schema
+
+
+def get_field_type(field):
+    "Returns the data models field type based on properties of the field."
+    return get_field_schema(field)[0]
+
+
+def checkbox_column(field_name, code):
+    "Returns the name REDCap stores a checkbox choice under."
+    code = re.sub(r'[^a-z0-9_]', '_', code.lower())
+
+    return '{}___{}'.format(field_name, code)
+
+
+def get_field_columns(field):
+    """Yields (name, label, description, schema) for each column a field is
+    stored as. Checkboxes are stored as one column per choice, or as a single
+    text column if their choices cannot be parsed."""
+    name = field.field_name
+    label = field.field_label
+    description = get_field_description(field)
+    choices = ()
+
+    if field.field_type == 'checkbox':
+        choices = parse_choices(field.select_choices_or_calculations)
+
+    if not choices:
+        yield name, label, description, get_field_schema(field)
+        return
+
+    for code, choice in choices:
+        yield (checkbox_column(name, code),
+               '{} (choice={})'.format(label, choice),
+               description,
+               ('boolean', '', '', ''))
+
+
+def read_dictionary(path):
+    "Yields the field records of a REDCap data dictionary file."
+    with open(path, encoding='latin-1') as f:
+        reader = csv.reader(f)
+
+        # Skip header
+        next(reader)
+
+        for row in reader:
+            yield field_from_row(row)
+
+
+def group_forms(rc_fields):
+    """Yields (form, fields) pairs for each run of fields of the same form.
+
+    REDCap orders fields by form, so each form is normally a single run,
+    yielded as soon as it starts. Fields of a form that come again after
+    other forms, as in a dictionary edited by hand, are held and yielded
+    at the end as a second pair per form, so only those are buffered.
+    """
+    seen = set()
+    later = OrderedDict()
+
+    for form, fields in groupby(rc_fields, key=attrgetter('form_name')):
+        if form in seen:
+            later.setdefault(form, []).extend(fields)
+            continue
+
+        seen.add(form)
+
+        yield form, fields
+
+    yield from later.items()
+
+
+def generate(rc_fields, model, version, sink, incremental=False):
+    """Writes the model files for REDCap metadata records to the sink.
+
+    The records are Field tuples in any iterable ordered by form. Each
+    form's files are written as soon as the next form starts, so only one
+    form is held in memory at a time. The rows of fields that come after
+    other forms are appended to the files of their form.
+
+    In incremental mode, forms whose metadata fingerprint matches the
+    manifest of the previous run are carried over rather than rewritten.
+    """
+    # Models file.
+    sink.write([
+        ('models.csv', MODEL_COLUMNS, [(model, version, '', '', '')]),
+    ])
+
+    previous = manifest.load(sink, model, version) if incremental else {}
+    current = {}
+    changes = manifest.new_changes()
+
+    # Treat the form as the table. The section will be included
+    # in the field description if one is present.
+    for table, fields in group_forms(rc_fields):
+        data, metadata = form_data(model, version, table, fields)
+
+        if table in current:
+            append_form(sink, model, version, table, data, metadata,
+                        previous, current, changes)
+            continue
+
+        fp = manifest.fingerprint(metadata)
+        current[table] = {'fingerprint': fp}
+
+        if manifest.compare(previous, table, fp, changes):
+            generate_table_files(sink, model, version, table, data)
+        else:
+            sink.keep(table)
 
     # Tables file.
-    generate_tables(root, model, version, tables.keys())
+    generate_tables(sink, model, version, current.keys())
 
-    workers = os.cpu_count()
-    pool = ThreadPoolExecutor(max_workers=workers)
+    manifest.save(sink, model, version, current)
 
-    for table, data in tables.items():
-        pool.submit(generate_table_files, root, model, version, table, data)
+    if incremental:
+        manifest.removed(previous, current, changes)
+        manifest.report(changes)
 
-    pool.shutdown()
 
+def append_form(sink, model, version, table, data, metadata, previous,
+                current, changes):
+    """Appends the rows of the later fields of a form to its files and
+    records the change status of the form as a whole."""
+    entry = current[table]
+    entry['fingerprint'] = manifest.fingerprint((entry['fingerprint'],
+                                                 metadata))
 
-def generate_tables(dirname, model, version, tables):
-    "Creates a tables file."
-    fn = os.path.join(dirname, 'tables.csv')
+    for status in changes.values():
+        if table in status:
+            status.remove(table)
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(TABLE_COLUMNS)
+    manifest.compare(previous, table, entry['fingerprint'], changes)
+
+    generate_table_files(sink, model, version, table, data, append=True)
+
+
+def form_data(model, version, table, fields):
+    """Returns the field and schema rows of a form along with the metadata
+    its fingerprint is computed from."""
+    # Constraints could be included for the `identifier` and
+    # `field_required` fields.
+    data = {
+        'fields': [],
+        'schemata': [],
+    }
+
+    metadata = []
+
+    for f in fields:
+        metadata.append(tuple(f))
+
+        for field, label, description, schema in get_field_columns(f):
+            # Add field to table.
+            data['fields'].append((
+                model,
+                version,
+                table,
+                field,
+                label,
+                description,
+            ))
 
-        for table in tables:
-            w.writerow([
+            # Add field schema to table.
+            data['schemata'].append((
                 model,
                 version,
                 table,
-                '',
-            ])
+                field,
+                schema[0],  # type
+                schema[1],  # length
+                schema[2],  # precision
+                schema[3],  # scale
+                '',  # default
+            ))
 
+    return data, metadata
 
-def generate_table_files(dirname, model, version, table, data):
-    "Creates a field and schema files."
-    dirname = os.path.join(dirname, table)
 
-    if not os.path.exists(dirname):
-        os.mkdir(dirname)
+def generate_tables(sink, model, version, tables):
+    "Creates a tables file."
+    rows = []
+
+    for table in tables:
+        rows.append([
+            model,
+            version,
+            table,
+            '',
+        ])
 
-    fn = os.path.join(dirname, 'fields.csv')
+    sink.write([
+        ('tables.csv', TABLE_COLUMNS, rows),
+    ])
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(FIELD_COLUMNS)
-        w.writerows(data['fields'])
 
-    fn = os.path.join(dirname, 'schema.csv')
+def generate_table_files(sink, model, version, table, data, append=False):
+    "Creates a field and schema files, or appends to them."
+    write = sink.append if append else sink.write
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(SCHEMA_COLUMNS)
-        w.writerows(data['schemata'])
+    write([
+        (os.path.join(table, 'fields.csv'), FIELD_COLUMNS, data['fields']),
+        (os.path.join(table, 'schema.csv'), SCHEMA_COLUMNS,
+         data['schemata']),
+    ])
 
 
 def main(argv=None):
     usage = """REDCap Data Model Generator
 
     Usage:
-        redcap csv  <model> <version> <path>        [--dir=DIR]
-        redcap api  <model> <version> <url> <token> [--dir=DIR]
-        redcap db   <model> <version> <project>     [--dir=DIR] [--db=DB] [--host=HOST] [--port=PORT] [--user=USER] [--pass=PASS]
+        redcap csv  <model> <version> <path>        [--dir=DIR] [--format=FORMAT] [--store=DIR] [--compress=METHOD] [--incremental]
+        redcap api  <model> <version> <url> <token> [--dir=DIR] [--format=FORMAT] [--store=DIR] [--compress=METHOD] [--incremental]
+        redcap db   <model> <version> <project>     [--dir=DIR] [--format=FORMAT] [--store=DIR] [--compress=METHOD] [--incremental] [--db=DB] [--host=HOST] [--port=PORT] [--user=USER] [--pass=PASS]
 
     Options:
         -h --help       Show this screen.
-        --dir=DIR       Name of the directory to output the files.
+        --dir=DIR       Name of the directory to output the files. Paths ending in .tar, .tar.gz, .tgz or .zip are written as a single archive.
+        --format=FORMAT     Layout of the output: tree, flat, jsonl or sqlite, see the sql command [default: tree].
+        --store=DIR     Write the files to a content-addressed blob store rather than the output directory, see the sql command.
+        --compress=METHOD   Compression of the files in the blob store, none, gzip or zstd [default: gzip].
+        --incremental   Only rewrite forms that changed since the last run, based on the manifest in the output directory.
         --db=DB         Name of the REDCap database [default: redcap].
         --host=HOST     Host of the database server [default: localhost].
         --port=PORT     Port of the database server [default: 3306].
@@ -253,31 +549,40 @@ def main(argv=None):
 
     args = docopt(usage, argv=argv, version='0.1')
 
+    if args['--format'] not in FORMATS:
+        print('error: unknown format {}'.format(args['--format']),
+              file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        check_compression(args['--compress'])
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
     # Default to a directory named after the database.
     if not args['--dir']:
         args['--dir'] = os.path.join(os.getcwd(),
                                      args['<model>'],
                                      args['<version>'])
 
-    # Ensure the output directory is created.
-    rootdir = args['--dir']
-
-    if os.path.exists(rootdir):
-        shutil.rmtree(rootdir)
-
-    os.makedirs(rootdir)
+    # Outputs in a blob store are named after the model and version.
+    if args['--store']:
+        args['--dir'] = os.path.join(args['<model>'], args['<version>'])
 
     # File path
     if args['csv']:
-        with open(args['<path>'], encoding='latin-1') as f:
-            # Skip header
-            next(f)
-            r = csv.DictReader(f, fieldnames=redcap_fields)
-            fields = list(r)
+        fields = read_dictionary(args['<path>'])
 
     elif args['api']:
+        # PyCap and its patch are only loaded for the API mode.
+        from redcap import Project
+        import _redcap
+
+        _redcap.patch()
+
         project = Project(args['<url>'], args['<token>'])
-        fields = project.export_metadata(format='json')
+        fields = map(field_from_dict, project.export_metadata(format='json'))
 
     elif args['db']:
         if args['--pass'] == '*':
@@ -291,7 +596,12 @@ def main(argv=None):
 
         fields = db_metadata(conn, args['<project>'])
 
-    generate(fields, args['<model>'], args['<version>'], args['--dir'])
+    # The output is staged and only replaces the previous tree once
+    # everything has been written.
+    with open_sink(args['--dir'], args['--format'], args['--store'],
+                   args['--compress']) as sink:
+        generate(fields, args['<model>'], args['<version>'], sink,
+                 incremental=args['--incremental'])
 
 
 if __name__ == '__main__':
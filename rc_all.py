@@ -1,55 +1,128 @@
 #!/usr/bin/env python3
 
 import os
-import shutil
+import sys
+import csv
+import time
 from getpass import getpass
-from concurrent.futures import ProcessPoolExecutor
-from sqlalchemy.sql import text
-from rc import db_connect, db_metadata, generate
+from itertools import groupby
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from output import DirectorySink, StoreSink, check_compression
+from rc import db_connect, db_metadata_columns, Field, generate
 
 
-def worker(project, index, args):
-    conn = db_connect(args['--db'],
-                      args['--host'],
-                      args['--port'],
-                      args['--user'],
-                      args['--pass'])
+REPORT_COLUMNS = (
+    'project',
+    'status',
+    'fields',
+    'seconds',
+    'error',
+)
+
+
+def worker(project, fields, version, dirname, incremental=False, store=None,
+           compression='none'):
+    """Writes the model tree of a single project, or its output in a blob
+    store if one is given, and returns the elapsed time."""
+    start = time.time()
 
-    fields = db_metadata(conn, project)
+    if store:
+        sink = StoreSink(store, os.path.join(project, version), compression)
+    else:
+        sink = DirectorySink(os.path.join(dirname, project, version))
 
-    if not fields:
-        return
+    with sink:
+        generate(fields, project, version, sink, incremental=incremental)
 
-    rootdir = os.path.join(args['<dir>'],
-                           project,
-                           args['<version>'])
+    return time.time() - start
 
-    if os.path.exists(rootdir):
-        shutil.rmtree(rootdir)
 
-    os.makedirs(rootdir)
+def db_metadata_all(conn, projects=None):
+    """Yields (project, fields) pairs for every project with metadata.
 
-    generate(fields, project, args['<version>'], rootdir)
+    The metadata of all projects is fetched with a single query ordered by
+    project, streamed and partitioned in one pass.
+    """
+    from sqlalchemy.sql import text
 
+    params = {}
+    where = ''
+
+    if projects:
+        names = []
+
+        for i, project in enumerate(projects):
+            params['p{}'.format(i)] = project
+            names.append(':p{}'.format(i))
+
+        where = 'WHERE redcap_projects.project_name IN ({})'.format(
+            ', '.join(names))
 
-def db_projects(conn):
     sql = text('''
         SELECT
-            project_name
-        FROM
-            redcap_projects
-    ''')
+            redcap_projects.project_name,
+            {}
+        FROM redcap_metadata JOIN redcap_projects
+            ON (redcap_metadata.project_id = redcap_projects.project_id)
+        {}
+        ORDER BY redcap_projects.project_name, field_order
+    '''.format(db_metadata_columns, where))
+
+    query = conn.execution_options(stream_results=True).execute(sql, **params)
+
+    for project, rows in groupby(query, key=itemgetter(0)):
+        yield project, [Field._make(row[1:]) for row in rows]
+
 
-    query = conn.execute(sql)
+def export(conn, version, dirname, procs, projects=None, incremental=False,
+           store=None, compression='none'):
+    """Writes every project's model tree using a bounded process pool.
 
-    return [row[0] for row in query]
+    Returns a list of report rows, one per project.
+    """
+    report = []
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            project, nfields = pending.pop(future)
+
+            try:
+                seconds = future.result()
+            except Exception as e:
+                row = (project, 'failed', nfields, '', str(e))
+            else:
+                row = (project, 'ok', nfields, '{:.3f}'.format(seconds), '')
+
+            print('{:6} {} ({} fields)'.format(row[1], project, nfields),
+                  file=sys.stderr)
+
+            report.append(row)
+
+    with ProcessPoolExecutor(max_workers=procs) as pool:
+        for project, fields in db_metadata_all(conn, projects):
+            # Bound the number of partitions held in memory.
+            if len(pending) >= procs * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            future = pool.submit(worker, project, fields, version, dirname,
+                                 incremental, store, compression)
+            pending[future] = (project, len(fields))
+
+        collect(wait(pending).done)
+
+    report.sort()
+
+    return report
 
 
 def main(argv=None):
     usage = """REDCap Data Model Generator
 
     Usage:
-        redcap dball <version> [--dir=DIR] [--db=DB] [--host=HOST] [--port=PORT] [--user=USER] [--pass=PASS]
+        redcap dball <version> [<project>...] [--dir=DIR] [--db=DB] [--host=HOST] [--port=PORT] [--user=USER] [--pass=PASS] [--procs=PROCS] [--report=FILE] [--incremental] [--store=DIR] [--compress=METHOD]
 
     Options:
         -h --help       Show this screen.
@@ -60,6 +133,10 @@ def main(argv=None):
         --user=USER     Username to connect with.
         --pass=PASS     Password to connect with. If set to *, a prompt will be provided.
         --procs=PROCS   Number of processes to spawn [default: 24].
+        --report=FILE   Write a CSV report of the status and timing of each project.
+        --incremental   Only rewrite forms that changed since the last run of each project.
+        --store=DIR     Write the files to a content-addressed blob store rather than the output directory, with the output of each project named <project>/<version>. Instruments shared by projects are stored once.
+        --compress=METHOD   Compression of the files in the blob store, none, gzip or zstd [default: gzip].
 
     """  # noqa
 
@@ -67,6 +144,12 @@ def main(argv=None):
 
     args = docopt(usage, argv=argv, version='0.1')
 
+    try:
+        check_compression(args['--compress'])
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
     if args['--pass'] == '*':
         args['--pass'] = getpass('password: ')
 
@@ -76,14 +159,31 @@ def main(argv=None):
                       args['--user'],
                       args['--pass'])
 
-    project_names = db_projects(conn)
+    start = time.time()
+
+    report = export(conn,
+                    args['<version>'],
+                    args['--dir'],
+                    int(args['--procs']),
+                    args['<project>'],
+                    args['--incremental'],
+                    store=args['--store'],
+                    compression=args['--compress'])
+
+    failed = [row for row in report if row[1] != 'ok']
 
-    pool = ProcessPoolExecutor(max_workers=int(args['--procs']))
+    print('{} project(s) exported, {} failed in {:.1f}s'.format(
+        len(report) - len(failed), len(failed), time.time() - start),
+        file=sys.stderr)
 
-    for name in project_names:
-        pool.submit(worker, name, args)
+    if args['--report']:
+        with open(args['--report'], 'w') as f:
+            w = csv.writer(f)
+            w.writerow(REPORT_COLUMNS)
+            w.writerows(report)
 
-    pool.shutdown()
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from output import DirectorySink, StoreSink, check_compression
+from rc import generate, field_from_dict
+from rc_all import REPORT_COLUMNS
+
+
+# Columns of the token manifest.
+MANIFEST_COLUMNS = (
+    'model',
+    'version',
+    'url',
+    'token',
+)
+
+# Responses worth retrying; anything else is reported as is.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def read_manifest(path):
+    "Returns the entries of a token manifest CSV file."
+    with open(path) as f:
+        entries = list(csv.DictReader(f))
+
+    for i, entry in enumerate(entries):
+        missing = [c for c in MANIFEST_COLUMNS if not entry.get(c)]
+
+        if missing:
+            raise ValueError('line {} of {} is missing {}'.format(
+                i + 2, path, ', '.join(missing)))
+
+    return entries
+
+
+def new_session(workers):
+    "Returns a session that keeps a connection alive per worker."
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def fetch_metadata(session, url, token, retries=3, backoff=1, timeout=60):
+    """Exports the metadata of a project from the REDCap API.
+
+    Only the metadata endpoint is called. Connection errors, timeouts and
+    throttling or server errors are retried with exponential backoff.
+    """
+    payload = {
+        'token': token,
+        'content': 'metadata',
+        'format': 'json',
+    }
+
+    for attempt in range(retries + 1):
+        try:
+            resp = session.post(url, data=payload, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt == retries:
+                resp.raise_for_status()
+                return resp.json()
+
+        time.sleep(backoff * 2 ** attempt)
+
+
+def fetch(session, entry, retries, backoff, timeout):
+    start = time.time()
+
+    fields = fetch_metadata(session, entry['url'], entry['token'],
+                            retries=retries, backoff=backoff, timeout=timeout)
+    fields = [field_from_dict(f) for f in fields]
+
+    return fields, time.time() - start
+
+
+def export(entries, dirname, workers, retries=3, backoff=1, timeout=60,
+           incremental=False, store=None, compression='none'):
+    """Fetches the metadata of every entry concurrently and writes each
+    model tree as soon as its metadata arrives.
+
+    Returns a list of report rows, one per entry.
+    """
+    report = []
+    session = new_session(workers)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+
+        for entry in entries:
+            future = pool.submit(fetch, session, entry, retries, backoff,
+                                 timeout)
+            futures[future] = entry
+
+        for future in as_completed(futures):
+            entry = futures[future]
+            model, version = entry['model'], entry['version']
+            nfields = ''
+
+            try:
+                fields, seconds = future.result()
+                nfields = len(fields)
+
+                start = time.time()
+                if store:
+                    sink = StoreSink(store, os.path.join(model, version),
+                                     compression)
+                else:
+                    sink = DirectorySink(os.path.join(dirname, model,
+                                                      version))
+
+                with sink:
+                    generate(fields, model, version, sink,
+                             incremental=incremental)
+
+                seconds += time.time() - start
+            except Exception as e:
+                row = (model, 'failed', nfields, '', str(e))
+            else:
+                row = (model, 'ok', nfields, '{:.3f}'.format(seconds), '')
+
+            print('{:6} {} {}'.format(row[1], model, version),
+                  file=sys.stderr)
+
+            report.append(row)
+
+    session.close()
+    report.sort()
+
+    return report
+
+
+def main(argv=None):
+    usage = """REDCap Data Model Generator
+
+    Usage:
+        redcap apibatch <manifest> [--dir=DIR] [--workers=NUM] [--retries=NUM] [--backoff=SEC] [--timeout=SEC] [--report=FILE] [--incremental] [--store=DIR] [--compress=METHOD]
+
+    The manifest is a CSV file with a header and the columns model, version,
+    url and token. Each model is written to <dir>/<model>/<version>.
+
+    Options:
+        -h --help       Show this screen.
+        --dir=DIR       Name of the directory to output the files [default: .].
+        --workers=NUM   Number of concurrent requests [default: 8].
+        --retries=NUM   Number of retries of a failed request [default: 3].
+        --backoff=SEC   Seconds to wait before the first retry, doubled on each retry [default: 1].
+        --timeout=SEC   Seconds to wait for a response [default: 60].
+        --report=FILE   Write a CSV report of the status and timing of each model.
+        --incremental   Only rewrite forms that changed since the last run of each model.
+        --store=DIR     Write the files to a content-addressed blob store rather than the output directory, with each model named <model>/<version>.
+        --compress=METHOD   Compression of the files in the blob store, none, gzip or zstd [default: gzip].
+
+    """  # noqa
+
+    from docopt import docopt
+
+    args = docopt(usage, argv=argv, version='0.1')
+
+    try:
+        check_compression(args['--compress'])
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+    entries = read_manifest(args['<manifest>'])
+
+    start = time.time()
+
+    report = export(entries,
+                    args['--dir'],
+                    int(args['--workers']),
+                    retries=int(args['--retries']),
+                    backoff=float(args['--backoff']),
+                    timeout=float(args['--timeout']),
+                    incremental=args['--incremental'],
+                    store=args['--store'],
+                    compression=args['--compress'])
+
+    failed = [row for row in report if row[1] != 'ok']
+
+    print('{} model(s) exported, {} failed in {:.1f}s'.format(
+        len(report) - len(failed), len(failed), time.time() - start),
+        file=sys.stderr)
+
+    if args['--report']:
+        with open(args['--report'], 'w') as f:
+            w = csv.writer(f)
+            w.writerow(REPORT_COLUMNS)
+            w.writerows(report)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1031 @@
+import re
+import sys
+import time
+import fnmatch
+from decimal import Decimal
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from sqlalchemy import exc, inspect, types
+from sqlalchemy.sql import text
+from sqlalchemy.engine.url import make_url
+
+
+# Set-based catalog queries per dialect. Each query reflects a whole schema
+# and returns positional rows ordered by table so they can be grouped into
+# per-table records without touching the catalog again.
+#
+#   tables:      table
+#   columns:     table, column, type, length, precision, scale,
+#                nullable, default
+#   constraints: table, type ('p' or 'u'), key, name, column
+#   references:  table, key, name, column, ref_schema, ref_table, ref_column
+#   indexes:     table, name, column, unique
+#
+# The tables query lists views too if :views is 1. The other queries are
+# restricted to the selected tables through their {names[column]} field,
+# which renders as nothing when every table is selected.
+QUERIES = {
+    'postgresql': {
+        'tables': '''
+            SELECT c.relname
+            FROM pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+            WHERE n.nspname = :schema
+                AND (c.relkind IN ('r', 'p')
+                    OR (:views = 1 AND c.relkind IN ('v', 'm')))
+            ORDER BY c.relname
+        ''',
+
+        'columns': '''
+            SELECT
+                table_name,
+                column_name,
+                CASE data_type
+                    WHEN 'USER-DEFINED' THEN udt_name
+                    ELSE data_type
+                END,
+                character_maximum_length,
+                numeric_precision,
+                numeric_scale,
+                is_nullable,
+                column_default
+            FROM information_schema.columns
+            WHERE table_schema = :schema
+                {names[table_name]}
+            ORDER BY table_name, ordinal_position
+        ''',
+
+        'constraints': '''
+            SELECT c.relname, con.contype, con.conname, con.conname,
+                a.attname
+            FROM pg_catalog.pg_constraint con
+                JOIN pg_catalog.pg_class c ON (c.oid = con.conrelid)
+                JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+                CROSS JOIN LATERAL unnest(con.conkey)
+                    WITH ORDINALITY AS k(attnum, ord)
+                JOIN pg_catalog.pg_attribute a
+                    ON (a.attrelid = con.conrelid AND a.attnum = k.attnum)
+            WHERE n.nspname = :schema
+                AND con.contype IN ('p', 'u')
+                {names[c.relname]}
+            ORDER BY c.relname, con.conname, k.ord
+        ''',
+
+        'references': '''
+            SELECT c.relname, con.conname, con.conname, a.attname,
+                rn.nspname, rc.relname, ra.attname
+            FROM pg_catalog.pg_constraint con
+                JOIN pg_catalog.pg_class c ON (c.oid = con.conrelid)
+                JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+                JOIN pg_catalog.pg_class rc ON (rc.oid = con.confrelid)
+                JOIN pg_catalog.pg_namespace rn ON (rn.oid = rc.relnamespace)
+                CROSS JOIN LATERAL unnest(con.conkey, con.confkey)
+                    WITH ORDINALITY AS k(attnum, refnum, ord)
+                JOIN pg_catalog.pg_attribute a
+                    ON (a.attrelid = con.conrelid AND a.attnum = k.attnum)
+                JOIN pg_catalog.pg_attribute ra
+                    ON (ra.attrelid = con.confrelid AND ra.attnum = k.refnum)
+            WHERE n.nspname = :schema
+                AND con.contype = 'f'
+                {names[c.relname]}
+            ORDER BY c.relname, con.conname, k.ord
+        ''',
+
+        'indexes': '''
+            SELECT t.relname, i.relname, a.attname, ix.indisunique
+            FROM pg_catalog.pg_index ix
+                JOIN pg_catalog.pg_class t ON (t.oid = ix.indrelid)
+                JOIN pg_catalog.pg_class i ON (i.oid = ix.indexrelid)
+                JOIN pg_catalog.pg_namespace n ON (n.oid = t.relnamespace)
+                CROSS JOIN LATERAL unnest(ix.indkey::int2[])
+                    WITH ORDINALITY AS k(attnum, ord)
+                JOIN pg_catalog.pg_attribute a
+                    ON (a.attrelid = t.oid AND a.attnum = k.attnum)
+            WHERE n.nspname = :schema
+                AND NOT ix.indisprimary
+                {names[t.relname]}
+            ORDER BY t.relname, i.relname, k.ord
+        ''',
+    },
+
+    'mysql': {
+        'tables': '''
+            SELECT table_name
+            FROM information_schema.tables
+            WHERE table_schema = :schema
+                AND (table_type = 'BASE TABLE'
+                    OR (:views = 1 AND table_type = 'VIEW'))
+            ORDER BY table_name
+        ''',
+
+        'columns': '''
+            SELECT
+                table_name,
+                column_name,
+                data_type,
+                character_maximum_length,
+                numeric_precision,
+                numeric_scale,
+                is_nullable,
+                column_default
+            FROM information_schema.columns
+            WHERE table_schema = :schema
+                {names[table_name]}
+            ORDER BY table_name, ordinal_position
+        ''',
+
+        'constraints': '''
+            SELECT
+                tc.table_name,
+                CASE tc.constraint_type
+                    WHEN 'PRIMARY KEY' THEN 'p'
+                    ELSE 'u'
+                END,
+                tc.constraint_name,
+                tc.constraint_name,
+                kcu.column_name
+            FROM information_schema.table_constraints tc
+                JOIN information_schema.key_column_usage kcu
+                    ON (kcu.table_schema = tc.table_schema
+                        AND kcu.table_name = tc.table_name
+                        AND kcu.constraint_name = tc.constraint_name)
+            WHERE tc.table_schema = :schema
+                AND tc.constraint_type IN ('PRIMARY KEY', 'UNIQUE')
+                {names[tc.table_name]}
+            ORDER BY tc.table_name, tc.constraint_name, kcu.ordinal_position
+        ''',
+
+        'references': '''
+            SELECT
+                table_name,
+                constraint_name,
+                constraint_name,
+                column_name,
+                referenced_table_schema,
+                referenced_table_name,
+                referenced_column_name
+            FROM information_schema.key_column_usage
+            WHERE table_schema = :schema
+                AND referenced_table_name IS NOT NULL
+                {names[table_name]}
+            ORDER BY table_name, constraint_name, ordinal_position
+        ''',
+
+        'indexes': '''
+            SELECT table_name, index_name, column_name, non_unique = 0
+            FROM information_schema.statistics
+            WHERE table_schema = :schema
+                AND index_name <> 'PRIMARY'
+                {names[table_name]}
+            ORDER BY table_name, index_name, seq_in_index
+        ''',
+    },
+
+    'oracle': {
+        'tables': '''
+            SELECT table_name
+            FROM all_tables
+            WHERE owner = :schema
+                AND iot_name IS NULL
+                AND duration IS NULL
+            UNION ALL
+            SELECT view_name
+            FROM all_views
+            WHERE owner = :schema
+                AND :views = 1
+            ORDER BY 1
+        ''',
+
+        'columns': '''
+            SELECT
+                table_name,
+                column_name,
+                data_type,
+                char_length,
+                data_precision,
+                data_scale,
+                nullable,
+                data_default
+            FROM all_tab_columns
+            WHERE owner = :schema
+                {names[table_name]}
+            ORDER BY table_name, column_id
+        ''',
+
+        'constraints': '''
+            SELECT c.table_name, LOWER(c.constraint_type), c.constraint_name,
+                c.constraint_name, cc.column_name
+            FROM all_constraints c
+                JOIN all_cons_columns cc
+                    ON (cc.owner = c.owner
+                        AND cc.constraint_name = c.constraint_name
+                        AND cc.table_name = c.table_name)
+            WHERE c.owner = :schema
+                AND c.constraint_type IN ('P', 'U')
+                {names[c.table_name]}
+            ORDER BY c.table_name, c.constraint_name, cc.position
+        ''',
+
+        'references': '''
+            SELECT c.table_name, c.constraint_name, c.constraint_name,
+                cc.column_name, r.owner, r.table_name, rc.column_name
+            FROM all_constraints c
+                JOIN all_cons_columns cc
+                    ON (cc.owner = c.owner
+                        AND cc.constraint_name = c.constraint_name)
+                JOIN all_constraints r
+                    ON (r.owner = c.r_owner
+                        AND r.constraint_name = c.r_constraint_name)
+                JOIN all_cons_columns rc
+                    ON (rc.owner = r.owner
+                        AND rc.constraint_name = r.constraint_name
+                        AND rc.position = cc.position)
+            WHERE c.owner = :schema
+                AND c.constraint_type = 'R'
+                {names[c.table_name]}
+            ORDER BY c.table_name, c.constraint_name, cc.position
+        ''',
+
+        'indexes': '''
+            SELECT i.table_name, i.index_name, ic.column_name,
+                CASE i.uniqueness WHEN 'UNIQUE' THEN 1 ELSE 0 END
+            FROM all_indexes i
+                JOIN all_ind_columns ic
+                    ON (ic.index_owner = i.owner
+                        AND ic.index_name = i.index_name)
+            WHERE i.table_owner = :schema
+                {names[i.table_name]}
+                AND NOT EXISTS (
+                    SELECT 1 FROM all_constraints c
+                    WHERE c.owner = i.table_owner
+                        AND c.index_name = i.index_name
+                        AND c.constraint_type = 'P'
+                )
+            ORDER BY i.table_name, i.index_name, ic.column_position
+        ''',
+    },
+
+    # SQLite has no information schema, but the pragma table-valued
+    # functions (3.16+) can be joined against sqlite_master.
+    'sqlite': {
+        'tables': '''
+            SELECT name
+            FROM sqlite_master
+            WHERE (type = 'table' OR (:views = 1 AND type = 'view'))
+                AND name NOT LIKE 'sqlite~_%' ESCAPE '~'
+            ORDER BY name
+        ''',
+
+        'columns': '''
+            SELECT m.name, p.name, p.type, NULL, NULL, NULL,
+                NOT p."notnull", p.dflt_value
+            FROM sqlite_master m
+                JOIN pragma_table_info(m.name) p
+            WHERE m.type IN ('table', 'view')
+                {names[m.name]}
+            ORDER BY m.name, p.cid
+        ''',
+
+        'constraints': '''
+            SELECT tbl, typ, key, name, col FROM (
+                SELECT m.name AS tbl, 'p' AS typ, NULL AS key, NULL AS name,
+                    p.name AS col, p.pk AS pos
+                FROM sqlite_master m
+                    JOIN pragma_table_info(m.name) p
+                WHERE m.type = 'table'
+                    AND p.pk > 0
+                    {names[m.name]}
+                UNION ALL
+                SELECT m.name, 'u', il.name,
+                    CASE WHEN il.name LIKE 'sqlite~_autoindex~_%' ESCAPE '~'
+                        THEN NULL
+                        ELSE il.name
+                    END,
+                    ii.name, ii.seqno
+                FROM sqlite_master m
+                    JOIN pragma_index_list(m.name) il
+                    JOIN pragma_index_info(il.name) ii
+                WHERE m.type = 'table'
+                    AND il.origin = 'u'
+                    {names[m.name]}
+            )
+            ORDER BY tbl, typ, key, pos
+        ''',
+
+        'references': '''
+            SELECT m.name, f.id, NULL, f."from", NULL, f."table", f."to"
+            FROM sqlite_master m
+                JOIN pragma_foreign_key_list(m.name) f
+            WHERE m.type = 'table'
+                {names[m.name]}
+            ORDER BY m.name, f.id, f.seq
+        ''',
+
+        'indexes': '''
+            SELECT m.name, il.name, ii.name, il."unique"
+            FROM sqlite_master m
+                JOIN pragma_index_list(m.name) il
+                JOIN pragma_index_info(il.name) ii
+            WHERE m.type = 'table'
+                AND il.origin = 'c'
+                {names[m.name]}
+            ORDER BY m.name, il.name, ii.seqno
+        ''',
+    },
+}
+
+
+# Queries returning a cheap per-table token that changes whenever the
+# table's definition does, for catalogs that expose one. Tables whose token
+# is unchanged since the last run need not be reflected again.
+VERSION_QUERIES = {
+    'oracle': '''
+        SELECT object_name, TO_CHAR(last_ddl_time, 'YYYY-MM-DD HH24:MI:SS')
+        FROM all_objects
+        WHERE owner = :schema
+            AND object_type = 'TABLE'
+    ''',
+
+    # Indexes have their own entries in sqlite_master.
+    'sqlite': '''
+        SELECT tbl_name, group_concat(sql, ';')
+        FROM (
+            SELECT tbl_name, sql
+            FROM sqlite_master
+            WHERE sql IS NOT NULL
+            ORDER BY tbl_name, type, name
+        )
+        GROUP BY tbl_name
+    ''',
+}
+
+
+# Matches the parameters of a type declaration, e.g. VARCHAR(20) or
+# TIMESTAMP(6) WITH TIME ZONE.
+_type_params = re.compile(r'\s*\(([^)]*)\)\s*')
+
+
+def supported(engine, schema=None):
+    "Returns true if the engine's dialect supports bulk reflection."
+    name = engine.dialect.name
+
+    # The SQLite queries only read the main database.
+    if name == 'sqlite' and schema not in (None, 'main'):
+        return False
+
+    return name in QUERIES
+
+
+def name_filter(include=(), exclude=()):
+    """Returns a predicate selecting table names, or None to select all.
+
+    Patterns are globs, or regular expressions if prefixed with re:, and
+    must match the whole name. A name is selected if it matches an include
+    pattern, or there are none, and no exclude pattern. Schema-qualified
+    names are also matched by patterns of the bare table name.
+    """
+    if not include and not exclude:
+        return None
+
+    def compile(pattern):
+        if pattern.startswith('re:'):
+            return re.compile(pattern[3:])
+
+        return re.compile(fnmatch.translate(pattern))
+
+    include = [compile(p) for p in include]
+    exclude = [compile(p) for p in exclude]
+
+    def found(patterns, names):
+        return any(p.fullmatch(n) for p in patterns for n in names)
+
+    def match(name):
+        names = (name, name.rsplit('.', 1)[-1])
+
+        if include and not found(include, names):
+            return False
+
+        return not found(exclude, names)
+
+    return match
+
+
+def table_key(schema, name):
+    "Returns the output name of a table, qualified if the schema is given."
+    if schema is None:
+        return name
+
+    return '{}.{}'.format(schema, name)
+
+
+def schema_names(dialect, schemas):
+    """Returns the given schemas normalized as the catalog names are, so
+    tables and the schemas they refer to are named alike whatever case the
+    schemas are given in."""
+    if not schemas:
+        return schemas
+
+    normalize = _normalizer(dialect)
+
+    return [normalize(schema) for schema in schemas]
+
+
+def qualify(table, schema):
+    """Qualifies the names of a table record and of the tables it refers
+    to with their schema."""
+    table['name'] = table_key(schema, table['name'])
+
+    for ref in table['foreign_keys']:
+        ref['referred_table'] = table_key(ref['referred_schema'] or schema,
+                                          ref['referred_table'])
+
+    return table
+
+
+def new_table(name):
+    "Returns an empty table record in the shape the Inspector uses."
+    return {
+        'name': name,
+        'columns': [],
+        'primary_key': {
+            'name': None,
+            'constrained_columns': [],
+        },
+        'foreign_keys': [],
+        'unique_constraints': [],
+        'indexes': [],
+    }
+
+
+def coerce_type(dialect, name, length=None, precision=None, scale=None):
+    "Returns a type instance for a catalog type name."
+    params = _type_params.search(name)
+
+    if params:
+        name = _type_params.sub(' ', name).strip()
+        args = [int(a) for a in params.group(1).split(',')
+                if a.strip().isdigit()]
+
+        if args and length is None and precision is None:
+            length = precision = args[0]
+
+            if len(args) > 1:
+                scale = args[1]
+
+    names = dialect.ischema_names
+    cls = names.get(name) or names.get(name.lower()) or \
+        names.get(name.upper())
+
+    if cls is None:
+        # SQLite resolves arbitrary type names by affinity.
+        if hasattr(dialect, '_resolve_type_affinity'):
+            return dialect._resolve_type_affinity(name)
+
+        return types.NullType()
+
+    kwargs = {}
+
+    if issubclass(cls, types.String):
+        kwargs['length'] = length
+    elif issubclass(cls, types.Float):
+        kwargs['precision'] = precision
+    elif issubclass(cls, types.Numeric):
+        kwargs['precision'] = precision
+        kwargs['scale'] = scale
+
+    kwargs = {k: v for k, v in kwargs.items() if v is not None}
+
+    try:
+        return cls(**kwargs)
+    except TypeError:
+        return cls()
+
+
+def _nullable(value):
+    if isinstance(value, str):
+        return value.upper() in ('YES', 'Y')
+
+    return bool(value)
+
+
+def completed(result):
+    "Returns a future that is already resolved to `result`."
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def failed(error):
+    "Returns a future that has already failed with `error`."
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+def transient(error):
+    """Returns true if an error is worth retrying on a new connection, such
+    as a lost connection, a session or statement timeout or an exhausted
+    pool, rather than an error in the query itself."""
+    if isinstance(error, exc.DBAPIError):
+        return error.connection_invalidated or \
+            isinstance(error, (exc.OperationalError, exc.InterfaceError))
+
+    return isinstance(error, (exc.TimeoutError, ConnectionError))
+
+
+def first_line(error):
+    "Returns the first line of an error's message, or its repr if empty."
+    return (str(error).splitlines() or [repr(error)])[0]
+
+
+def with_retries(func, retries=0, backoff=1):
+    """Returns the function retrying transient errors up to `retries` times,
+    waiting `backoff` seconds before the first retry and doubling the wait
+    on each one. Connections are checked out per attempt, so each retry
+    reconnects."""
+    if not retries:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt == retries or not transient(e):
+                    raise
+
+                delay = backoff * 2 ** attempt
+                print('warning: retrying in {}s after: {}'.format(
+                    delay, first_line(e)), file=sys.stderr)
+
+            time.sleep(delay)
+
+    return wrapper
+
+
+@contextmanager
+def checkout(engine):
+    """Checks out a pooled connection. The connection is discarded rather
+    than returned to the pool on a transient error, so the pool opens a new
+    one for the next checkout."""
+    with engine.connect() as conn:
+        try:
+            yield conn
+        except Exception as e:
+            if transient(e) and not conn.invalidated:
+                conn.invalidate()
+            raise
+
+
+def versions(engine, schemas=None):
+    """Returns a dict of definition version tokens by table, if supported.
+
+    Tables are keyed as they are by reflect for the same schemas.
+    """
+    query = VERSION_QUERIES.get(engine.dialect.name)
+
+    if query is None:
+        return {}
+
+    tokens = {}
+
+    with checkout(engine) as conn:
+        dialect = conn.dialect
+        normalize = _normalizer(dialect)
+
+        for schema in schema_names(dialect, schemas) or [None]:
+            if not supported(engine, schema):
+                continue
+
+            params = {'schema': _denormalizer(dialect)(
+                schema or dialect.default_schema_name)}
+
+            for name, token in conn.execute(text(query), **params):
+                tokens[table_key(schema, normalize(name))] = token
+
+    return tokens
+
+
+def reflect(engine, schemas=None, workers=None, exclude=(), match=None,
+            views=False, retries=0, backoff=1):
+    """Yields (name, future) pairs for each table as it is reflected.
+
+    Every worker reflects on its own pooled connection, so the engine's
+    pool should allow `workers` connections. Calling `result()` on the
+    future returns the table record or raises the error encountered while
+    reflecting it. Dialects without bulk catalog queries fall back to the
+    Inspector, one table per job.
+
+    The default schema is reflected unless `schemas` are given, in which
+    case they are reflected concurrently and table names are qualified
+    with their schema. Tables named in `exclude` or rejected by the `match`
+    predicate are not reflected at all. Views are included if `views` is
+    true.
+
+    Transient errors of each catalog query or table are retried on a new
+    connection, see with_retries. The tables of a catalog query that still
+    fails are yielded as failed, and a schema whose tables cannot be listed
+    as a failed <schema>.* entry, so the other tables are not affected.
+    """
+    schemas = schema_names(engine.dialect, schemas) or [None]
+
+    def selected(schema, name):
+        key = table_key(schema, name)
+        return key not in exclude and (match is None or match(key))
+
+    with checkout(engine) as conn:
+        default = conn.dialect.default_schema_name
+        inspector = inspect(conn)
+        names = {}
+
+        for schema in schemas:
+            if supported(engine, schema):
+                continue
+
+            found = inspector.get_table_names(schema=schema or default)
+
+            if views:
+                found += inspector.get_view_names(schema=schema or default)
+
+            names[schema] = [name for name in found
+                             if selected(schema, name)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        bulk = [schema for schema in schemas if schema not in names]
+
+        for schema, name, table in bulk_tables(pool, engine, bulk, default,
+                                               selected, views, retries,
+                                               backoff):
+            if isinstance(table, Exception):
+                yield table_key(schema, name), failed(table)
+                continue
+
+            # Tables of the default schema keep their names, but the
+            # tables they refer to in other schemas are qualified.
+            qualify(table, schema)
+
+            yield table['name'], completed(table)
+
+        def job(schema, name):
+            # Inspectors cache per connection and are not thread-safe, so
+            # each job checks out its own connection from the pool.
+            with checkout(engine) as conn:
+                table = inspector_table(inspect(conn), name,
+                                        schema or default)
+
+            if schema is not None:
+                qualify(table, schema)
+
+            return table
+
+        job = with_retries(job, retries, backoff)
+
+        futures = {pool.submit(job, schema, name): table_key(schema, name)
+                   for schema, found in names.items()
+                   for name in found}
+
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class _Names:
+    "Renders the {names[column]} fields of the catalog queries."
+    def __init__(self, params):
+        self.params = params
+
+    def __getitem__(self, column):
+        if self.params is None:
+            return ''
+
+        return 'AND {} IN ({})'.format(
+            column, ', '.join(':' + p for p in self.params))
+
+
+def fetch_rows(engine, key, schema, names=None, views=False):
+    """Runs one of the bulk catalog queries on a pooled connection,
+    restricted to the given table names if any."""
+    dialect = engine.dialect
+    params = {
+        'schema': _denormalizer(dialect)(schema),
+        'views': int(views),
+    }
+
+    if names is None:
+        query = QUERIES[dialect.name][key].format(names=_Names(None))
+    else:
+        binds = ['name_{}'.format(i) for i in range(len(names))]
+        params.update(zip(binds, names))
+        query = QUERIES[dialect.name][key].format(names=_Names(binds))
+
+    with checkout(engine) as conn:
+        return conn.execute(text(query), **params).fetchall()
+
+
+# Number of table names bound in a single catalog query, which also keeps
+# within the IN list limit of Oracle.
+CHUNK_SIZE = 500
+
+
+def bulk_tables(pool, engine, schemas, default, selected, views=False,
+                retries=0, backoff=1):
+    """Reflects whole schemas with concurrent queries per object type.
+
+    The tables of every schema are listed first. If some are not selected,
+    the other queries are run on chunks of the selected names so the rest
+    are never read.
+
+    Yields (schema, name, table) triples, where the table is the error
+    instead if a query it depends on failed. The name is * if the tables of
+    the schema could not be listed.
+    """
+    dialect = engine.dialect
+    normalize = _normalizer(dialect)
+    fetch = with_retries(fetch_rows, retries, backoff)
+
+    listings = {pool.submit(fetch, engine, 'tables', schema or default,
+                            views=views): schema
+                for schema in schemas}
+
+    pending = {}
+
+    for future in as_completed(listings):
+        schema = listings[future]
+
+        try:
+            listed = [name for (name,) in future.result()]
+        except Exception as e:
+            yield schema, '*', e
+            continue
+
+        names = [name for name in listed
+                 if selected(schema, normalize(name))]
+
+        if not names:
+            continue
+
+        if len(names) == len(listed):
+            chunks = [None]
+        else:
+            chunks = [names[i:i + CHUNK_SIZE]
+                      for i in range(0, len(names), CHUNK_SIZE)]
+
+        futures = {}
+
+        for key in QUERIES[dialect.name]:
+            if key == 'tables':
+                continue
+
+            futures[key] = [(chunk, pool.submit(fetch, engine, key,
+                                                schema or default,
+                                                names=chunk))
+                            for chunk in chunks]
+
+        pending[schema] = (names, futures)
+
+    for schema, (names, futures) in pending.items():
+        rows = {}
+        errors = OrderedDict()
+
+        for key, chunks in futures.items():
+            rows[key] = []
+
+            for chunk, future in chunks:
+                try:
+                    rows[key].extend(future.result())
+                except Exception as e:
+                    for name in chunk or names:
+                        errors.setdefault(name, e)
+
+        # Tables missing rows of a failed query are left out of grouping.
+        rows['tables'] = [(name,) for name in names if name not in errors]
+
+        for table in group_tables(dialect, schema or default, rows):
+            yield schema, table['name'], table
+
+        for name, error in errors.items():
+            yield schema, normalize(name), error
+
+
+def group_tables(dialect, schema, rows):
+    "Groups the rows of the bulk catalog queries into table records."
+    normalize = _normalizer(dialect)
+
+    tables = OrderedDict()
+
+    for (name,) in rows['tables']:
+        name = normalize(name)
+        tables[name] = new_table(name)
+
+    for row in rows['columns']:
+        table = tables.get(normalize(row[0]))
+
+        # Views and other relations share the columns catalog.
+        if table is None:
+            continue
+
+        table['columns'].append({
+            'name': normalize(row[1]),
+            'type': coerce_type(dialect, row[2], row[3], row[4], row[5]),
+            'nullable': _nullable(row[6]),
+            'default': row[7],
+        })
+
+    uniques = {}
+
+    for tname, typ, key, name, column in rows['constraints']:
+        table = tables.get(normalize(tname))
+
+        if table is None:
+            continue
+
+        column = normalize(column)
+
+        if typ == 'p':
+            table['primary_key']['name'] = normalize(name)
+            table['primary_key']['constrained_columns'].append(column)
+            continue
+
+        uniq = uniques.get((table['name'], key))
+
+        if uniq is None:
+            uniq = uniques[(table['name'], key)] = {
+                'name': normalize(name),
+                'column_names': [],
+            }
+            table['unique_constraints'].append(uniq)
+
+        uniq['column_names'].append(column)
+
+    refs = {}
+
+    for tname, key, name, column, rschema, rtable, rcolumn in \
+            rows['references']:
+        table = tables.get(normalize(tname))
+
+        if table is None:
+            continue
+
+        ref = refs.get((table['name'], key))
+
+        if ref is None:
+            rschema = normalize(rschema) if rschema else None
+
+            ref = refs[(table['name'], key)] = {
+                'name': normalize(name),
+                'constrained_columns': [],
+                'referred_schema': None if rschema == schema else rschema,
+                'referred_table': normalize(rtable),
+                'referred_columns': [],
+            }
+            table['foreign_keys'].append(ref)
+
+        ref['constrained_columns'].append(normalize(column))
+        ref['referred_columns'].append(normalize(rcolumn))
+
+    indexes = {}
+
+    for tname, name, column, unique in rows['indexes']:
+        table = tables.get(normalize(tname))
+
+        if table is None:
+            continue
+
+        idx = indexes.get((table['name'], name))
+
+        if idx is None:
+            idx = indexes[(table['name'], name)] = {
+                'name': normalize(name),
+                'column_names': [],
+                'unique': bool(unique),
+            }
+            table['indexes'].append(idx)
+
+        idx['column_names'].append(normalize(column))
+
+    return list(tables.values())
+
+
+def record_catalog(engine, schemas=None, views=False, match=None):
+    """Yields (schema, rows) pairs of the rows of every bulk catalog query
+    of each schema, by query, for replay_catalog.
+
+    Only the rows of tables accepted by the `match` predicate are recorded,
+    with the names bound in chunks as bulk_tables does.
+
+    Raises a ValueError for dialects without bulk catalog queries.
+    """
+    dialect = engine.dialect
+    normalize = _normalizer(dialect)
+
+    with engine.connect() as conn:
+        default = conn.dialect.default_schema_name
+
+    for schema in schema_names(dialect, schemas) or [None]:
+        if not supported(engine, schema):
+            raise ValueError('{} has no catalog queries for schema {}'.format(
+                dialect.name, schema or default))
+
+        listed = fetch_rows(engine, 'tables', schema or default,
+                            views=views)
+        names = [name for (name,) in listed
+                 if match is None or match(table_key(schema,
+                                                     normalize(name)))]
+
+        if len(names) == len(listed):
+            chunks = [None]
+        else:
+            chunks = [names[i:i + CHUNK_SIZE]
+                      for i in range(0, len(names), CHUNK_SIZE)]
+
+        rows = {'tables': [[_plain(name)] for name in names]}
+
+        for key in QUERIES[dialect.name]:
+            if key == 'tables':
+                continue
+
+            rows[key] = [[_plain(value) for value in row]
+                         for chunk in chunks
+                         for row in fetch_rows(engine, key, schema or default,
+                                               names=chunk)]
+
+        yield schema, rows
+
+
+def replay_catalog(dialect, schema, rows, default=None):
+    """Returns the table records of recorded catalog rows, as reflect does
+    for the rows of the database.
+
+    The dialect is an instance or the name of one, which is created
+    without connecting, so no driver is needed.
+    """
+    if isinstance(dialect, str):
+        dialect = make_url('{}://'.format(dialect)).get_dialect()()
+
+    # Snapshots recorded before schemas were normalized may name them in
+    # the case they were given in.
+    if schema is not None:
+        schema = _normalizer(dialect)(schema)
+
+    tables = group_tables(dialect, schema or default, rows)
+
+    for table in tables:
+        qualify(table, schema)
+
+    return tables
+
+
+def _plain(value):
+    "Returns a catalog value as a JSON-serializable one."
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() \
+            else float(value)
+
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+
+    return str(value)
+
+
+def inspector_table(inspector, name, schema=None):
+    "Reflects a single table using the SQLAlchemy Inspector."
+    table = new_table(name)
+
+    table['columns'] = inspector.get_columns(name, schema=schema)
+    table['foreign_keys'] = inspector.get_foreign_keys(name, schema=schema)
+    table['indexes'] = inspector.get_indexes(name, schema=schema)
+
+    pk = inspector.get_pk_constraint(name, schema=schema)
+
+    if pk:
+        table['primary_key'] = pk
+
+    try:
+        uniques = inspector.get_unique_constraints(name, schema=schema)
+    except NotImplementedError:
+        uniques = []
+
+    table['unique_constraints'] = uniques
+
+    return table
+
+
+def _normalizer(dialect):
+    "Returns a function that normalizes case-folded catalog names."
+    if getattr(dialect, 'requires_name_normalize', False):
+        return lambda name: dialect.normalize_name(name) if name else name
+
+    return lambda name: name
+
+
+def _denormalizer(dialect):
+    if getattr(dialect, 'requires_name_normalize', False):
+        return lambda name: dialect.denormalize_name(name) if name else name
+
+    return lambda name: name
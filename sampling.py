@@ -0,0 +1,294 @@
+import os
+import sys
+import math
+import time
+import numbers
+import hashlib
+import decimal
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy.sql import text
+from constants import PROFILE_COLUMNS
+
+
+# Queries reading a server-side sample of at most {rows} rows per dialect.
+# Dialects without one read the first {rows} rows instead.
+SAMPLE_QUERIES = {
+    'postgresql': 'SELECT {columns} FROM {table} '
+                  'TABLESAMPLE SYSTEM ({percent}) LIMIT {rows}',
+    'oracle': 'SELECT {columns} FROM {table} SAMPLE ({percent}) '
+              'WHERE ROWNUM <= {rows}',
+    'mssql': 'SELECT TOP {rows} {columns} FROM {table} '
+             'TABLESAMPLE ({percent} PERCENT)',
+}
+
+LIMIT_QUERIES = {
+    'oracle': 'SELECT {columns} FROM {table} WHERE ROWNUM <= {rows}',
+    'mssql': 'SELECT TOP {rows} {columns} FROM {table}',
+}
+
+DEFAULT_LIMIT_QUERY = 'SELECT {columns} FROM {table} LIMIT {rows}'
+
+# Statements bounding the run time of the queries of a transaction, in
+# milliseconds, for dialects that have one.
+TIMEOUTS = {
+    'postgresql': 'SET LOCAL statement_timeout = {ms}',
+}
+
+# Number of rows fetched between checks of the time budget.
+BATCH_SIZE = 500
+
+
+class HyperLogLog:
+    """Estimates the number of distinct values in constant memory.
+
+    With the default of 2^10 registers the standard error is about 3%.
+    """
+    def __init__(self, p=10):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode('utf8')
+
+        x = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(),
+                           'big')
+
+        bits = 64 - self.p
+        j = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+
+        if rank > self.registers[j]:
+            self.registers[j] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+
+        # Linear counting is more accurate for small cardinalities.
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+
+class ColumnStats:
+    "Accumulates the statistics of the sampled values of a column."
+    def __init__(self):
+        self.rows = 0
+        self.nulls = 0
+        self.max_length = None
+        self.min = None
+        self.max = None
+        self.distinct = HyperLogLog()
+
+    def add(self, value):
+        self.rows += 1
+
+        if value is None:
+            self.nulls += 1
+            return
+
+        self.distinct.add(value)
+
+        if isinstance(value, (str, bytes)):
+            if self.max_length is None or len(value) > self.max_length:
+                self.max_length = len(value)
+        elif _ordered(value):
+            if self.min is None or value < self.min:
+                self.min = value
+
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def row(self):
+        "Returns the statistics as profile columns."
+        return [
+            self.rows,
+            '{:.4f}'.format(self.nulls / self.rows) if self.rows else '',
+            _blank(self.max_length),
+            _blank(self.min),
+            _blank(self.max),
+            self.distinct.count() if self.rows > self.nulls else 0,
+        ]
+
+
+def sample_query(dialect, table, schema, columns, percent, rows):
+    "Returns the sampling query of a table and the query without sampling."
+    quote = dialect.identifier_preparer.quote
+
+    params = {
+        'columns': ', '.join(quote(c) for c in columns),
+        'table': quote(table) if schema is None else
+        '{}.{}'.format(dialect.identifier_preparer.quote_schema(schema),
+                       quote(table)),
+        'percent': percent,
+        'rows': int(rows),
+    }
+
+    limit = LIMIT_QUERIES.get(dialect.name, DEFAULT_LIMIT_QUERY)
+    sample = SAMPLE_QUERIES.get(dialect.name)
+
+    if sample is None or percent >= 100:
+        sample = limit
+
+    return sample.format(**params), limit.format(**params)
+
+
+def split_key(key, schemas=None):
+    "Returns the schema and name of a table named as reflect does."
+    for schema in schemas or ():
+        if key.startswith(schema + '.'):
+            return schema, key[len(schema) + 1:]
+
+    return None, key
+
+
+def read_sample(engine, query, columns, deadline):
+    """Returns the statistics of the rows of a query by column and whether
+    it stopped early because the deadline passed."""
+    stats = [ColumnStats() for _ in columns]
+    timeout = TIMEOUTS.get(engine.dialect.name)
+
+    with engine.connect() as conn:
+        with conn.begin():
+            if timeout:
+                ms = max(1, int((deadline - time.time()) * 1000))
+                conn.execute(text(timeout.format(ms=ms)))
+
+            result = conn.execution_options(stream_results=True) \
+                .execute(text(query))
+
+            try:
+                while True:
+                    batch = result.fetchmany(BATCH_SIZE)
+
+                    if not batch:
+                        return stats, False
+
+                    for row in batch:
+                        for s, value in zip(stats, row):
+                            s.add(value)
+
+                    if time.time() >= deadline:
+                        return stats, True
+            finally:
+                result.close()
+
+
+def profile_table(engine, info, schema=None, percent=1, rows=10000,
+                  budget=30):
+    """Profiles the columns of a reflected table from a sample of its rows.
+
+    The sample is read with the dialect's TABLESAMPLE or SAMPLE clause and
+    at most `rows` rows, or the first `rows` rows if the dialect has none,
+    the sample comes back empty or the table cannot be sampled, like most
+    views. Reading stops once `budget` seconds have passed, keeping what
+    was read so far.
+
+    Returns (field, sampled rows, null fraction, max length, min, max,
+    distinct) rows, where the distinct count is estimated for the sample.
+    """
+    _, name = split_key(info['name'], [schema] if schema else None)
+    columns = [c['name'] for c in info['columns']]
+
+    if not columns:
+        return []
+
+    deadline = time.time() + budget
+    sample, limit = sample_query(engine.dialect, name, schema, columns,
+                                 percent, rows)
+
+    try:
+        stats, stopped = read_sample(engine, sample, columns, deadline)
+    except Exception:
+        if sample == limit:
+            raise
+
+        stats = None
+
+    if sample != limit and (stats is None or not stats[0].rows):
+        stats, stopped = read_sample(engine, limit, columns, deadline)
+
+    if stopped:
+        print('warning: {}: profile stopped after {} rows at the time budget'
+              .format(info['name'], stats[0].rows), file=sys.stderr)
+
+    return [[column] + s.row() for column, s in zip(columns, stats)]
+
+
+class Profiler:
+    """Profiles reflected tables with bounded parallelism and writes a
+    profile.csv file per table.
+
+    The engine's pool should allow `workers` connections.
+    """
+    def __init__(self, engine, schemas=None, percent=1, rows=10000,
+                 budget=30, workers=None):
+        self.engine = engine
+        self.schemas = schemas
+        self.percent = percent
+        self.rows = rows
+        self.budget = budget
+        self.workers = workers
+
+    def run(self, sink, model, version, tables):
+        """Profiles the table records and writes their files to the sink
+        as each completes.
+
+        Returns a list of (table, error) pairs for tables that could not
+        be profiled, which are only reported.
+        """
+        errors = []
+
+        def job(info):
+            schema, _ = split_key(info['name'], self.schemas)
+            return profile_table(self.engine, info, schema=schema,
+                                 percent=self.percent, rows=self.rows,
+                                 budget=self.budget)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(job, info): info['name']
+                       for info in tables}
+
+            for future in as_completed(futures):
+                table = futures[future]
+
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    errors.append((table, e))
+                    print('warning: {}: profile failed: {}'.format(table, e),
+                          file=sys.stderr)
+                    continue
+
+                generate_profile(sink, model, version, table, rows)
+
+        return errors
+
+
+def generate_profile(sink, model, version, table, rows):
+    "Writes the profile file of a table."
+    if not rows:
+        return
+
+    sink.write([
+        (os.path.join(table, 'profile.csv'), PROFILE_COLUMNS,
+         [[model, version, table] + row for row in rows]),
+    ])
+
+
+def _ordered(value):
+    if isinstance(value, bool):
+        return False
+
+    return isinstance(value, (numbers.Real, decimal.Decimal, datetime.date,
+                              datetime.time))
+
+
+def _blank(value):
+    return '' if value is None else value
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import stat
+import signal
+import time
+import threading
+import socketserver
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Fields every job of a command must have.
+REQUIRED = {
+    ('sql', None): ('model', 'version', 'engine', 'database'),
+    ('redcap', 'csv'): ('model', 'version', 'path'),
+    ('redcap', 'api'): ('model', 'version', 'url', 'token'),
+    ('redcap', 'db'): ('model', 'version', 'project'),
+}
+
+
+class Server:
+    """Runs generation jobs on a bounded executor.
+
+    Engines are kept per connection URL and number of workers, so jobs
+    against the same database reuse its pooled connections rather than
+    connecting again.
+    """
+    def __init__(self, jobs, workers):
+        self.jobs = jobs
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.engines = {}
+        self.lock = threading.Lock()
+        self.patched = False
+
+    def engine(self, url, workers):
+        """Returns the engine of a URL for jobs of a number of workers,
+        creating it on first use.
+
+        Every job that may run at once can share the engine, so its pool
+        holds `workers` connections per concurrent job.
+        """
+        from sql import connect
+
+        key = (str(url), workers)
+
+        with self.lock:
+            engine = self.engines.get(key)
+
+            if engine is None:
+                engine = self.engines[key] = connect(url,
+                                                     workers * self.jobs)
+
+        return engine
+
+    def submit(self, job):
+        "Schedules a job and returns the future of its result."
+        return self.executor.submit(self.run, job)
+
+    def run(self, job):
+        "Runs a job and returns its result, which reports any error."
+        start = time.time()
+
+        result = {
+            'id': job.get('id'),
+            'command': job.get('command'),
+            'dir': None,
+            'status': 'ok',
+            'errors': [],
+        }
+
+        try:
+            command = job.get('command')
+            key = (command, job.get('mode') if command == 'redcap' else None)
+
+            if key not in REQUIRED:
+                raise ValueError('unknown command {}'.format(
+                    ' '.join(str(k) for k in key if k)))
+
+            missing = [f for f in REQUIRED[key] if job.get(f) is None]
+
+            if missing:
+                raise ValueError('missing {}'.format(', '.join(missing)))
+
+            result['dir'] = job.get('dir') or os.path.join(
+                os.getcwd(), job['model'], job['version'])
+
+            # Outputs in a blob store are named after the model and version.
+            if job.get('store'):
+                result['dir'] = os.path.join(job['model'], job['version'])
+
+            if command == 'sql':
+                errors = self.run_sql(job, result['dir'])
+            else:
+                errors = self.run_redcap(job, result['dir'])
+
+            for table, error in errors:
+                result['errors'].append({
+                    'table': table,
+                    'error': str(error),
+                })
+
+            if errors:
+                result['status'] = 'failed'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['errors'].append({
+                'table': None,
+                'error': str(e),
+            })
+
+        result['seconds'] = round(time.time() - start, 3)
+
+        return result
+
+    def run_sql(self, job, dirname):
+        from sqlalchemy.engine.url import URL
+        from reflect import name_filter
+        from typemap import TypeMap
+        from sql import generate
+
+        workers = int(job.get('workers') or self.workers)
+
+        url = URL(job['engine'],
+                  username=job.get('user'),
+                  password=job.get('password'),
+                  host=job.get('host'),
+                  port=job.get('port'),
+                  database=job['database'])
+
+        with self.sink(job, dirname) as sink:
+            return generate(self.engine(url, workers), job['model'],
+                            job['version'], sink, workers=workers,
+                            incremental=job.get('incremental', False),
+                            typemap=TypeMap(job.get('fallback_type',
+                                                    'string')),
+                            schemas=job.get('schemas'),
+                            match=name_filter(job.get('include', ()),
+                                              job.get('exclude', ())),
+                            views=job.get('views', False),
+                            retries=int(job.get('retries', 3)),
+                            backoff=float(job.get('backoff', 1)))
+
+    def sink(self, job, dirname):
+        "Returns the sink of the output of a job."
+        from output import open_sink
+
+        return open_sink(dirname, job.get('format', 'tree'), job.get('store'),
+                         job.get('compress', 'gzip'))
+
+    def run_redcap(self, job, dirname):
+        import rc
+
+        mode = job['mode']
+
+        with ExitStack() as stack:
+            if mode == 'csv':
+                fields = rc.read_dictionary(job['path'])
+            elif mode == 'api':
+                from redcap import Project
+
+                with self.lock:
+                    if not self.patched:
+                        import _redcap
+
+                        _redcap.patch()
+                        self.patched = True
+
+                fields = map(rc.field_from_dict, Project(
+                    job['url'], job['token']).export_metadata(format='json'))
+            else:
+                url = rc.db_url(job.get('db', 'redcap'),
+                                job.get('host', 'localhost'),
+                                job.get('port', 3306),
+                                job.get('user'),
+                                job.get('password'))
+
+                # The records are streamed while the files are generated,
+                # so the connection is held until then.
+                conn = stack.enter_context(
+                    self.engine(url, self.workers).connect())
+                fields = rc.db_metadata(conn, job['project'])
+
+            with self.sink(job, dirname) as sink:
+                rc.generate(fields, job['model'], job['version'], sink,
+                            incremental=job.get('incremental', False))
+
+        return []
+
+    def close(self):
+        "Waits for the running jobs and closes the pooled connections."
+        self.executor.shutdown(wait=True)
+
+        for engine in self.engines.values():
+            engine.dispose()
+
+
+def serve_lines(server, lines, write):
+    """Submits a job per JSON line and writes each result as a JSON line
+    as soon as it completes. Returns once every result has been written."""
+    done = threading.Condition()
+    pending = [0]
+
+    def reply(result):
+        with done:
+            write(json.dumps(result) + '\n')
+
+    def respond(future):
+        try:
+            reply(future.result())
+        finally:
+            with done:
+                pending[0] -= 1
+                done.notify_all()
+
+    for line in lines:
+        line = line.strip()
+
+        if not line:
+            continue
+
+        try:
+            job = json.loads(line)
+
+            if not isinstance(job, dict):
+                raise ValueError('a job must be an object')
+        except ValueError as e:
+            reply({
+                'id': None,
+                'status': 'failed',
+                'errors': [{'table': None, 'error': str(e)}],
+            })
+            continue
+
+        with done:
+            pending[0] += 1
+
+        server.submit(job).add_done_callback(respond)
+
+    with done:
+        done.wait_for(lambda: not pending[0])
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        def write(data):
+            self.wfile.write(data.encode('utf8'))
+            self.wfile.flush()
+
+        lines = (line.decode('utf8') for line in self.rfile)
+
+        try:
+            serve_lines(self.server.jobs, lines, write)
+        except BrokenPipeError:
+            pass
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_socket(server, path):
+    "Serves jobs on a Unix socket until interrupted or terminated."
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise ValueError('{} exists and is not a socket'.format(path))
+
+        os.remove(path)
+
+    # Stop on SIGTERM as on an interrupt so the socket is cleaned up.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with _UnixServer(path, _Handler) as unix:
+        unix.jobs = server
+
+        try:
+            unix.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+def main(argv=None):
+    usage = """Data Models Generator Server
+
+    Usage:
+        serve [--socket=PATH] [--jobs=NUM] [--workers=NUM]
+
+    Runs generation jobs sent as JSON lines on stdin, or on each connection
+    to a Unix socket, and replies with a JSON line per job as it completes.
+    Engines are kept open across jobs so connections to the same database
+    are reused.
+
+    A job is an object with an id and a command of sql or redcap, and the
+    arguments of that command as fields, e.g.
+
+        {"id": 1, "command": "sql", "model": "omop", "version": "v5", "engine": "postgresql", "database": "omop", "host": "db", "dir": "omop/v5", "incremental": true}
+        {"id": 2, "command": "redcap", "mode": "db", "model": "study", "version": "v1", "project": "study", "host": "redcap"}
+
+    The sql fields are model, version, engine, database, host, port, user,
+    password, dir, format, store, compress, incremental, workers, schemas,
+    include, exclude, views, fallback_type, retries and backoff. The redcap
+    fields are mode (csv, api or db), model, version, dir, format, store,
+    compress, incremental and path for csv, url and token for api or
+    project, db, host, port, user and password for db.
+
+    The reply has the id, status (ok or failed), dir, seconds and the
+    errors of the job. The dir is the output name if the job has a store.
+
+    Options:
+        -h --help       Show this screen.
+        --socket=PATH   Listen on a Unix socket rather than reading stdin.
+        --jobs=NUM      Number of jobs run concurrently [default: 4].
+        --workers=NUM   Default number of reflection workers and pooled connections per database. Defaults to the number of CPUs.
+
+    """  # noqa
+
+    from docopt import docopt
+
+    args = docopt(usage, argv=argv, version='0.1')
+
+    server = Server(int(args['--jobs']),
+                    int(args['--workers'] or os.cpu_count()))
+
+    try:
+        if args['--socket']:
+            serve_socket(server, args['--socket'])
+        else:
+            def write(data):
+                sys.stdout.write(data)
+                sys.stdout.flush()
+
+            serve_lines(server, sys.stdin, write)
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+import os
+import sys
+import gzip
+import json
+import importlib
+from datetime import datetime
+from sqlalchemy import types
+from reflect import reflect, versions, completed, record_catalog, \
+    replay_catalog, schema_names
+
+
+# Identifies snapshot files and the version of their layout.
+FORMAT = 'data-models-snapshot'
+VERSION = 1
+
+# Identifies snapshots of the raw rows of the catalog queries.
+CATALOG_FORMAT = 'data-models-catalog'
+
+
+def dump_type(typ):
+    """Returns a JSON-serializable description of a type instance.
+
+    The public attributes holding scalars, lists of scalars or nested types
+    are kept, which covers lengths, precision, scale and the like.
+    """
+    cls = type(typ)
+    attrs = {}
+
+    for key, value in vars(typ).items():
+        if key.startswith('_'):
+            continue
+
+        if isinstance(value, types.TypeEngine):
+            value = {'type': dump_type(value)}
+        elif isinstance(value, (list, tuple)):
+            if not all(_scalar(v) for v in value):
+                continue
+
+            value = list(value)
+        elif not _scalar(value):
+            continue
+
+        attrs[key] = value
+
+    return {
+        'class': '{}:{}'.format(cls.__module__, cls.__name__),
+        'attrs': attrs,
+    }
+
+
+def load_type(data):
+    "Rebuilds a type instance from its description."
+    module, name = data['class'].split(':')
+
+    # Only SQLAlchemy types are instantiated from a snapshot.
+    if module != 'sqlalchemy' and not module.startswith('sqlalchemy.'):
+        return types.NullType()
+
+    try:
+        cls = getattr(importlib.import_module(module), name)
+    except (ImportError, AttributeError):
+        return types.NullType()
+
+    # Bypass the constructor since the attributes are restored directly.
+    typ = cls.__new__(cls)
+
+    for key, value in data['attrs'].items():
+        if isinstance(value, dict) and 'type' in value:
+            value = load_type(value['type'])
+
+        setattr(typ, key, value)
+
+    return typ
+
+
+def dump_table(table, token=None):
+    "Returns a JSON-serializable table record."
+    return {
+        'name': table['name'],
+        'token': token,
+        'columns': [{
+            'name': col['name'],
+            'type': dump_type(col['type']),
+            'nullable': col['nullable'],
+            'default': col['default'],
+        } for col in table['columns']],
+        'primary_key': {
+            'name': table['primary_key'].get('name'),
+            'constrained_columns':
+                table['primary_key']['constrained_columns'],
+        },
+        'foreign_keys': [{
+            'name': ref['name'],
+            'constrained_columns': ref['constrained_columns'],
+            'referred_schema': ref['referred_schema'],
+            'referred_table': ref['referred_table'],
+            'referred_columns': ref['referred_columns'],
+        } for ref in table['foreign_keys']],
+        'unique_constraints': [{
+            'name': uniq['name'],
+            'column_names': uniq['column_names'],
+        } for uniq in table['unique_constraints']],
+        'indexes': [{
+            'name': idx['name'],
+            'column_names': idx['column_names'],
+            'unique': bool(idx['unique']),
+        } for idx in table['indexes']],
+    }
+
+
+def load_table(data):
+    "Rebuilds a table record, returning it along with its version token."
+    token = data.pop('token', None)
+
+    for col in data['columns']:
+        col['type'] = load_type(col['type'])
+
+    return data, token
+
+
+def _open(path, mode, compressed):
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf8')
+
+    return open(path, mode, encoding='utf8')
+
+
+def dump(path, dialect, schemas, tables, tokens=None):
+    """Writes table records to a JSON-lines snapshot file.
+
+    The first line is a header identifying the format, version and source.
+    Every following line is one table. Paths ending in .gz are compressed.
+    """
+    tokens = tokens or {}
+
+    header = {
+        'format': FORMAT,
+        'version': VERSION,
+        'dialect': dialect,
+        'schemas': schemas,
+        'created': datetime.utcnow().isoformat(),
+        'tables': len(tables),
+    }
+
+    _write(path, header, (dump_table(table, tokens.get(table['name']))
+                          for table in tables))
+
+
+def dump_catalog(path, dialect, default, schemas):
+    """Writes the rows of the catalog queries to a JSON-lines snapshot
+    file, given as (schema, rows) pairs. Every line after the header is one
+    schema."""
+    header = {
+        'format': CATALOG_FORMAT,
+        'version': VERSION,
+        'dialect': dialect,
+        'default_schema': default,
+        'created': datetime.utcnow().isoformat(),
+    }
+
+    _write(path, header, ({'schema': schema, 'rows': rows}
+                          for schema, rows in schemas))
+
+
+def _write(path, header, lines):
+    "Writes the header and lines to a temporary file moved into place."
+    tmp = '{}.tmp-{}'.format(path, os.getpid())
+
+    try:
+        with _open(tmp, 'w', path.endswith('.gz')) as f:
+            f.write(json.dumps(header, separators=(',', ':')))
+            f.write('\n')
+
+            for data in lines:
+                f.write(json.dumps(data, separators=(',', ':')))
+                f.write('\n')
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    os.replace(tmp, path)
+
+
+def capture(engine, path, workers=None, schemas=None, match=None,
+            views=False, raw=False, retries=0, backoff=1):
+    """Reflects the database and writes the catalog to a snapshot file.
+
+    The schemas, table filter, views and retries are passed on to reflect.
+
+    If `raw` is true, the rows of the catalog queries of the selected
+    tables are written instead, so the reflection itself can be replayed
+    without the database, e.g. as a test fixture.
+
+    Returns a list of (table, error) pairs for tables that failed, which
+    are left out of the snapshot.
+    """
+    schemas = schema_names(engine.dialect, schemas)
+
+    if raw:
+        with engine.connect() as conn:
+            default = conn.dialect.default_schema_name
+
+        dump_catalog(path, engine.dialect.name, default,
+                     record_catalog(engine, schemas=schemas, views=views,
+                                    match=match))
+
+        return []
+
+    tables = []
+    errors = []
+
+    for table, future in reflect(engine, schemas=schemas, workers=workers,
+                                 match=match, views=views, retries=retries,
+                                 backoff=backoff):
+        try:
+            tables.append(future.result())
+        except Exception as e:
+            errors.append((table, e))
+            print('error: {}: {}'.format(table, e), file=sys.stderr)
+
+    tables.sort(key=lambda t: t['name'])
+
+    tokens = versions(engine, schemas=schemas)
+
+    dump(path, engine.dialect.name,
+         schemas or [engine.dialect.default_schema_name],
+         tables, tokens={t['name']: tokens.get(t['name']) for t in tables})
+
+    return errors
+
+
+class Snapshot:
+    """Table records loaded from a snapshot file, or replayed from the
+    recorded catalog rows of a raw snapshot."""
+    def __init__(self, path):
+        self.path = path
+        self.tables = []
+        self.tokens = {}
+
+        with _open(path, 'r', path.endswith('.gz')) as f:
+            self.header = json.loads(f.readline())
+
+            if self.header.get('format') not in (FORMAT, CATALOG_FORMAT):
+                raise ValueError('{} is not a snapshot'.format(path))
+
+            if self.header.get('version') != VERSION:
+                raise ValueError('{} has unsupported snapshot version {}'
+                                 .format(path, self.header.get('version')))
+
+            if self.header['format'] == CATALOG_FORMAT:
+                self.replay(f)
+                return
+
+            for line in f:
+                table, token = load_table(json.loads(line))
+                self.tables.append(table)
+
+                if token is not None:
+                    self.tokens[table['name']] = token
+
+    def replay(self, lines):
+        "Groups recorded catalog rows into table records."
+        for line in lines:
+            data = json.loads(line)
+
+            self.tables.extend(replay_catalog(
+                self.header['dialect'], data['schema'], data['rows'],
+                default=self.header['default_schema']))
+
+        self.tables.sort(key=lambda t: t['name'])
+
+    def versions(self):
+        "Returns the definition version tokens recorded in the snapshot."
+        return dict(self.tokens)
+
+    def reflect(self, workers=None, exclude=(), match=None):
+        "Yields (name, future) pairs like reflect.reflect."
+        for table in self.tables:
+            name = table['name']
+
+            if name not in exclude and (match is None or match(name)):
+                yield name, completed(table)
+
+
+def _scalar(value):
+    return value is None or isinstance(value, (str, int, float, bool))
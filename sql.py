@@ -1,257 +1,429 @@
 #!/usr/bin/env python3
 
 import os
-import csv
-import shutil
+import sys
+from functools import partial
 from getpass import getpass
-from multiprocessing.pool import ThreadPool
-from sqlalchemy import inspect, create_engine, types
+from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
+from sqlalchemy.pool import QueuePool
+from reflect import reflect, versions, name_filter, with_retries, \
+    first_line, schema_names
+from snapshot import Snapshot, capture
+from journal import Journal, default_path
+from sampling import Profiler
+import manifest
+from output import open_sink, check_compression, FORMATS
+from typemap import TypeMap
 from constants import MODEL_COLUMNS, TABLE_COLUMNS, FIELD_COLUMNS, \
     SCHEMA_COLUMNS, INDEX_COLUMNS, CONSTRAINT_COLUMNS, REFERENCE_COLUMNS
 
 
-def map_field_attrs(col):
-    typ = col['type']
-
-    # Map simple type.
-    if isinstance(typ, types.Integer):
-        col['dm_type'] = 'integer'
-    elif isinstance(typ, types.Boolean):
-        col['dm_type'] = 'boolean'
-    elif isinstance(typ, types.Date):
-        col['dm_type'] = 'date'
-    elif isinstance(typ, types.DateTime):
-        col['dm_type'] = 'datetime'
-    elif isinstance(typ, types.Float):
-        col['dm_type'] = 'number'
-    elif isinstance(typ, types._Binary):
-        col['dm_type'] = 'bytes'
-    elif isinstance(typ, types.Numeric):
-        col['dm_type'] = 'number'
-    elif isinstance(typ, types.String):
-        col['dm_type'] = 'string'
+def map_field_attrs(col, typemap):
+    col['dm_type'] = typemap.resolve(col['type'])
 
     # Ignore Postgres sequence-based defaults.
     if col['default'] and col['default'].startswith('nextval'):
         col['default'] = ''
 
 
-def generate(engine, model, version, root):
-    with open(os.path.join(root, 'models.csv'), 'w') as f:
-        w = csv.writer(f)
-        w.writerows([
-            MODEL_COLUMNS,
-            (model, version, '', '', ''),
-        ])
-
-    inspector = inspect(engine)
-
-    tables = inspector.get_table_names()
-    generate_tables(root, model, version, tables)
-
-    pool = ThreadPool()
-
-    for table in tables:
-        args = (inspector, root, model, version, table)
-        pool.apply_async(generate_table_files, args=args)
-
-    pool.close()
-    pool.join()
-
+def table_fingerprint(info):
+    "Returns a content hash of a reflected table record."
+    pk = info['primary_key']
+
+    return manifest.fingerprint((
+        [(c['name'], repr(c['type']), c['nullable'], c['default'])
+         for c in info['columns']],
+        (pk['name'], pk['constrained_columns']),
+        [(r['name'], r['constrained_columns'], r['referred_schema'],
+          r['referred_table'], r['referred_columns'])
+         for r in info['foreign_keys']],
+        [(u['name'], u['column_names']) for u in info['unique_constraints']],
+        [(i['name'], i['column_names'], i['unique'])
+         for i in info['indexes']],
+    ))
+
+
+def generate(source, model, version, sink, workers=None, incremental=False,
+             typemap=None, schemas=None, match=None, views=False,
+             profiler=None, journal=None, retries=0, backoff=1):
+    """Reflects the database and writes the model files to the sink.
+
+    The source is either an engine or a Snapshot, in which case the
+    recorded catalog is used and no connection is made.
+
+    In incremental mode, tables whose fingerprint matches the manifest of
+    the previous run are carried over rather than rewritten and tables
+    whose catalog version is unchanged are not reflected at all.
+
+    Column types are resolved with the TypeMap, by default one that falls
+    back to 'string'. Types without a mapping are reported at the end.
+
+    The `schemas`, `match` predicate and `views` flag select what is
+    reflected, see reflect.reflect. A snapshot is only filtered by `match`.
+
+    If a sampling.Profiler is given, the data of the tables written in
+    this run is profiled once reflection is done. Tables that are carried
+    over keep their previous profile.
+
+    If a journal.Journal is given, every completed table is recorded in it
+    and the tables it holds from an interrupted run are written from it
+    rather than reflected again. They are not profiled again. Transient
+    database errors are retried `retries` times with exponential backoff
+    from `backoff` seconds, see reflect.with_retries.
+
+    Returns a list of (table, error) pairs for tables that failed.
+    """
+    if typemap is None:
+        typemap = TypeMap()
+
+    generate_models(sink, model, version)
+
+    previous = manifest.load(sink, model, version) if incremental else {}
+    current = {}
+    changes = manifest.new_changes()
+    errors = []
+    written = []
+
+    if isinstance(source, Snapshot):
+        reflect_tables, table_versions = source.reflect, source.versions
+    else:
+        reflect_tables = partial(reflect, source, schemas=schemas,
+                                 views=views, retries=retries,
+                                 backoff=backoff)
+        table_versions = partial(with_retries(versions, retries, backoff),
+                                 source, schemas=schemas)
+
+    tokens = {table: manifest.fingerprint(token)
+              for table, token in table_versions().items()
+              if match is None or match(table)}
+    skip = set()
+
+    for table, token in tokens.items():
+        entry = previous.get(table)
+
+        if entry and entry.get('token') == token:
+            skip.add(table)
+            sink.keep(table)
+            current[table] = entry
+            changes['unchanged'].append(table)
+
+    if journal is not None:
+        for table, entry, files in journal.completed():
+            if table in skip or (match is not None and not match(table)):
+                continue
+
+            if files is None:
+                sink.keep(table)
+            else:
+                sink.write(files)
+
+            skip.add(table)
+            current[table] = entry
+            manifest.compare(previous, table, entry['fingerprint'], changes)
+
+    # Write each table as soon as its reflection completes.
+    for table, future in reflect_tables(workers=workers, exclude=skip,
+                                        match=match):
+        try:
+            info = future.result()
+            fp = table_fingerprint(info)
+
+            if manifest.compare(previous, table, fp, changes):
+                files = generate_table_files(sink, model, version, info,
+                                             typemap)
+                written.append(info)
+            else:
+                files = None
+                sink.keep(table)
+        except Exception as e:
+            errors.append((table, e))
+            print('error: {}: {}'.format(table, e), file=sys.stderr)
+        else:
+            current[table] = {
+                'fingerprint': fp,
+                'token': tokens.get(table),
+            }
+
+            if journal is not None:
+                journal.record(table, current[table], files)
+
+    if profiler is not None:
+        profiler.run(sink, model, version, written)
+
+    # Keep the previous files of tables that failed this time, which are
+    # listed and reported as unchanged.
+    for table, _ in errors:
+        if table in previous:
+            sink.keep(table)
+            current[table] = previous[table]
+
+            for status in changes.values():
+                if table in status:
+                    status.remove(table)
+
+            changes['unchanged'].append(table)
+
+    generate_tables(sink, model, version, sorted(current))
+
+    manifest.save(sink, model, version, current)
+
+    if incremental:
+        manifest.removed(previous, current, changes)
+        manifest.report(changes)
+
+    typemap.report()
+
+    return errors
+
+
+def generate_table_files(sink, model, version, info, typemap):
+    "Writes the files of a table record as one batch and returns them."
+    files = table_files(model, version, info, typemap)
+    sink.write(files)
+
+    return files
+
+
+def table_files(model, version, info, typemap):
+    "Returns the files of a reflected table record."
+    table = info['name']
+
+    files = []
+    files.extend(generate_fields(model, version, table, info['columns'],
+                                 typemap))
+    files.extend(generate_references(model, version, table,
+                                     info['foreign_keys']))
+    files.extend(generate_indexes(model, version, table, info['indexes']))
+    files.extend(generate_constraints(model, version, table, info['columns'],
+                                      info['primary_key'],
+                                      info['unique_constraints']))
 
-def generate_table_files(inspector, dirname, model, version, table):
-    dirname = os.path.join(dirname, table)
+    return files
 
-    if not os.path.exists(dirname):
-        os.mkdir(dirname)
 
-    generate_fields(inspector, dirname, model, version, table)
-    generate_references(inspector, dirname, model, version, table)
-    generate_indexes(inspector, dirname, model, version, table)
-    generate_constraints(inspector, dirname, model, version, table)
+def generate_models(sink, model, version):
+    "Creates a models file."
+    sink.write([
+        ('models.csv', MODEL_COLUMNS, [(model, version, '', '', '')]),
+    ])
 
 
-def generate_tables(dirname, model, version, tables):
+def generate_tables(sink, model, version, tables):
     "Creates a tables file."
-    fn = os.path.join(dirname, 'tables.csv')
+    rows = []
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(TABLE_COLUMNS)
-
-        for table in tables:
-            w.writerow([
-                model,
-                version,
-                table,
-                '',
-            ])
+    for table in tables:
+        rows.append([
+            model,
+            version,
+            table,
+            '',
+        ])
 
+    sink.write([
+        ('tables.csv', TABLE_COLUMNS, rows),
+    ])
 
-def generate_fields(inspector, dirname, model, version, table):
-    "Creates a fields file."
-    fields = inspector.get_columns(table)
 
+def generate_fields(model, version, table, fields, typemap):
+    "Returns the fields and schema files."
     if not fields:
-        return
+        return []
+
+    rows = []
+
+    for field in fields:
+        rows.append([
+            model,
+            version,
+            table,
+            field['name'],
+            '',  # label
+            '',  # description
+        ])
 
-    fn = os.path.join(dirname, 'fields.csv')
+    schemata = []
+
+    for field in fields:
+        map_field_attrs(field, typemap)
+
+        schemata.append([
+            model,
+            version,
+            table,
+            field['name'],
+            field['dm_type'],
+            getattr(field['type'], 'length', ''),
+            getattr(field['type'], 'precision', ''),
+            getattr(field['type'], 'scale', ''),
+            field['default'],
+        ])
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(FIELD_COLUMNS)
+    return [
+        (os.path.join(table, 'fields.csv'), FIELD_COLUMNS, rows),
+        (os.path.join(table, 'schema.csv'), SCHEMA_COLUMNS, schemata),
+    ]
 
-        for field in fields:
-            w.writerow([
-                model,
-                version,
-                table,
-                field['name'],
-                '',  # label
-                '',  # description
-            ])
 
-    fn = os.path.join(dirname, 'schema.csv')
+def generate_references(model, version, table, refs):
+    if not refs:
+        return []
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(SCHEMA_COLUMNS)
+    rows = []
 
-        for field in fields:
-            map_field_attrs(field)
+    for ref in refs:
+        cols = ref['constrained_columns']
+        rcols = ref['referred_columns']
 
-            w.writerow([
+        for i, col in enumerate(cols):
+            rows.append([
                 model,
                 version,
                 table,
-                field['name'],
-                field['dm_type'],
-                getattr(field['type'], 'length', ''),
-                getattr(field['type'], 'precision', ''),
-                getattr(field['type'], 'scale', ''),
-                field['default'],
+                col,
+                ref['referred_table'],
+                rcols[i],
+                ref['name'],
             ])
 
+    return [
+        (os.path.join(table, 'references.csv'), REFERENCE_COLUMNS, rows),
+    ]
 
-def generate_references(inspector, dirname, model, version, table):
-    refs = inspector.get_foreign_keys(table)
-
-    if not refs:
-        return
-
-    fn = os.path.join(dirname, 'references.csv')
-
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(REFERENCE_COLUMNS)
-
-        for ref in refs:
-            cols = ref['constrained_columns']
-            rcols = ref['referred_columns']
-
-            for i, col in enumerate(cols):
-                w.writerow([
-                    model,
-                    version,
-                    table,
-                    col,
-                    ref['referred_table'],
-                    rcols[i],
-                    ref['name'],
-                ])
-
-
-def generate_indexes(inspector, dirname, model, version, table):
-    indexes = inspector.get_indexes(table)
 
+def generate_indexes(model, version, table, indexes):
     if not indexes:
-        return
-
-    fn = os.path.join(dirname, 'indexes.csv')
+        return []
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(INDEX_COLUMNS)
-
-        for idx in indexes:
-            for col in idx['column_names']:
-                w.writerow([
-                    model,
-                    version,
-                    table,
-                    col,
-                    idx['name'],
-                    '',
-                ])
+    rows = []
 
+    for idx in indexes:
+        for col in idx['column_names']:
+            rows.append([
+                model,
+                version,
+                table,
+                col,
+                idx['name'],
+                '',
+            ])
 
-def generate_constraints(inspector, dirname, model, version, table):
-    fn = os.path.join(dirname, 'constraints.csv')
+    return [
+        (os.path.join(table, 'indexes.csv'), INDEX_COLUMNS, rows),
+    ]
 
-    fields = inspector.get_columns(table)
 
+def generate_constraints(model, version, table, fields, pk, uniques):
     if not fields:
-        return
+        return []
 
     not_nulls = [f for f in fields if not f['nullable']]
 
-    pk = inspector.get_pk_constraint(table)
-    uniques = inspector.get_unique_constraints(table)
+    if not pk['constrained_columns'] and not uniques and not not_nulls:
+        return []
 
-    if not pk and not uniques and not not_nulls:
-        return
+    rows = []
 
-    with open(fn, 'w') as f:
-        w = csv.writer(f)
-        w.writerow(CONSTRAINT_COLUMNS)
+    for col in pk['constrained_columns']:
+        rows.append([
+            model,
+            version,
+            table,
+            col,
+            'primary key',
+            pk['name'],
+        ])
 
-        for col in pk['constrained_columns']:
-            w.writerow([
+    for uniq in uniques:
+        for col in uniq['column_names']:
+            rows.append([
                 model,
                 version,
                 table,
                 col,
-                'primary key',
-                pk['name'],
+                'unique',
+                uniq['name'],
             ])
 
-        for uniq in uniques:
-            for col in uniq['column_names']:
-                w.writerow([
-                    model,
-                    version,
-                    table,
-                    col,
-                    'unique',
-                    uniq['name'],
-                ])
-
-        for field in not_nulls:
-            w.writerow([
-                model,
-                version,
-                table,
-                field['name'],
-                'not null',
-                '',
-            ])
+    for field in not_nulls:
+        rows.append([
+            model,
+            version,
+            table,
+            field['name'],
+            'not null',
+            '',
+        ])
+
+    return [
+        (os.path.join(table, 'constraints.csv'), CONSTRAINT_COLUMNS, rows),
+    ]
+
+
+# Engine options by driver. cx_Oracle fetches 50 rows per round trip by
+# default, which dominates the time of the catalog queries.
+DRIVER_OPTIONS = {
+    'cx_oracle': {'arraysize': 1000},
+}
+
+
+def connect(url, workers):
+    "Creates an engine whose pool holds a connection per worker."
+    dialect = url.get_dialect()
+    options = dict(DRIVER_OPTIONS.get(getattr(dialect, 'driver', None), {}))
+
+    if issubclass(dialect.get_pool_class(url), QueuePool):
+        options.update(pool_size=workers, max_overflow=0)
+
+    return create_engine(url, **options)
 
 
 def main(argv=None):
     usage = """SQL Data Model Generator
 
-    Usage: sql <model> <version> <engine> <database> [--dir=DIR] \
-            [--host=HOST] [--port=PORT] \
-            [--user=USER] [--pass=PASS]
+    Usage:
+        sql snapshot <path> <engine> <database> [--host=HOST] [--port=PORT] [--user=USER] [--pass=PASS] [--workers=NUM] [--schema=NAME...] [--include=PATTERN...] [--exclude=PATTERN...] [--views] [--raw] [--retries=NUM] [--backoff=SEC]
+        sql generate <model> <version> --from-snapshot=PATH [--dir=DIR] [--format=FORMAT] [--store=DIR] [--compress=METHOD] [--incremental] [--resume] [--fallback-type=TYPE] [--include=PATTERN...] [--exclude=PATTERN...]
+        sql <model> <version> <engine> <database> [--dir=DIR] [--format=FORMAT] [--store=DIR] [--compress=METHOD] [--host=HOST] [--port=PORT] [--user=USER] [--pass=PASS] [--workers=NUM] [--incremental] [--resume] [--retries=NUM] [--backoff=SEC] [--fallback-type=TYPE] [--schema=NAME...] [--include=PATTERN...] [--exclude=PATTERN...] [--views] [--profile-data] [--sample-percent=PERCENT] [--sample-rows=NUM] [--profile-budget=SECONDS]
+
+    The snapshot command writes the reflected catalog to a JSON-lines file,
+    compressed if the path ends in .gz. With --raw, the rows of the catalog
+    queries are written instead and reflected again when generating, which
+    makes a fixture of the reflection of a database. The generate command
+    writes the model from either without connecting to the database.
+
+    Each completed table is recorded in a journal next to the output, which
+    is removed once a run completes without errors. With --resume, the
+    tables recorded by an interrupted or failed run are written from the
+    journal and only the others are reflected.
 
     Options:
         -h --help       Show this screen.
-        --dir=DIR       Name of the directory to output the files.
+        --dir=DIR       Name of the directory to output the files. Paths ending in .tar, .tar.gz, .tgz or .zip are written as a single archive.
+        --format=FORMAT     Layout of the output: tree writes a directory of files per table, flat a single file per entity (fields.csv, schema.csv, ...) for all tables, jsonl a single gzipped JSON-lines bundle and sqlite a single SQLite bundle [default: tree].
+        --store=DIR     Write the files to a content-addressed blob store rather than the output directory, storing identical files once. The output is named <model>/<version> in the store.
+        --compress=METHOD   Compression of the files in the blob store, none, gzip or zstd [default: gzip].
         --host=HOST     Host of the database server. Defaults to localhost.
         --port=PORT     Port of the database server. Defaults to default port for the engine.
         --user=USER     Username to connect with.
         --pass=PASS     Password to connect with. If set to *, a prompt will be provided.
+        --workers=NUM   Number of concurrent reflection workers and pooled connections. Defaults to the number of CPUs.
+        --incremental   Only rewrite tables that changed since the last run, based on the manifest in the output directory.
+        --resume        Resume from the journal of the previous run rather than starting over.
+        --retries=NUM   Number of retries of a catalog query or table after a transient database error, each on a new connection [default: 3].
+        --backoff=SEC   Seconds to wait before the first retry, doubled on each retry [default: 1].
+        --fallback-type=TYPE    Data model type of columns whose type has no mapping [default: string].
+        --from-snapshot=PATH    Snapshot file written by the snapshot command.
+        --schema=NAME   Schema to reflect, may be repeated. Tables are then named <schema>.<table>. Defaults to the default schema of the connection.
+        --include=PATTERN   Only reflect tables matching the pattern, may be repeated. Patterns are globs, or regular expressions if prefixed with re:.
+        --exclude=PATTERN   Do not reflect tables matching the pattern, may be repeated.
+        --views         Reflect views as well as tables.
+        --raw           Write the rows of the catalog queries of the selected tables rather than the reflected tables.
+        --profile-data  Profile a sample of the rows of each table and write its observed max length, min, max, null fraction and approximate distinct count to profile.csv.
+        --sample-percent=PERCENT    Percent of the table sampled with TABLESAMPLE or SAMPLE where supported [default: 1].
+        --sample-rows=NUM   Maximum number of rows profiled per table [default: 10000].
+        --profile-budget=SECONDS    Time after which the profile of a table stops reading rows [default: 30].
 
     """  # noqa
 
@@ -259,33 +431,116 @@ def main(argv=None):
 
     args = docopt(usage, argv=argv, version='0.1')
 
-    # Default to a directory named after the database.
-    if not args['--dir']:
-        args['--dir'] = os.path.join(os.getcwd(),
-                                     args['<model>'],
-                                     args['<version>'])
+    if args['--format'] not in FORMATS:
+        print('error: unknown format {}'.format(args['--format']),
+              file=sys.stderr)
+        sys.exit(1)
 
-    # Ensure the output directory is created.
-    rootdir = args['--dir']
+    try:
+        check_compression(args['--compress'])
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
 
-    if os.path.exists(rootdir):
-        shutil.rmtree(rootdir)
+    workers = int(args['--workers'] or os.cpu_count())
+    schemas = args['--schema'] or None
+    match = name_filter(args['--include'], args['--exclude'])
 
-    os.makedirs(rootdir)
+    profiler = None
+
+    if args['--profile-data']:
+        percent = float(args['--sample-percent'])
+
+        if not 0 < percent <= 100:
+            print('error: sample percent must be within (0, 100]',
+                  file=sys.stderr)
+            sys.exit(1)
 
     if args['--pass'] == '*':
         args['--pass'] = getpass('password: ')
 
-    url = URL(args['<engine>'],
-              username=args['--user'],
-              password=args['--pass'],
-              host=args['--host'],
-              port=args['--port'],
-              database=args['<database>'])
+    if args['--from-snapshot']:
+        source = Snapshot(args['--from-snapshot'])
+    else:
+        url = URL(args['<engine>'],
+                  username=args['--user'],
+                  password=args['--pass'],
+                  host=args['--host'],
+                  port=args['--port'],
+                  database=args['<database>'])
+
+        source = connect(url, workers)
+        schemas = schema_names(source.dialect, schemas)
+
+        if args['--profile-data']:
+            profiler = Profiler(source, schemas=schemas, percent=percent,
+                                rows=int(args['--sample-rows']),
+                                budget=float(args['--profile-budget']),
+                                workers=workers)
+
+    if args['snapshot']:
+        try:
+            errors = capture(source, args['<path>'], workers=workers,
+                             schemas=schemas, match=match,
+                             views=args['--views'], raw=args['--raw'],
+                             retries=int(args['--retries']),
+                             backoff=float(args['--backoff']))
+        except ValueError as e:
+            print('error: {}'.format(e), file=sys.stderr)
+            sys.exit(1)
+
+        if errors:
+            print('{} table(s) failed.'.format(len(errors)), file=sys.stderr)
+            sys.exit(1)
 
-    engine = create_engine(url)
+        return
+
+    # Default to a directory named after the database.
+    if not args['--dir']:
+        args['--dir'] = os.path.join(os.getcwd(),
+                                     args['<model>'],
+                                     args['<version>'])
 
-    generate(engine, args['<model>'], args['<version>'], args['--dir'])
+    # Outputs in a blob store are named after the model and version.
+    if args['--store']:
+        args['--dir'] = os.path.join(args['<model>'], args['<version>'])
+
+    try:
+        journal = Journal(default_path(args['--dir'], args['--store']),
+                          args['<model>'], args['<version>'],
+                          resume=args['--resume'])
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+    # The output is staged and only replaces the previous tree once
+    # everything has been written.
+    try:
+        with open_sink(args['--dir'], args['--format'], args['--store'],
+                       args['--compress']) as sink:
+            errors = generate(source, args['<model>'], args['<version>'],
+                              sink, workers=workers,
+                              incremental=args['--incremental'],
+                              typemap=TypeMap(args['--fallback-type']),
+                              schemas=schemas, match=match,
+                              views=args['--views'], profiler=profiler,
+                              journal=journal,
+                              retries=int(args['--retries']),
+                              backoff=float(args['--backoff']))
+    finally:
+        journal.close()
+
+    if errors:
+        print('{} table(s) failed:'.format(len(errors)), file=sys.stderr)
+
+        for table, error in sorted(errors, key=lambda e: e[0]):
+            print('  {}: {}'.format(table, first_line(error)),
+                  file=sys.stderr)
+
+        print('Run again with --resume to only retry them.', file=sys.stderr)
+        sys.exit(1)
+
+    journal.remove()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from output import BlobStore, open_sink
+
+
+def materialize(store, name, path):
+    """Writes the files of an output of the store as a plain directory
+    tree, or an archive if the path ends in an archive extension."""
+    files = store.load(name)
+
+    if files is None:
+        raise ValueError('no output named {}'.format(name))
+
+    with open_sink(path) as sink:
+        for fn in sorted(files):
+            sink.put(fn, store.get(files[fn]))
+
+    return len(files)
+
+
+def usage_rows(store):
+    """Returns a (name, files, bytes) row per output and the bytes taken by
+    the blobs they refer to."""
+    rows = []
+    blobs = set()
+
+    for name in store.names():
+        files = store.load(name)
+        rows.append((name, len(files),
+                     sum(entry['size'] for entry in files.values())))
+
+        blobs.update(store.blob_path(entry['blob'], entry['compression'])
+                     for entry in files.values())
+
+    return rows, sum(os.path.getsize(path) for path in blobs)
+
+
+def main(argv=None):
+    usage = """Data Models Blob Store
+
+    Usage:
+        store list <store>
+        store materialize <store> <name> [--dir=DIR]
+        store gc <store>
+
+    A blob store holds the outputs written with --store, named <model>/<version>
+    or <project>/<version>, with the files they share stored once.
+
+    The list command prints the files and size of each output and the space
+    taken by the store. The materialize command writes the files of an output
+    as the plain directory tree, or archive, the output directory would have
+    held. The gc command removes files no output refers to anymore and must
+    not run while outputs are being written to the store.
+
+    Options:
+        -h --help       Show this screen.
+        --dir=DIR       Name of the directory to write the files to. Paths ending in .tar, .tar.gz, .tgz or .zip are written as a single archive. Defaults to the output name.
+
+    """  # noqa
+
+    from docopt import docopt
+
+    args = docopt(usage, argv=argv, version='0.1')
+
+    if not os.path.isdir(args['<store>']):
+        print('error: {} is not a blob store'.format(args['<store>']),
+              file=sys.stderr)
+        sys.exit(1)
+
+    store = BlobStore(args['<store>'])
+
+    try:
+        if args['list']:
+            rows, stored = usage_rows(store)
+
+            for name, files, size in rows:
+                print('{}\t{} files\t{} bytes'.format(name, files, size))
+
+            print('{} output(s), {} bytes of files in {} bytes stored'.format(
+                len(rows), sum(row[2] for row in rows), stored),
+                file=sys.stderr)
+        elif args['materialize']:
+            path = args['--dir'] or os.path.join(os.getcwd(), args['<name>'])
+            count = materialize(store, args['<name>'], path)
+
+            print('{} file(s) written to {}'.format(count, path),
+                  file=sys.stderr)
+        else:
+            count, size = store.gc()
+
+            print('{} blob(s) removed, {} bytes'.format(count, size),
+                  file=sys.stderr)
+    except Exception as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy.engine.url import make_url
+import ddl
+import sql
+from diff import load
+from output import open_sink
+from tests.util import make_database, rows
+
+
+class DDLTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = sql.connect(make_database(
+            os.path.join(self.dir, 'db.sqlite'), 5), 2)
+
+        self.model = os.path.join(self.dir, 'model')
+
+        with open_sink(self.model) as sink:
+            sql.generate(self.engine, 'm', 'v', sink)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def script(self, model=None):
+        output = os.path.join(self.dir, 'create.sql')
+        ddl.main([model or self.model, 'sqlite', '--output', output])
+
+        with open(output) as f:
+            return f.read()
+
+    def round_trip(self, model):
+        "Runs the sqlite script of a model and returns the rows of a copy."
+        path = os.path.join(self.dir, 'copy.sqlite')
+
+        conn = sqlite3.connect(path)
+        conn.executescript(self.script(model))
+        conn.close()
+
+        copy = sql.connect(make_url('sqlite:///{}'.format(path)), 2)
+        target = os.path.join(self.dir, 'copy')
+
+        try:
+            with open_sink(target) as sink:
+                sql.generate(copy, 'm', 'v', sink)
+        finally:
+            copy.dispose()
+
+        return rows(target)
+
+    def test_round_trip(self):
+        copied = self.round_trip(self.model)
+        original = rows(self.model)
+
+        # SQLite reports an INTEGER PRIMARY KEY as nullable, which the
+        # script declares NOT NULL.
+        added = [dict(row) for row in copied['constraints']
+                 if row not in original['constraints']]
+
+        self.assertEqual({(row['table'], row['field'], row['type'])
+                          for row in added},
+                         {('t{:02d}'.format(i), 'id', 'not null')
+                          for i in range(5)})
+
+        copied['constraints'] = original['constraints']
+        self.assertEqual(copied, original)
+
+    def test_unnamed_constraints(self):
+        path = os.path.join(self.dir, 'unnamed.sqlite')
+
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+            CREATE TABLE person (id INTEGER NOT NULL PRIMARY KEY);
+            CREATE TABLE account (
+                id INTEGER NOT NULL PRIMARY KEY,
+                email VARCHAR(50) UNIQUE,
+                ssn VARCHAR(11) UNIQUE,
+                created_by INTEGER REFERENCES person (id),
+                person_id INTEGER REFERENCES person (id)
+            );
+        ''')
+        conn.close()
+
+        engine = sql.connect(make_url('sqlite:///{}'.format(path)), 2)
+        model = os.path.join(self.dir, 'unnamed')
+
+        try:
+            with open_sink(model) as sink:
+                sql.generate(engine, 'm', 'v', sink)
+        finally:
+            engine.dispose()
+
+        script = self.script(model)
+
+        self.assertIn('UNIQUE (email)', script)
+        self.assertIn('UNIQUE (ssn)', script)
+        self.assertIn('FOREIGN KEY(created_by) REFERENCES person (id)',
+                      script)
+        self.assertIn('FOREIGN KEY(person_id) REFERENCES person (id)',
+                      script)
+
+        self.assertEqual(self.round_trip(model), rows(model))
+
+    def test_reference_order(self):
+        model = ddl.Model(load(self.model))
+
+        self.assertEqual(list(model.tables),
+                         ['t00', 't01', 't02', 't03', 't04'])
+        self.assertEqual(len(model.foreign_keys), 4)
+        self.assertEqual(len(model.indexes), 5)
+
+    def test_unknown_index_field(self):
+        entities = load(self.model)
+        entities['indexes'][0]['field'] = 'missing'
+
+        with self.assertRaises(ValueError) as cm:
+            ddl.Model(entities)
+
+        self.assertIn('unknown field missing', str(cm.exception))
+
+        with mock.patch('ddl.load', return_value=entities), \
+                mock.patch('sys.stderr', new_callable=io.StringIO) as err, \
+                self.assertRaises(SystemExit):
+            self.script()
+
+        self.assertIn('error: ', err.getvalue())
@@ -0,0 +1,169 @@
+import io
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from diff import compare, differs, main
+from tests.util import make_database
+
+
+def model(tables, fields, references):
+    """Returns the loaded rows of a model of the given tables, (table, field,
+    label) fields and (table, field, ref_table, name) references."""
+    def row(**values):
+        return dict(values, model='m', version='v')
+
+    return {
+        'tables': [row(table=t, description='') for t in tables],
+        'fields': [row(table=t, field=f, label=l, description='')
+                   for t, f, l in fields],
+        'references': [row(table=t, field=f, ref_table=r, ref_field='id',
+                           name=n)
+                       for t, f, r, n in references],
+    }
+
+
+LEFT = model(
+    ['person', 'site', 'visit'],
+    [('person', 'id', 'Id'), ('person', 'name', 'Name'),
+     ('person', 'site_id', 'Site'), ('site', 'id', 'Id'),
+     ('visit', 'id', 'Id'), ('visit', 'person_id', 'Person'),
+     ('visit', 'date', 'Date')],
+    [('person', 'site_id', 'site', 'fk_person'),
+     ('visit', 'person_id', 'person', 'fk_visit')])
+
+# Replaces site by clinic and changes a label and the name of a reference.
+RIGHT = model(
+    ['clinic', 'person', 'visit'],
+    [('clinic', 'id', 'Id'), ('person', 'id', 'Id'),
+     ('person', 'name', 'Full Name'), ('person', 'age', 'Age'),
+     ('visit', 'id', 'Id'), ('visit', 'person_id', 'Person'),
+     ('visit', 'clinic_id', 'Clinic')],
+    [('visit', 'clinic_id', 'clinic', 'fk_clinic'),
+     ('visit', 'person_id', 'person', 'fk_visit_person')])
+
+
+class CompareTest(unittest.TestCase):
+    def setUp(self):
+        self.result = compare(LEFT, RIGHT)
+
+    def keys(self, entity, kind, *columns):
+        entries = self.result[entity][kind]
+
+        if kind == 'changed':
+            entries = [e['key'] for e in entries]
+
+        return [tuple(e[c] for c in columns) for e in entries]
+
+    def test_tables(self):
+        tables = self.result['tables']
+
+        self.assertEqual(tables['added'],
+                         [{'table': 'clinic', 'description': ''}])
+        self.assertEqual(tables['removed'],
+                         [{'table': 'site', 'description': ''}])
+        # Tables changed through their entries are listed without values.
+        self.assertEqual(tables['changed'], [{'key': {'table': 'person'}},
+                                             {'key': {'table': 'visit'}}])
+
+    def test_fields(self):
+        # The fields of added and removed tables are not repeated.
+        self.assertEqual(self.keys('fields', 'added', 'table', 'field'),
+                         [('person', 'age'), ('visit', 'clinic_id')])
+        self.assertEqual(self.keys('fields', 'removed', 'table', 'field'),
+                         [('person', 'site_id'), ('visit', 'date')])
+        self.assertEqual(self.result['fields']['changed'], [{
+            'key': {'table': 'person', 'field': 'name'},
+            'before': {'label': 'Name', 'description': ''},
+            'after': {'label': 'Full Name', 'description': ''},
+        }])
+
+    def test_references(self):
+        references = self.result['references']
+
+        self.assertEqual(references['added'], [{
+            'table': 'visit', 'field': 'clinic_id',
+            'rows': [{'ref_table': 'clinic', 'ref_field': 'id',
+                      'name': 'fk_clinic'}],
+        }])
+        self.assertEqual(self.keys('references', 'removed', 'table', 'field'),
+                         [('person', 'site_id')])
+        self.assertEqual(
+            [(e['before'][0]['name'], e['after'][0]['name'])
+             for e in references['changed']],
+            [('fk_visit', 'fk_visit_person')])
+
+    def test_same(self):
+        result = compare(LEFT, LEFT)
+
+        self.assertFalse(differs(result, ('added', 'removed', 'changed')))
+        self.assertTrue(all(not entries for kinds in result.values()
+                            for entries in kinds.values()))
+
+    def test_only_added(self):
+        right = model(['person', 'site', 'visit', 'clinic'],
+                      [('person', 'age', 'Age')], [])
+        result = compare(model(['person', 'site', 'visit'], [], []), right)
+
+        self.assertTrue(differs(result, ('added', 'removed', 'changed')))
+        self.assertFalse(differs(result, ('removed', 'changed')))
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.left = make_database(os.path.join(self.dir, 'left.sqlite'), 3)
+        self.right = make_database(os.path.join(self.dir, 'right.sqlite'), 3)
+        self.output = os.path.join(self.dir, 'diff.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_main(self, *args):
+        "Returns the exit code of the command."
+        argv = [str(self.left), str(self.right), '--output', self.output]
+
+        try:
+            main(argv + list(args))
+        except SystemExit as e:
+            return e.code
+
+        return 0
+
+    def alter(self, sql):
+        conn = sqlite3.connect(self.right.database)
+        conn.execute(sql)
+        conn.commit()
+        conn.close()
+
+    def test_same(self):
+        self.assertEqual(self.run_main(), 0)
+
+    def test_added(self):
+        self.alter('ALTER TABLE t01 ADD COLUMN note TEXT')
+
+        self.assertEqual(self.run_main(), 1)
+        self.assertEqual(self.run_main('--allow-added'), 0)
+
+        with open(self.output) as f:
+            summary = json.load(f)['summary']
+
+        self.assertEqual(summary['fields']['added'], 1)
+        self.assertEqual(summary['tables']['changed'], 1)
+
+    def test_removed(self):
+        self.alter('DROP TABLE t02')
+
+        self.assertEqual(self.run_main(), 1)
+        self.assertEqual(self.run_main('--allow-added'), 1)
+
+    def test_load_error(self):
+        self.left = os.path.join(self.dir, 'missing')
+
+        with mock.patch('sys.stderr', io.StringIO()) as stderr:
+            self.assertEqual(self.run_main(), 2)
+
+        self.assertIn('does not exist', stderr.getvalue())
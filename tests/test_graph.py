@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from graph import Graph, main
+from tests.util import make_database
+
+
+# A chain of a, b and c, a cycle of x and y referring to c, a table s
+# referring to itself and a, and the disconnected p, q and z.
+REFERENCES = [
+    ('a', 'b'), ('c', 'a'), ('c', 'b'),
+    ('x', 'y'), ('y', 'x'), ('x', 'c'),
+    ('s', 's'), ('s', 'b'),
+    ('q', 'p'),
+]
+
+
+def graph():
+    g = Graph(['z'])
+
+    for table, ref in REFERENCES:
+        g.add(table, ref)
+
+    return g
+
+
+class GraphTest(unittest.TestCase):
+    def test_components(self):
+        components = graph().components()
+
+        self.assertEqual(sorted(components), [
+            ['a'], ['b'], ['c'], ['p'], ['q'], ['s'], ['x', 'y'], ['z'],
+        ])
+
+        # Each component comes after the components it refers to.
+        position = {t: i for i, c in enumerate(components) for t in c}
+
+        for table, ref in REFERENCES:
+            self.assertLessEqual(position[ref], position[table])
+
+    def test_cycles(self):
+        self.assertEqual(graph().cycles(), [['s'], ['x', 'y']])
+        self.assertEqual(Graph(['a']).cycles(), [])
+
+    def test_levels(self):
+        self.assertEqual(graph().levels(), [
+            ['b', 'p', 'z'],
+            ['a', 'q', 's'],
+            ['c'],
+            ['x', 'y'],
+        ])
+        self.assertEqual(graph().order(),
+                         ['b', 'p', 'z', 'a', 'q', 's', 'c', 'x', 'y'])
+
+    def test_schedule(self):
+        self.assertEqual(graph().schedule(2, {'b': 5}), [
+            [['b'], ['p', 'z']],
+            [['a', 's'], ['q']],
+            [['c']],
+            [['x'], ['y']],
+        ])
+        self.assertEqual(graph().schedule(1)[0], [['b', 'p', 'z']])
+
+    def test_impact(self):
+        g = graph()
+
+        self.assertEqual(g.downstream('b'), ['a', 'c', 's', 'x', 'y'])
+        self.assertEqual(g.downstream('s'), [])
+        self.assertEqual(g.upstream('x'), ['a', 'b', 'c', 'y'])
+        self.assertEqual(g.upstream('z'), [])
+
+    def test_dot(self):
+        dot = graph().to_dot()
+
+        self.assertIn('    "x" -> "y" [color=red];', dot)
+        self.assertIn('    "s" -> "s" [color=red];', dot)
+        self.assertIn('    "x" -> "c";', dot)
+        self.assertIn('    "z";', dot)
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_json(self):
+        url = make_database(os.path.join(self.dir, 'db.sqlite'), 3)
+        output = os.path.join(self.dir, 'graph.json')
+        main([str(url), '--workers=2', '--output', output])
+
+        with open(output) as f:
+            data = json.load(f)
+
+        self.assertEqual(data['cycles'], [])
+        self.assertEqual(data['levels'], [['t00'], ['t01'], ['t02']])
+        self.assertEqual(data['schedule']['waves'],
+                         [[['t00']], [['t01']], [['t02']]])
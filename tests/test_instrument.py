@@ -0,0 +1,142 @@
+import io
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine
+from constants import FIELD_COLUMNS
+import main
+import rc
+from instrument import Recorder
+from output import BundleSink, MemorySink, StoreSink
+from tests.util import make_database
+
+
+MODULE = '''
+import time
+
+
+def work(seconds):
+    time.sleep(seconds)
+'''
+
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.recorder = Recorder()
+
+    def tearDown(self):
+        self.recorder.disable()
+        shutil.rmtree(self.dir)
+
+    def phases(self):
+        return {phase: len(d) for phase, d in self.recorder.phases().items()}
+
+    def test_patches_modules_once_imported(self):
+        with open(os.path.join(self.dir, 'lazy_target.py'), 'w') as f:
+            f.write(MODULE)
+
+        sys.path.insert(0, self.dir)
+
+        try:
+            self.recorder.enable([('lazy_target', 'work', 'work', None),
+                                  ('missing_target', 'work', 'work', None)])
+
+            self.assertNotIn('lazy_target', sys.modules)
+
+            import lazy_target
+            lazy_target.work(0)
+
+            self.assertEqual(self.phases(), {'work': 1})
+
+            self.recorder.disable()
+            lazy_target.work(0)
+
+            self.assertEqual(self.phases(), {'work': 1})
+            self.assertNotIn(self.recorder.finder, sys.meta_path)
+        finally:
+            sys.path.remove(self.dir)
+            sys.modules.pop('lazy_target', None)
+
+    def test_sink_writes(self):
+        self.recorder.enable()
+
+        files = [('person/fields.csv', FIELD_COLUMNS,
+                  [('m', 'v', 'person', 'id', '', '')])]
+
+        MemorySink().write(files)
+        BundleSink(MemorySink(), 'flat').write(files)
+        StoreSink(os.path.join(self.dir, 'store'), 'm/v').write(files)
+
+        self.assertEqual(self.phases(), {'csv write': 3})
+        self.assertEqual(set(self.recorder.tables()), {'person'})
+
+    def test_stream_is_timed_until_consumed(self):
+        path = os.path.join(self.dir, 'redcap.sqlite')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE redcap_projects (project_id INTEGER, '
+                     'project_name TEXT)')
+        conn.execute('CREATE TABLE redcap_metadata (project_id INTEGER, '
+                     'field_order INTEGER, {})'.format(
+                         ', '.join(rc.DB_COLUMNS.values())))
+        conn.execute("INSERT INTO redcap_projects VALUES (1, 'study')")
+        conn.executemany(
+            'INSERT INTO redcap_metadata (project_id, field_order, '
+            'field_name, form_name) VALUES (1, ?, ?, ?)',
+            [(1, 'record_id', 'demographics'), (2, 'age', 'demographics')])
+        conn.commit()
+        conn.close()
+
+        self.recorder.enable()
+
+        engine = create_engine('sqlite:///{}'.format(path))
+
+        try:
+            with engine.connect() as conn:
+                fields = []
+
+                for field in rc.db_metadata(conn, 'study'):
+                    fields.append(field.field_name)
+                    time.sleep(0.05)
+        finally:
+            engine.dispose()
+
+        self.assertEqual(fields, ['record_id', 'age'])
+
+        durations = self.recorder.phases()['redcap metadata query']
+
+        self.assertEqual(len(durations), 1)
+        self.assertGreaterEqual(durations[0], 0.1)
+        self.assertEqual(dict(self.recorder.tables()['study']),
+                         {'redcap metadata query': durations[0]})
+
+    def test_profile_bundle(self):
+        url = make_database(os.path.join(self.dir, 'db.sqlite'), 3)
+        out = os.path.join(self.dir, 'out')
+        argv = ['main.py', '--profile', 'sql', 'm', 'v', 'sqlite',
+                url.database, '--dir', out, '--format=flat']
+
+        with mock.patch('sys.argv', argv), \
+                mock.patch('sys.stderr', new_callable=io.StringIO), \
+                mock.patch('instrument.Recorder.report',
+                           autospec=True) as report:
+            main.main()
+
+        self.assertIn('fields.csv', os.listdir(out))
+
+        recorder = report.call_args[0][0]
+        self.assertIn('csv write', recorder.phases())
+
+    def test_table_errors_are_ignored(self):
+        def table(args, kwargs):
+            raise TypeError
+
+        work = self.recorder.wrap(lambda: 1, 'work', table)
+
+        self.assertEqual(work(), 1)
+        self.assertEqual(self.recorder.spans[0][:2], ('work', None))
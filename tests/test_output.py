@@ -0,0 +1,218 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from constants import FIELD_COLUMNS
+from output import MemorySink, DirectorySink, ArchiveSink, BundleSink, \
+    StoreSink, open_sink, read_archive, render_csv
+
+
+def fields(table, *names):
+    "Returns the batch of a table's fields file."
+    return [(os.path.join(table, 'fields.csv'), FIELD_COLUMNS,
+             [('m', 'v', table, name, '', '') for name in names])]
+
+
+class MemorySinkTest(unittest.TestCase):
+    def test_write(self):
+        sink = MemorySink()
+        sink.write(fields('person', 'id', 'name'))
+        sink.put('manifest.json', b'{}')
+
+        self.assertEqual(sink.files, {
+            'person/fields.csv': render_csv(FIELD_COLUMNS, [
+                ('m', 'v', 'person', 'id', '', ''),
+                ('m', 'v', 'person', 'name', '', ''),
+            ]),
+            'manifest.json': b'{}',
+        })
+
+    def test_keep(self):
+        sink = MemorySink(previous={
+            'person/fields.csv': b'a',
+            'person/schema.csv': b'b',
+            'personnel/fields.csv': b'c',
+        })
+
+        sink.keep('person')
+
+        self.assertEqual(sink.read('personnel/fields.csv'), b'c')
+        self.assertEqual(sorted(sink.files),
+                         ['person/fields.csv', 'person/schema.csv'])
+
+
+class DirectorySinkTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def listing(self):
+        return sorted(os.listdir(self.dir))
+
+    def test_commit_replaces_tree(self):
+        with DirectorySink(self.root) as sink:
+            sink.write(fields('person', 'id'))
+            sink.write(fields('visit', 'id'))
+
+            # Nothing is visible until the sink is committed.
+            self.assertFalse(os.path.exists(self.root))
+
+        self.assertEqual(sorted(os.listdir(self.root)), ['person', 'visit'])
+
+        with DirectorySink(self.root) as sink:
+            sink.write(fields('site', 'id'))
+
+        self.assertEqual(os.listdir(self.root), ['site'])
+        self.assertEqual(self.listing(), ['out'])
+
+    def test_abort_keeps_previous_tree(self):
+        with DirectorySink(self.root) as sink:
+            sink.write(fields('person', 'id'))
+
+        with self.assertRaises(RuntimeError):
+            with DirectorySink(self.root) as sink:
+                sink.write(fields('visit', 'id'))
+                raise RuntimeError
+
+        self.assertEqual(os.listdir(self.root), ['person'])
+        self.assertEqual(self.listing(), ['out'])
+
+    def test_keep_links_previous_files(self):
+        with DirectorySink(self.root) as sink:
+            sink.write(fields('person', 'id'))
+            sink.write(fields('visit', 'id'))
+
+        fn = os.path.join(self.root, 'person', 'fields.csv')
+        inode = os.stat(fn).st_ino
+
+        with DirectorySink(self.root) as sink:
+            self.assertEqual(sink.read('person/fields.csv'),
+                             render_csv(FIELD_COLUMNS,
+                                        [('m', 'v', 'person', 'id', '', '')]))
+            sink.keep('person')
+            sink.keep('missing')
+
+        self.assertEqual(os.listdir(self.root), ['person'])
+        self.assertEqual(os.stat(fn).st_ino, inode)
+
+    def test_removes_dead_staging(self):
+        dead = os.path.join(self.dir, '.out.staging-99999999-0')
+        live = os.path.join(self.dir, '.out.staging-1-0')
+        os.makedirs(dead)
+        os.makedirs(live)
+
+        with mock.patch('output._alive', lambda pid: pid == 1):
+            DirectorySink(self.root).abort()
+
+        self.assertEqual(self.listing(), ['.out.staging-1-0'])
+
+    def test_sinks_of_same_root(self):
+        first = DirectorySink(self.root)
+        first.write(fields('person', 'id'))
+
+        second = DirectorySink(self.root)
+        second.write(fields('visit', 'id'))
+        second.commit()
+
+        first.commit()
+        self.assertEqual(os.listdir(self.root), ['person'])
+        self.assertEqual(self.listing(), ['out'])
+
+    def test_commit_without_exchange(self):
+        with DirectorySink(self.root) as sink:
+            sink.write(fields('person', 'id'))
+
+        with mock.patch('output._exchange', return_value=False):
+            with DirectorySink(self.root) as sink:
+                sink.write(fields('visit', 'id'))
+
+        self.assertEqual(os.listdir(self.root), ['visit'])
+        self.assertEqual(self.listing(), ['out'])
+
+
+class ArchiveSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_archives(self):
+        for name in ('out.tar', 'out.tar.gz', 'out.tgz', 'out.zip'):
+            with self.subTest(name):
+                path = os.path.join(self.dir, name)
+
+                with ArchiveSink(path) as sink:
+                    sink.write(fields('person', 'id'))
+                    sink.write(fields('visit', 'id'))
+
+                with ArchiveSink(path) as sink:
+                    sink.keep('person')
+                    sink.write(fields('site', 'id'))
+
+                files = read_archive(path)
+
+                self.assertEqual(sorted(files), ['person/fields.csv',
+                                                 'site/fields.csv'])
+                self.assertEqual(os.listdir(self.dir), [name])
+                os.remove(path)
+
+    def test_abort(self):
+        path = os.path.join(self.dir, 'out.zip')
+
+        with self.assertRaises(RuntimeError):
+            with ArchiveSink(path) as sink:
+                sink.write(fields('person', 'id'))
+                raise RuntimeError
+
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+class BundleSinkTest(unittest.TestCase):
+    def test_keep(self):
+        for format in ('flat', 'jsonl', 'sqlite'):
+            with self.subTest(format):
+                first = MemorySink()
+
+                with BundleSink(first, format) as sink:
+                    sink.write(fields('person', 'id', 'name'))
+                    sink.write(fields('visit', 'id'))
+
+                second = MemorySink(previous=first.files)
+
+                with BundleSink(second, format) as sink:
+                    sink.keep('person')
+                    sink.write(fields('site', 'id'))
+
+                rows = BundleSink(MemorySink(second.files), format).load()
+
+                self.assertEqual(
+                    [row[2:4] for row in rows['fields']],
+                    [('person', 'id'), ('person', 'name'), ('site', 'id')])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            BundleSink(MemorySink(), 'xml')
+
+
+class OpenSinkTest(unittest.TestCase):
+    def test_backends(self):
+        dirname = tempfile.mkdtemp()
+
+        try:
+            for path, format, store, cls in (
+                    ('out', 'tree', None, DirectorySink),
+                    ('out.tgz', 'tree', None, ArchiveSink),
+                    ('out', 'tree', 'store', StoreSink),
+                    ('out.zip', 'jsonl', None, BundleSink)):
+                sink = open_sink(os.path.join(dirname, path), format,
+                                 store and os.path.join(dirname, store))
+                sink.abort()
+
+                self.assertIsInstance(sink, cls)
+        finally:
+            shutil.rmtree(dirname)
@@ -0,0 +1,162 @@
+import io
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import rc
+from output import BlobStore, MemorySink, open_sink
+from store import materialize
+from tests.util import rows
+
+
+def field(name, form, field_type='text'):
+    return rc.field_from_row([name, form, '', field_type, name.title()])
+
+
+def read(sink, path):
+    return list(csv.DictReader(io.StringIO(sink.files[path].decode('utf8'))))
+
+
+# Fields of two forms, the first of which comes again after the second.
+INTERLEAVED = [
+    field('record_id', 'demographics'),
+    field('age', 'demographics'),
+    field('visit_date', 'visit'),
+    field('sex', 'demographics'),
+    field('weight', 'visit'),
+]
+
+
+class GroupFormsTest(unittest.TestCase):
+    def test_runs(self):
+        groups = [(form, [f.field_name for f in fields])
+                  for form, fields in rc.group_forms(iter(INTERLEAVED))]
+
+        self.assertEqual(groups, [
+            ('demographics', ['record_id', 'age']),
+            ('visit', ['visit_date']),
+            ('demographics', ['sex']),
+            ('visit', ['weight']),
+        ])
+
+    def test_streams(self):
+        consumed = []
+
+        def records():
+            for f in INTERLEAVED:
+                consumed.append(f.field_name)
+                yield f
+
+        groups = rc.group_forms(records())
+        form, fields = next(groups)
+
+        self.assertEqual(form, 'demographics')
+        self.assertEqual(next(fields).field_name, 'record_id')
+        self.assertEqual(consumed, ['record_id'])
+
+
+class FieldColumnsTest(unittest.TestCase):
+    def columns(self, choices):
+        f = rc.field_from_row(['color', 'f', '', 'checkbox', 'Color',
+                               choices])
+        return [(name, schema[0])
+                for name, _, _, schema in rc.get_field_columns(f)]
+
+    def test_checkbox(self):
+        self.assertEqual(self.columns('1, Red | 2, Blue'),
+                         [('color___1', 'boolean'), ('color___2', 'boolean')])
+
+    def test_unparsed_checkbox(self):
+        for choices in ('Red | Blue', '', None):
+            with self.subTest(choices):
+                self.assertEqual(self.columns(choices), [('color', 'string')])
+
+
+class GenerateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_interleaved_forms(self):
+        sink = MemorySink()
+        rc.generate(iter(INTERLEAVED), 'study', 'v1', sink)
+
+        self.assertEqual(
+            [row['field'] for row in read(sink, 'demographics/fields.csv')],
+            ['record_id', 'age', 'sex'])
+        self.assertEqual(
+            [row['field'] for row in read(sink, 'visit/schema.csv')],
+            ['visit_date', 'weight'])
+        self.assertEqual(
+            [row['table'] for row in read(sink, 'tables.csv')],
+            ['demographics', 'visit'])
+
+    def test_outputs(self):
+        contiguous = os.path.join(self.dir, 'contiguous')
+
+        with open_sink(contiguous) as sink:
+            rc.generate(sorted(INTERLEAVED, key=lambda f: f.form_name),
+                        'study', 'v1', sink)
+
+        expected = rows(contiguous)
+
+        for name, format, store in (
+                ('tree', 'tree', False),
+                ('out.zip', 'tree', False),
+                ('out.tar.gz', 'tree', False),
+                ('flat', 'flat', False),
+                ('jsonl', 'jsonl', False),
+                ('store', 'tree', True)):
+            with self.subTest(name):
+                path = os.path.join(self.dir, name)
+                root = os.path.join(self.dir, 'blobs') if store else None
+
+                with open_sink(name if store else path, format, root,
+                               'gzip') as sink:
+                    rc.generate(iter(INTERLEAVED), 'study', 'v1', sink)
+
+                if store:
+                    materialize(BlobStore(root), name, path)
+
+                self.assertEqual(rows(path), expected)
+
+    def test_incremental(self):
+        path = os.path.join(self.dir, 'tree')
+
+        with open_sink(path) as sink:
+            rc.generate(iter(INTERLEAVED[:3]), 'study', 'v1', sink)
+
+        kept = os.path.join(path, 'demographics', 'fields.csv')
+
+        with open(kept, 'rb') as f:
+            before = f.read()
+
+        # The first run of demographics is kept from the previous output
+        # and the later fields are appended to a copy of its files.
+        with self.assertRaises(RuntimeError):
+            with open_sink(path) as sink:
+                rc.generate(iter(INTERLEAVED), 'study', 'v1', sink,
+                            incremental=True)
+                raise RuntimeError
+
+        with open(kept, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+        def changes():
+            with open_sink(path) as sink, \
+                    mock.patch('manifest.report') as report:
+                rc.generate(iter(INTERLEAVED), 'study', 'v1', sink,
+                            incremental=True)
+
+            return {status: tables for status, tables in
+                    report.call_args[0][0].items() if tables}
+
+        self.assertEqual(changes(), {'changed': ['demographics', 'visit']})
+        self.assertEqual(changes(), {'unchanged': ['demographics', 'visit']})
+        self.assertEqual(
+            [dict(row)['field'] for row in rows(path)['fields']],
+            ['age', 'record_id', 'sex', 'visit_date', 'weight'])
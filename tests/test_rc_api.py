@@ -0,0 +1,130 @@
+import os
+import csv
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+import rc_api
+from tests.util import rows
+
+
+def metadata(form, *names):
+    return [{'field_name': name, 'form_name': form, 'field_type': 'text',
+             'field_label': name.title()} for name in names]
+
+
+# Metadata served per token.
+PROJECTS = {
+    'alpha': metadata('demographics', 'record_id', 'age'),
+    'beta': metadata('visit', 'visit_id', 'visit_date'),
+}
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    "Serves the metadata endpoint of the REDCap API."
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        form = parse_qs(self.rfile.read(length).decode('utf8'))
+        token = form['token'][0]
+
+        self.server.requests.append((token, form['content'][0]))
+
+        # The first request of each token is throttled.
+        if self.server.requests.count((token, 'metadata')) == 1:
+            return self.reply(503, {'error': 'busy'})
+
+        if token not in PROJECTS:
+            return self.reply(403, {'error': 'invalid token'})
+
+        self.reply(200, PROJECTS[token])
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ApiBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.url = 'http://127.0.0.1:{}/api/'.format(self.server.server_port)
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.dir)
+
+    def entries(self, *tokens):
+        return [{'model': token, 'version': 'v1', 'url': self.url,
+                 'token': token} for token in tokens]
+
+    def test_export_retries(self):
+        report = rc_api.export(self.entries('alpha', 'beta', 'gamma'),
+                               self.dir, 2, retries=2, backoff=0)
+
+        self.assertEqual([row[:3] for row in report], [
+            ('alpha', 'ok', 2),
+            ('beta', 'ok', 2),
+            ('gamma', 'failed', ''),
+        ])
+        self.assertIn('403', report[2][4])
+
+        # Each token is retried once after it is throttled and the invalid
+        # one is not retried after that.
+        for token in ('alpha', 'beta', 'gamma'):
+            self.assertEqual(
+                self.server.requests.count((token, 'metadata')), 2)
+
+        fields = rows(os.path.join(self.dir, 'alpha', 'v1'))['fields']
+        self.assertEqual([dict(f)['field'] for f in fields],
+                         ['age', 'record_id'])
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'gamma')))
+
+    def test_export_gives_up(self):
+        report = rc_api.export(self.entries('alpha'), self.dir, 1,
+                               retries=0, backoff=0)
+
+        self.assertEqual(report[0][:2], ('alpha', 'failed'))
+        self.assertIn('503', report[0][4])
+
+    def test_main(self):
+        manifest = os.path.join(self.dir, 'tokens.csv')
+        report = os.path.join(self.dir, 'report.csv')
+        store = os.path.join(self.dir, 'store')
+
+        with open(manifest, 'w') as f:
+            w = csv.DictWriter(f, rc_api.MANIFEST_COLUMNS)
+            w.writeheader()
+            w.writerows(self.entries('alpha', 'beta'))
+
+        rc_api.main(['apibatch', manifest, '--dir', self.dir, '--workers=2',
+                     '--backoff=0', '--report', report, '--store', store])
+
+        with open(report) as f:
+            self.assertEqual([(r['project'], r['status'])
+                              for r in csv.DictReader(f)],
+                             [('alpha', 'ok'), ('beta', 'ok')])
+
+        self.assertTrue(os.path.isdir(os.path.join(store, 'blobs')))
@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import sql
+from journal import Journal, default_path
+from output import open_sink, BlobStore
+from store import materialize
+from tests.util import make_database, rows
+
+
+class Crash(BaseException):
+    "Stands for the process dying, so nothing catches it."
+
+
+class ResumeTest(unittest.TestCase):
+    # (output name, format, whether it is written to a blob store)
+    SINKS = (
+        ('tree', 'tree', False),
+        ('model.tar.gz', 'tree', False),
+        ('model.zip', 'tree', False),
+        ('flat', 'flat', False),
+        ('jsonl.tar', 'jsonl', False),
+        ('store', 'tree', True),
+    )
+
+    TABLES = 12
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = sql.connect(make_database(
+            os.path.join(self.dir, 'db.sqlite'), self.TABLES), 2)
+        self.store = os.path.join(self.dir, 'store')
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def run_generate(self, name, format, store, journal=None, **kwargs):
+        with open_sink(name, format, self.store if store else None,
+                       'gzip') as sink:
+            return sql.generate(self.engine, 'm', 'v', sink, workers=2,
+                                journal=journal, **kwargs)
+
+    def target(self, prefix, name, store):
+        "Returns the path of an output, or its name in the blob store."
+        if store:
+            return '{}/{}'.format(prefix, name)
+
+        return os.path.join(self.dir, prefix, name)
+
+    def output(self, name, store):
+        "Returns the rows of an output, materialized if it is in the store."
+        if store:
+            path = os.path.join(self.dir, 'materialized', name)
+            materialize(BlobStore(self.store), name, path)
+            return rows(path)
+
+        return rows(name)
+
+    def crash_after(self, n):
+        "Patches table file generation to crash after n tables."
+        table_files = sql.table_files
+        calls = []
+
+        def crash(*args):
+            if len(calls) == n:
+                raise Crash
+
+            calls.append(args)
+
+            return table_files(*args)
+
+        return mock.patch('sql.table_files', side_effect=crash)
+
+    def test_resume(self):
+        for name, format, store in self.SINKS:
+            with self.subTest(output=name):
+                clean = self.target('clean', name, store)
+                path = self.target('out', name, store)
+
+                self.run_generate(clean, format, store)
+                expected = self.output(clean, store)
+
+                journal_path = default_path(
+                    path, self.store if store else None)
+
+                journal = Journal(journal_path, 'm', 'v')
+
+                with self.crash_after(5), self.assertRaises(Crash):
+                    self.run_generate(path, format, store, journal)
+
+                journal.close()
+
+                # Nothing of the interrupted run is visible.
+                if store:
+                    self.assertIsNone(BlobStore(self.store).load(path))
+                    self.assertEqual(os.listdir(
+                        os.path.join(self.store, 'staging')), [])
+                else:
+                    self.assertFalse(os.path.exists(path))
+
+                journal = Journal(journal_path, 'm', 'v', resume=True)
+
+                with mock.patch('sql.table_files',
+                                wraps=sql.table_files) as table_files:
+                    errors = self.run_generate(path, format, store, journal)
+
+                journal.remove()
+
+                self.assertEqual(errors, [])
+                self.assertEqual(table_files.call_count, self.TABLES - 5)
+                self.assertEqual(self.output(path, store), expected)
+
+    def test_resume_failed_tables(self):
+        path = os.path.join(self.dir, 'out', 'model.tar.gz')
+        journal_path = default_path(path)
+        table_files = sql.table_files
+
+        def fail(model, version, info, typemap):
+            if info['name'] in ('t03', 't07'):
+                raise ValueError('lost')
+
+            return table_files(model, version, info, typemap)
+
+        journal = Journal(journal_path, 'm', 'v')
+
+        with mock.patch('sql.table_files', side_effect=fail):
+            errors = self.run_generate(path, 'tree', False, journal)
+
+        journal.close()
+
+        self.assertEqual(sorted(table for table, _ in errors), ['t03', 't07'])
+
+        journal = Journal(journal_path, 'm', 'v', resume=True)
+
+        with mock.patch('sql.table_files', wraps=sql.table_files) as calls:
+            errors = self.run_generate(path, 'tree', False, journal)
+
+        journal.remove()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(c[0][2]['name'] for c in calls.call_args_list),
+                         ['t03', 't07'])
+
+        clean = os.path.join(self.dir, 'clean')
+        self.run_generate(clean, 'tree', False)
+        self.assertEqual(rows(path), rows(clean))
+
+    def test_incremental_archive_keeps_tables(self):
+        path = os.path.join(self.dir, 'model.zip')
+
+        self.run_generate(path, 'tree', False)
+        expected = rows(path)
+
+        with mock.patch('sql.table_files', wraps=sql.table_files) as calls:
+            self.run_generate(path, 'tree', False, incremental=True)
+
+        self.assertEqual(calls.call_count, 0)
+        self.assertEqual(rows(path), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
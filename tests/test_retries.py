@@ -0,0 +1,53 @@
+import unittest
+from unittest import mock
+from sqlalchemy import exc
+from reflect import with_retries, first_line
+
+
+class RetriesTest(unittest.TestCase):
+    def flaky(self, *errors):
+        "Returns a function raising the errors in turn, then returning ok."
+        errors = list(errors)
+
+        def func():
+            if errors:
+                raise errors.pop(0)
+
+            return 'ok'
+
+        return func
+
+    @mock.patch('time.sleep')
+    def test_retries_transient_errors_with_backoff(self, sleep):
+        func = with_retries(self.flaky(exc.TimeoutError(),
+                                       ConnectionError('reset')),
+                            retries=3, backoff=2)
+
+        self.assertEqual(func(), 'ok')
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [2, 4])
+
+    @mock.patch('time.sleep')
+    def test_gives_up_after_retries(self, sleep):
+        func = with_retries(self.flaky(*[exc.TimeoutError()] * 3), retries=2)
+
+        with self.assertRaises(exc.TimeoutError):
+            func()
+
+        self.assertEqual(sleep.call_count, 2)
+
+    @mock.patch('time.sleep')
+    def test_other_errors_are_not_retried(self, sleep):
+        func = with_retries(self.flaky(ValueError('bad query')), retries=3)
+
+        with self.assertRaises(ValueError):
+            func()
+
+        sleep.assert_not_called()
+
+    def test_first_line(self):
+        self.assertEqual(first_line(ValueError('a\nb')), 'a')
+        self.assertEqual(first_line(ConnectionError()), 'ConnectionError()')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from serve import Server
+from tests.util import make_database, rows
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.url = make_database(os.path.join(self.dir, 'db.sqlite'), 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @mock.patch('sql.connect')
+    def test_engines_are_sized_for_concurrent_jobs(self, connect):
+        server = Server(jobs=4, workers=2)
+
+        try:
+            first = server.engine(self.url, 2)
+
+            self.assertIs(server.engine(self.url, 2), first)
+            connect.assert_called_once_with(self.url, 8)
+
+            server.engine(self.url, 5)
+            connect.assert_called_with(self.url, 20)
+            self.assertEqual(connect.call_count, 2)
+        finally:
+            server.executor.shutdown()
+
+    def test_concurrent_jobs_share_an_engine(self):
+        server = Server(jobs=3, workers=2)
+        jobs = [{
+            'id': i,
+            'command': 'sql',
+            'model': 'm',
+            'version': 'v',
+            'engine': 'sqlite',
+            'database': self.url.database,
+            'dir': os.path.join(self.dir, str(i)),
+        } for i in range(3)]
+
+        try:
+            results = [f.result() for f in map(server.submit, jobs)]
+        finally:
+            server.close()
+
+        self.assertEqual([r['status'] for r in results], ['ok'] * 3)
+        self.assertEqual(len(server.engines), 1)
+        self.assertEqual(rows(results[0]['dir']), rows(results[2]['dir']))
+
+
+if __name__ == '__main__':
+    unittest.main()
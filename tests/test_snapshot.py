@@ -0,0 +1,139 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import sql
+from reflect import name_filter, replay_catalog, schema_names
+from output import open_sink
+from snapshot import Snapshot, capture
+from tests.util import make_database, rows
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures',
+                       'oracle_catalog.jsonl')
+
+
+class OracleFixtureTest(unittest.TestCase):
+    "Replays catalog rows recorded from Oracle without a database."
+    def setUp(self):
+        self.tables = {t['name']: t for t in Snapshot(FIXTURE).tables}
+
+    def test_names(self):
+        self.assertEqual(sorted(self.tables),
+                         ['hr.dept', 'hr.site', 'person', 'visit'])
+
+        visit = self.tables['visit']
+
+        self.assertEqual([c['name'] for c in visit['columns']],
+                         ['id', 'person_id', 'site_id', 'MixedCase'])
+        self.assertEqual(visit['primary_key'],
+                         {'name': 'pk_visit', 'constrained_columns': ['id']})
+
+    def test_types(self):
+        columns = {c['name']: c for c in self.tables['person']['columns']}
+
+        self.assertEqual(columns['name']['type'].length, 40)
+        self.assertEqual((columns['amt']['type'].precision,
+                          columns['amt']['type'].scale), (10, 2))
+        self.assertFalse(columns['name']['nullable'])
+        self.assertTrue(columns['amt']['nullable'])
+
+    def test_references_name_tables_alike(self):
+        refs = {r['name']: r for r in self.tables['visit']['foreign_keys']}
+
+        self.assertEqual(refs['fk_person']['referred_schema'], None)
+        self.assertEqual(refs['fk_person']['referred_table'], 'person')
+        self.assertEqual(refs['fk_site']['referred_schema'], 'hr')
+        self.assertEqual(refs['fk_site']['referred_table'], 'hr.site')
+
+        ref, = self.tables['hr.site']['foreign_keys']
+        self.assertEqual(ref['referred_schema'], None)
+        self.assertEqual(ref['referred_table'], 'hr.dept')
+
+        for table in self.tables.values():
+            for ref in table['foreign_keys']:
+                self.assertIn(ref['referred_table'], self.tables)
+
+    def test_uppercase_schema(self):
+        with open(FIXTURE) as f:
+            lines = [json.loads(line) for line in f]
+
+        tables = replay_catalog('oracle', 'HR', lines[2]['rows'],
+                                default='scott')
+
+        self.assertEqual([t['name'] for t in tables], ['hr.dept', 'hr.site'])
+        self.assertEqual(tables[1]['foreign_keys'][0]['referred_table'],
+                         'hr.dept')
+
+    def test_schema_names(self):
+        from sqlalchemy.engine.url import make_url
+
+        oracle = make_url('oracle://').get_dialect()()
+        sqlite = make_url('sqlite://').get_dialect()()
+
+        self.assertEqual(schema_names(oracle, ['HR', 'hr', 'Mixed']),
+                         ['hr', 'hr', 'Mixed'])
+        self.assertEqual(schema_names(sqlite, ['HR']), ['HR'])
+        self.assertIsNone(schema_names(oracle, None))
+
+    def test_generate(self):
+        dirname = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(dirname, 'out')
+
+            with open_sink(path) as sink:
+                errors = sql.generate(Snapshot(FIXTURE), 'm', 'v', sink)
+
+            self.assertEqual(errors, [])
+
+            refs = {(r['table'], r['field']): r['ref_table']
+                    for r in map(dict, rows(path)['references'])}
+
+            self.assertEqual(refs[('visit', 'site_id')], 'hr.site')
+            self.assertEqual(refs[('hr.site', 'dept_id')], 'hr.dept')
+        finally:
+            shutil.rmtree(dirname)
+
+
+class RawSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = sql.connect(make_database(
+            os.path.join(self.dir, 'db.sqlite'), 6), 2)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def generate(self, source, name):
+        path = os.path.join(self.dir, name)
+
+        with open_sink(path) as sink:
+            self.assertEqual(sql.generate(source, 'm', 'v', sink), [])
+
+        return rows(path)
+
+    def test_raw_matches_reflection(self):
+        path = os.path.join(self.dir, 'raw.jsonl.gz')
+        capture(self.engine, path, raw=True)
+
+        self.assertEqual(self.generate(Snapshot(path), 'replayed'),
+                         self.generate(self.engine, 'reflected'))
+
+    def test_raw_match(self):
+        match = name_filter(['t0[1-3]'], ['t02'])
+        path = os.path.join(self.dir, 'raw.jsonl')
+
+        capture(self.engine, path, raw=True, match=match)
+
+        snapshot = Snapshot(path)
+
+        self.assertEqual([t['name'] for t in snapshot.tables], ['t01', 't03'])
+
+        with open(path) as f:
+            recorded = json.loads(f.readlines()[1])['rows']
+
+        for key, key_rows in recorded.items():
+            self.assertEqual({row[0] for row in key_rows}, {'t01', 't03'},
+                             key)
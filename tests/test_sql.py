@@ -0,0 +1,62 @@
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+import sql
+from output import open_sink
+from tests.util import make_database, rows
+
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = sql.connect(make_database(
+            os.path.join(self.dir, 'db.sqlite'), 4), 2)
+        self.path = os.path.join(self.dir, 'out')
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def run_generate(self):
+        with open_sink(self.path) as sink, \
+                mock.patch('manifest.report') as report:
+            errors = sql.generate(self.engine, 'm', 'v', sink, workers=2,
+                                  incremental=True)
+
+        return errors, report.call_args[0][0]
+
+    def test_failed_table_is_kept(self):
+        self.run_generate()
+        expected = rows(self.path)
+
+        # The changed table is reflected again rather than kept by its
+        # version token, and fails.
+        conn = sqlite3.connect(os.path.join(self.dir, 'db.sqlite'))
+        conn.execute('ALTER TABLE t01 ADD COLUMN extra INTEGER')
+        conn.commit()
+        conn.close()
+
+        fingerprint = sql.table_fingerprint
+
+        def fail(info):
+            if info['name'] == 't01':
+                raise ValueError('lost')
+
+            return fingerprint(info)
+
+        with mock.patch('sql.table_fingerprint', side_effect=fail):
+            errors, changes = self.run_generate()
+
+        self.assertEqual([table for table, _ in errors], ['t01'])
+        self.assertEqual(sorted(changes['unchanged']),
+                         ['t00', 't01', 't02', 't03'])
+        self.assertEqual(changes['removed'], [])
+
+        self.assertEqual(rows(self.path), expected)
+
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            self.assertIn('t01', json.load(f)['tables'])
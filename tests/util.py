@@ -0,0 +1,31 @@
+import os
+import sqlite3
+from sqlalchemy.engine.url import make_url
+from diff import load
+
+
+def make_database(path, tables=12):
+    """Creates a SQLite database of tables each referring to the previous
+    one and returns its URL."""
+    conn = sqlite3.connect(path)
+
+    for i in range(tables):
+        ref = ', parent_id INTEGER REFERENCES t{:02d} (id)'.format(i - 1) \
+            if i else ''
+
+        conn.execute('CREATE TABLE t{:02d} (id INTEGER PRIMARY KEY, '
+                     'name VARCHAR(20) NOT NULL, amount NUMERIC(10, 2){})'
+                     .format(i, ref))
+        conn.execute('CREATE INDEX ix_t{0:02d}_name ON t{0:02d} (name)'
+                     .format(i))
+
+    conn.commit()
+    conn.close()
+
+    return make_url('sqlite:///{}'.format(os.path.abspath(path)))
+
+
+def rows(path):
+    "Returns the rows of a generated model in any format, in a stable order."
+    return {entity: sorted(sorted(row.items()) for row in entity_rows)
+            for entity, entity_rows in load(path).items()}
@@ -0,0 +1,173 @@
+import sys
+from collections import Counter
+from sqlalchemy import types
+
+
+def oracle_number(typ):
+    "NUMBER is used for integers as well as decimals in Oracle."
+    if typ.scale == 0:
+        return 'integer'
+
+    return 'number'
+
+
+# Data model types by SQLAlchemy type class. A type that is not listed
+# resolves to its nearest listed base class. Entries may be a function of
+# the type instance for types whose mapping depends on their parameters.
+TYPES = {
+    types.Integer: 'integer',
+    types.Boolean: 'boolean',
+    types.Date: 'date',
+    types.DateTime: 'datetime',
+    types.Time: 'time',
+    types.Interval: 'string',
+    types.Float: 'number',
+    types.Numeric: 'number',
+    types._Binary: 'bytes',
+    types.String: 'string',
+    types.Enum: 'string',
+}
+
+# Dialect-specific types by dialect module. Names are looked up so
+# releases of SQLAlchemy without some of them still work. A dialect's types
+# are registered once its module has been loaded, which it must be for
+# columns of those types to exist, so no dialect is imported up front.
+DIALECT_TYPES = (
+    ('sqlalchemy.dialects.postgresql', {
+        'UUID': 'string',
+        'JSON': 'string',
+        'JSONB': 'string',
+        'HSTORE': 'string',
+        'ARRAY': 'string',
+        'INTERVAL': 'string',
+        'INET': 'string',
+        'CIDR': 'string',
+        'MACADDR': 'string',
+        'TSVECTOR': 'string',
+        'OID': 'integer',
+        'MONEY': 'number',
+        'BIT': 'string',
+    }),
+    ('sqlalchemy.dialects.oracle', {
+        'NUMBER': oracle_number,
+        'BINARY_DOUBLE': 'number',
+        'BINARY_FLOAT': 'number',
+        'RAW': 'bytes',
+        'BFILE': 'bytes',
+        'LONG': 'string',
+        'ROWID': 'string',
+        'INTERVAL': 'string',
+    }),
+    ('sqlalchemy.dialects.mysql', {
+        'YEAR': 'integer',
+        'BIT': 'integer',
+        'SET': 'string',
+        'ENUM': 'string',
+        'JSON': 'string',
+    }),
+)
+
+_registered = set()
+
+
+def register_dialects():
+    "Adds the types of the dialect modules loaded so far to TYPES."
+    for module, entries in DIALECT_TYPES:
+        if module in _registered or module not in sys.modules:
+            continue
+
+        _registered.add(module)
+
+        for name, dm_type in entries.items():
+            cls = getattr(sys.modules[module], name, None)
+
+            if cls is not None:
+                TYPES[cls] = dm_type
+
+
+class TypeMap:
+    """Resolves SQLAlchemy types to data model types.
+
+    The entry for each concrete type class is found by walking its MRO
+    once and memoized, so resolving a column is a dict lookup. Types
+    without an entry resolve to the fallback and are counted so they can
+    be reported.
+    """
+    def __init__(self, fallback='string', registry=None):
+        self.fallback = fallback
+        self.registry = TYPES if registry is None else registry
+        self.cache = {}
+        self.unmapped = Counter()
+
+    def lookup(self, cls):
+        "Returns the entry of the nearest registered class in the MRO."
+        if self.registry is TYPES:
+            register_dialects()
+
+        for base in cls.__mro__:
+            if base in self.registry:
+                return self.registry[base]
+
+    def resolve(self, typ):
+        "Returns the data model type of a type instance."
+        cls = type(typ)
+
+        try:
+            entry = self.cache[cls]
+        except KeyError:
+            entry = self.cache[cls] = self.lookup(cls)
+
+        if entry is None:
+            self.unmapped[cls.__name__] += 1
+            return self.fallback
+
+        if callable(entry):
+            return entry(typ)
+
+        return entry
+
+    def report(self, file=sys.stderr):
+        "Prints the types that had no mapping and their column counts."
+        if not self.unmapped:
+            return
+
+        print('unmapped types (written as {!r}):'.format(self.fallback),
+              file=file)
+
+        for name, count in self.unmapped.most_common():
+            print('  {} ({} columns)'.format(name, count), file=file)
+
+
+def _number(length, precision, scale):
+    if precision is None:
+        return types.Numeric()
+
+    return types.Numeric(precision, scale)
+
+
+def _string(length, precision, scale):
+    if length is None:
+        return types.Text()
+
+    return types.String(length)
+
+
+# SQLAlchemy types by data model type, as functions of the length,
+# precision and scale of a field, for writing a model back as DDL.
+MODEL_TYPES = {
+    'integer': lambda *params: types.Integer(),
+    'boolean': lambda *params: types.Boolean(create_constraint=False),
+    'date': lambda *params: types.Date(),
+    'datetime': lambda *params: types.DateTime(),
+    'time': lambda *params: types.Time(),
+    'number': _number,
+    'bytes': lambda *params: types.LargeBinary(),
+    'string': _string,
+}
+
+
+def model_type(name, length=None, precision=None, scale=None):
+    """Returns a type instance for a data model type. Unknown types are
+    text."""
+    entry = MODEL_TYPES.get(name, _string)
+    return entry(length, precision, scale)